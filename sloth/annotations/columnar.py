@@ -0,0 +1,333 @@
+"""
+The columnar module stores the rectangle and point annotations of a label set
+in a structured numpy array, one row per annotation.  Bulk operations such as
+statistics, filtering or export can then be computed on whole columns instead
+of looping over the annotation dicts.
+
+``AnnotationTable.fromFileItems(fileitems, attach=True)`` additionally replaces
+the annotation dicts in the file items by ``AnnotationRecord`` objects, which
+provide the usual mapping interface on top of a row of the table.  The
+annotation model uses them like annotation dicts, and changes made in the GUI
+are written to the table.
+"""
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+import numpy as np
+
+
+class AnnotationRecord(MutableMapping):
+    """
+    Mapping view of one annotation of an ``AnnotationTable``.  Values which
+    cannot be stored in the columns of the table are kept in a dict per
+    annotation.  Copies and pickles of a record are plain dicts.
+    """
+    __slots__ = ('_table', '_row')
+
+    # The annotation model writes to the record instead of copying it
+    writable_view = True
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def row(self):
+        """The row of the annotation in the table."""
+        return self._row
+
+    def table(self):
+        return self._table
+
+    def __getitem__(self, key):
+        return self._table._get(self._row, key)
+
+    def __setitem__(self, key, value):
+        self._table._set(self._row, key, value)
+
+    def __delitem__(self, key):
+        self._table._delete(self._row, key)
+
+    def __iter__(self):
+        return iter(self._table._keys(self._row))
+
+    def __len__(self):
+        return len(self._table._keys(self._row))
+
+    def __reduce__(self):
+        return (dict, (dict(self), ))
+
+    def __repr__(self):
+        return "AnnotationRecord(%r)" % dict(self)
+
+
+class AnnotationTable(object):
+    """
+    Columnar storage of annotations.  The structured array ``data`` has the
+    columns
+
+    * ``file``: index of the file item in the label set
+    * ``frame``: index of the frame in the video, -1 for images
+    * ``class``: index into ``classes``, -1 if the annotation has no class
+    * ``x``, ``y``, ``width``, ``height``: the coordinates, NaN if not set
+    * ``flags``: ``UNLABELED`` and ``UNCONFIRMED``, and which coordinates
+      are integers
+
+    Coordinates which are not numbers, e.g. strings, and all other keys are
+    stored in a dict per annotation.
+    """
+
+    dtype = np.dtype([('file', '<i4'), ('frame', '<i4'), ('class', '<i4'),
+                      ('x', '<f8'), ('y', '<f8'), ('width', '<f8'), ('height', '<f8'),
+                      ('flags', 'u1')])
+    coordinates = ('x', 'y', 'width', 'height')
+
+    UNLABELED = 0x10
+    UNCONFIRMED = 0x20
+    _flag_keys = {'unlabeled': UNLABELED, 'unconfirmed': UNCONFIRMED}
+    _int_flags = dict((key, 1 << i) for i, key in enumerate(coordinates))
+
+    def __init__(self, data=None, classes=(), extras=None):
+        if data is None:
+            data = np.zeros(0, dtype=self.dtype)
+        self.data = data
+        self.classes = list(classes)
+        self._class_ids = dict((c, i) for i, c in enumerate(self.classes))
+        self._extras = extras if extras is not None else [None] * len(data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def classId(self, name, add=False):
+        """
+        Return the index of the class ``name``, or -1 if it is unknown.  If
+        ``add`` is True, unknown classes are added.
+        """
+        cid = self._class_ids.get(name)
+        if cid is None:
+            if not add:
+                return -1
+            cid = len(self.classes)
+            self.classes.append(name)
+            self._class_ids[name] = cid
+        return cid
+
+    def className(self, cid):
+        """Return the class with the index ``cid``, or None for -1."""
+        if cid < 0:
+            return None
+        return self.classes[cid]
+
+    @classmethod
+    def _isColumnClass(cls, value):
+        try:
+            hash(value)
+        except TypeError:
+            return False
+        return value is not None
+
+    @classmethod
+    def fromFileItems(cls, fileitems, attach=False):
+        """
+        Create a table of all annotations of the file items.  Returns the
+        table and the list of file items.  If ``attach`` is True, the
+        annotations of the file items are replaced in place by
+        ``AnnotationRecord`` views of the table.
+        """
+        fileitems = list(fileitems)
+        table = cls()
+        rows = []
+        for fileno, fileitem in enumerate(fileitems):
+            if fileitem.get('class') == 'video':
+                frames = fileitem.get('frames', [])
+            else:
+                frames = [fileitem]
+            for frameno, frame in enumerate(frames):
+                if frame is fileitem:
+                    frameno = -1
+                for ann in frame.get('annotations', []):
+                    rows.append(table._makeRow(fileno, frameno, ann))
+        table.data = np.array(rows, dtype=cls.dtype)
+
+        if attach:
+            row = 0
+            for fileitem in fileitems:
+                if fileitem.get('class') == 'video':
+                    frames = fileitem.get('frames', [])
+                else:
+                    frames = [fileitem]
+                for frame in frames:
+                    n = len(frame.get('annotations', []))
+                    if n > 0:
+                        frame['annotations'] = [AnnotationRecord(table, r) for r in range(row, row + n)]
+                    row += n
+        return table, fileitems
+
+    def _makeRow(self, fileno, frameno, ann):
+        """
+        Split the annotation ``ann`` into a row tuple of the table and the
+        extra values, which are appended to the extra dicts.
+        """
+        extra = {}
+        cid = -1
+        coords = [np.nan] * 4
+        flags = 0
+        for key, value in ann.items():
+            if key == 'class' and self._isColumnClass(value):
+                cid = self.classId(value, add=True)
+            elif key in self._int_flags and type(value) in (float, int) and value == value:
+                coords[self.coordinates.index(key)] = value
+                if type(value) is int:
+                    flags |= self._int_flags[key]
+            elif key in self._flag_keys and value is True:
+                flags |= self._flag_keys[key]
+            else:
+                extra[key] = value
+        self._extras.append(extra or None)
+        return (fileno, frameno, cid, coords[0], coords[1], coords[2], coords[3], flags)
+
+    def record(self, row):
+        """Return a mapping view of the annotation in ``row``."""
+        return AnnotationRecord(self, row)
+
+    def annotation(self, row):
+        """Return the annotation in ``row`` as dict."""
+        return dict(AnnotationRecord(self, row))
+
+    def _get(self, row, key):
+        extra = self._extras[row]
+        if extra is not None and key in extra:
+            return extra[key]
+        r = self.data[row]
+        if key == 'class':
+            if r['class'] >= 0:
+                return self.classes[r['class']]
+        elif key in self._int_flags:
+            value = float(r[key])
+            if value == value:
+                if r['flags'] & self._int_flags[key]:
+                    return int(value)
+                return value
+        elif key in self._flag_keys:
+            if r['flags'] & self._flag_keys[key]:
+                return True
+        raise KeyError(key)
+
+    def _keys(self, row):
+        r = self.data[row]
+        keys = []
+        if r['class'] >= 0:
+            keys.append('class')
+        for key in self.coordinates:
+            if r[key] == r[key]:
+                keys.append(key)
+        for key, flag in self._flag_keys.items():
+            if r['flags'] & flag:
+                keys.append(key)
+        extra = self._extras[row]
+        if extra is not None:
+            keys.extend(extra.keys())
+        return keys
+
+    def _delete(self, row, key, missing_ok=False):
+        found = False
+        extra = self._extras[row]
+        if extra is not None and key in extra:
+            del extra[key]
+            if not extra:
+                self._extras[row] = None
+            found = True
+        r = self.data[row:row + 1]
+        if key == 'class' and r['class'][0] >= 0:
+            r['class'] = -1
+            found = True
+        elif key in self._int_flags and r[key][0] == r[key][0]:
+            r[key] = np.nan
+            r['flags'] &= ~self._int_flags[key] & 0xff
+            found = True
+        elif key in self._flag_keys and r['flags'][0] & self._flag_keys[key]:
+            r['flags'] &= ~self._flag_keys[key] & 0xff
+            found = True
+        if not found and not missing_ok:
+            raise KeyError(key)
+
+    def _set(self, row, key, value):
+        self._delete(row, key, missing_ok=True)
+        r = self.data[row:row + 1]
+        if key == 'class' and self._isColumnClass(value):
+            r['class'] = self.classId(value, add=True)
+        elif key in self._int_flags and type(value) in (float, int) and value == value:
+            r[key] = value
+            if type(value) is int:
+                r['flags'] |= self._int_flags[key]
+        elif key in self._flag_keys and value is True:
+            r['flags'] |= self._flag_keys[key]
+        else:
+            if self._extras[row] is None:
+                self._extras[row] = {}
+            self._extras[row][key] = value
+
+    def mask(self, classes=None, files=None):
+        """
+        Return a boolean array selecting the annotations of the given
+        classes and file items.
+        """
+        mask = np.ones(len(self.data), dtype=bool)
+        if classes is not None:
+            ids = [self.classId(c) for c in classes]
+            mask &= np.isin(self.data['class'], ids)
+        if files is not None:
+            mask &= np.isin(self.data['file'], list(files))
+        return mask
+
+    def select(self, mask):
+        """
+        Return a new table with the annotations selected by ``mask``, which
+        is a boolean array or an array of rows.
+        """
+        rows = np.arange(len(self.data))[mask]
+        return AnnotationTable(self.data[rows].copy(), self.classes,
+                               [dict(self._extras[r]) if self._extras[r] else None for r in rows])
+
+    def boxes(self):
+        """
+        Return the annotations as array of boxes (x1, y1, x2, y2).  Points
+        are boxes of size 0, other annotations are NaN.
+        """
+        d = self.data
+        width = np.where(np.isnan(d['width']), 0., d['width'])
+        height = np.where(np.isnan(d['height']), 0., d['height'])
+        return np.column_stack((d['x'], d['y'], d['x'] + width, d['y'] + height))
+
+    def statistics(self):
+        """
+        Return a dict mapping each class to the number of annotations and
+        the mean, minimum and maximum of the width and height of its boxes.
+        """
+        stats = {}
+        d = self.data
+        counts = np.bincount(d['class'] + 1, minlength=len(self.classes) + 1)
+        for cid, name in enumerate(self.classes):
+            if counts[cid + 1] == 0:
+                continue
+            entry = {'count': int(counts[cid + 1])}
+            rows = d[d['class'] == cid]
+            for key in ('width', 'height'):
+                values = rows[key][~np.isnan(rows[key])]
+                if len(values) > 0:
+                    entry[key] = (float(values.mean()), float(values.min()), float(values.max()))
+            stats[name] = entry
+        return stats
+
+    def save(self, filename):
+        """
+        Export the columns to the numpy file ``filename`` (.npz).  Values
+        which are not stored in columns are not exported.
+        """
+        np.savez(filename, data=self.data, classes=np.array(self.classes, dtype=object))
+
+    @classmethod
+    def load(cls, filename):
+        """Load a table exported by ``save()``."""
+        f = np.load(filename, allow_pickle=True)
+        return cls(f['data'], list(f['classes']))
@@ -1,10 +1,23 @@
 import os
+import re
+import codecs
 import fnmatch
+import gzip
+import mmap
+import multiprocessing
+import struct
+import threading
 import time
 import numpy as np
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
 from sloth.core.exceptions import \
     ImproperlyConfigured, NotImplementedException, InvalidArgumentException
 from sloth.core.utils import import_callable
+from sloth.annotations.imagecache import sharedImageCache
+from sloth.annotations.video import VideoSourceCache
 import logging
 LOG = logging.getLogger(__name__)
 
@@ -20,9 +33,16 @@ try:
     import yaml
 except ImportError:
     pass
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 try:
     import okapy
-    import okapy.videoio as okv
     _use_pil = False
 except ImportError:
     try:
@@ -32,6 +52,16 @@ except ImportError:
         raise RuntimeError("Could neither find PIL nor okapy.  Sloth needs one of them for loading images.")
 
 
+def _plainValue(obj):
+    """
+    Convert mappings which are not dicts, e.g. the annotation records of
+    ``sloth.annotations.columnar``, for the serializers.
+    """
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError("%r is not serializable" % (obj, ))
+
+
 class AnnotationContainerFactory:
     def __init__(self, containers):
         """
@@ -72,12 +102,92 @@ class AnnotationContainerFactory:
         )
 
 
+def _hasNonFinite(obj):
+    """
+    Return True if the file items ``obj`` contain a NaN or infinite float,
+    which the json module writes as NaN or Infinity but orjson as null.
+    """
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        t = type(o)
+        if t is float:
+            # inf - inf and nan - nan are nan
+            if o - o != 0.0:
+                return True
+        elif t is dict:
+            stack.extend(o.values())
+        elif t is list or t is tuple:
+            stack.extend(o)
+        elif isinstance(o, Mapping):
+            stack.extend(o.values())
+        elif isinstance(o, float):
+            if o - o != 0.0:
+                return True
+    return False
+
+
+def _replaceFile(src, dst):
+    """
+    Atomically replace ``dst`` by ``src``.  A file opened for reading keeps
+    reading the previous version of ``dst``.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class JournaledFileItems(Sequence):
+    """
+    Sequence of file items from a random access container with the records
+    of the journal applied on top.
+    """
+
+    def __init__(self, base, records):
+        self._base = base
+        self._records = records
+        self._len = len(base)
+        while self._len in records:
+            self._len += 1
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if index < 0 or index >= self._len:
+            raise IndexError("file item index out of range")
+        if index in self._records:
+            return self._records[index]
+        return self._base[index]
+
+    def encodedItem(self, index):
+        """The encoded file item of the base, or None if it was replaced."""
+        if index in self._records or not hasattr(self._base, 'encodedItem'):
+            return None
+        return self._base.encodedItem(index)
+
+    def close(self):
+        if hasattr(self._base, 'close'):
+            self._base.close()
+
+
 class AnnotationContainer:
     """
     Annotation Container base class.
     """
 
+    # Whether serializeToFile() accepts any sequence of file items.  Other
+    # containers are passed a list.
+    serializes_sequences = False
+
     def __init__(self):
+        self._image_cache = sharedImageCache()
+        self._video_lock = threading.Lock()
         self.clear()
 
     def filename(self):
@@ -87,21 +197,53 @@ class AnnotationContainer:
     def clear(self):
         self._annotations = []  # TODO Why isn't this used? Annotations are passed as parameters instead. Let's have encapsulation.
         self._filename = None
-        self._video_cache = {}
+        if getattr(self, '_video_cache', None) is not None:
+            self._video_cache.close()
+        self._video_cache = None
+        self._journal_length = 0
+        self._use_mmap = False
 
-    def load(self, filename):
+    def load(self, filename, use_mmap=False):
         """
         Load the annotations.
+
+        The returned file items are usually a list.  Containers which read
+        their files incrementally may instead return an iterator over the
+        file items; the annotation model then pulls the items on demand.
+
+        If ``use_mmap`` is True, containers reading the label file through
+        ``openInput()`` memory-map it instead of reading it into memory.
         """
         if not filename:
             raise InvalidArgumentException("filename cannot be empty")
         self._filename = filename
+        self._use_mmap = use_mmap
         start = time.time()
         ann = self.parseFromFile(filename)
+        ann = self._applyJournal(filename, ann)
         diff = time.time() - start
         LOG.info("Loaded annotations from %s in %.2fs" % (filename, diff))
         return ann
 
+    def openInput(self, filename):
+        """
+        Open ``filename`` for reading in binary mode.  If the annotations are
+        loaded with ``use_mmap``, a read-only memory map of the file is
+        returned instead.  It provides the file methods ``read()``,
+        ``readline()``, ``seek()``, ``tell()`` and ``close()``, and can be
+        sliced without copying the rest of the file.
+        """
+        f = open(filename, "rb")
+        if not self._use_mmap:
+            return f
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # Empty files cannot be mapped
+            return f
+        f.close()
+        return mapped
+
     def parseFromFile(self, filename):
         """
         Read the annotations from disk. Must be implemented in the subclass.
@@ -114,16 +256,164 @@ class AnnotationContainer:
 
     def save(self, annotations, filename=""):
         """
-        Save the annotations.
+        Save the annotations.  The annotations are serialized to a temporary
+        file which then replaces the label file, so that the label file is
+        never left partially written.
+        """
+        if not filename:
+            filename = self.filename()
+        root, ext = os.path.splitext(filename)
+        tmpname = "%s.saving%s" % (root, ext)
+        try:
+            self.serializeToFile(tmpname, annotations)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        _replaceFile(tmpname, filename)
+        self._filename = filename
+
+        # The journal has been merged into the file
+        journal = self.journalFilename(filename)
+        if os.path.exists(journal):
+            os.remove(journal)
+        self._journal_length = 0
+
+    def journalFilename(self, filename=None):
+        """
+        The filename of the journal which stores incrementally saved
+        changes of the label file ``filename``.
+        """
+        return (filename or self.filename()) + ".journal"
+
+    def journalLength(self):
+        """The number of file item records in the current journal."""
+        return self._journal_length
+
+    def saveIncremental(self, changes, filename=""):
+        """
+        Save only the changed file items by appending them to the journal
+        next to the label file instead of rewriting the whole file.  The
+        journal is applied when the label file is loaded again, and merged
+        into the label file by the next call to ``save()``.
+
+        Parameters
+        ==========
+        changes: list of tuples (int, dict)
+            The row and the annotations of each changed file item.  Rows
+            beyond the end of the label file append new file items.
         """
         if not filename:
             filename = self.filename()
-        self.serializeToFile(filename, annotations)
+        journal = self.journalFilename(filename)
+        self._truncatePartialRecord(journal)
+        with open(journal, "a") as f:
+            for row, fileitem in changes:
+                f.write(json.dumps({'row': row, 'item': fileitem}, separators=(',', ':'),
+                                   default=_plainValue))
+                f.write("\n")
         self._filename = filename
+        self._journal_length += len(changes)
+
+    def _truncatePartialRecord(self, journal, blocksize=4096):
+        """
+        Remove an incomplete last record left by an interrupted save from
+        the journal, so that the next record is not appended to it.
+        """
+        if not os.path.exists(journal):
+            return
+        with open(journal, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            pos = end
+            while pos > 0:
+                start = max(pos - blocksize, 0)
+                f.seek(start)
+                block = f.read(pos - start)
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    pos = start + newline + 1
+                    break
+                pos = start
+            if pos < end:
+                LOG.warn("Removing incomplete last record from journal %s" % journal)
+                f.truncate(pos)
+
+    def _readJournal(self, filename):
+        """
+        Read the journal of ``filename``.  Returns a dict mapping rows to
+        file items, the last record of a row wins.
+        """
+        records = {}
+        journal = self.journalFilename(filename)
+        if not os.path.exists(journal):
+            return records
+
+        count = 0
+        with open(journal, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Most probably an incomplete last record of a save
+                    # that was interrupted
+                    LOG.warn("Skipping corrupt record in journal %s" % journal)
+                    continue
+                records[record['row']] = record['item']
+                count += 1
+        self._journal_length = count
+        LOG.info("Read %d records from journal %s" % (count, journal))
+        return records
+
+    def _applyJournal(self, filename, ann):
+        """
+        Update the file items ``ann`` parsed from ``filename`` with the
+        records of the journal.  An InvalidArgumentException is raised if a
+        record refers to a row past the file items and the records appended
+        to them; for iterators, when the iterator is exhausted.
+        """
+        records = self._readJournal(filename)
+        if len(records) == 0:
+            return ann
+
+        if isinstance(ann, list):
+            self._checkJournalRows(filename, records, len(ann))
+            for row in sorted(records.keys()):
+                if row < len(ann):
+                    ann[row] = records[row]
+                else:
+                    ann.append(records[row])
+            return ann
+        elif isinstance(ann, Sequence):
+            self._checkJournalRows(filename, records, len(ann))
+            return JournaledFileItems(ann, records)
+        else:
+            return self._iterJournaled(filename, ann, records)
+
+    def _checkJournalRows(self, filename, records, length):
+        while length in records:
+            length += 1
+        missing = [row for row in records if row >= length]
+        if missing:
+            raise InvalidArgumentException("Journal of %s refers to missing file item %d" % (filename, min(missing)))
+
+    def _iterJournaled(self, filename, ann, records):
+        row = 0
+        for fileitem in ann:
+            yield records.get(row, fileitem)
+            row += 1
+        while row in records:
+            yield records[row]
+            row += 1
+        self._checkJournalRows(filename, records, row)
 
     def serializeToFile(self, filename, annotations):
         """
         Serialize the annotations to disk. Must be implemented in the subclass.
+
+        The file items passed in may be the dicts held by the annotation
+        model (see ``AnnotationModel.getAnnotations()``), so implementations
+        must not modify them, but copy them if they need to change them.
         """
         raise NotImplementedException(
             "You need to implement serializeToFile() in your subclass " +
@@ -144,17 +434,38 @@ class AnnotationContainer:
             fullpath = filename
         return fullpath
 
+    def imageCache(self):
+        """
+        The cache of decoded images and frames.  By default all containers
+        share ``sloth.annotations.imagecache.sharedImageCache()``.
+        """
+        return self._image_cache
+
+    def setImageCache(self, cache):
+        self._image_cache = cache
+
     def loadImage(self, filename):
         """
         Load and return the image referenced to by the filename.  In the
         default implementation this will try to load the image from a path
         relative to the label file's directory.
+
+        Decoded images are kept in the ``imageCache()``, and are invalidated
+        if the modification time of the image file changes.  The returned
+        arrays are read-only.
         """
         fullpath = self._fullpath(filename)
-        if not os.path.exists(fullpath):
+        try:
+            mtime = os.path.getmtime(fullpath)
+        except EnvironmentError:
             LOG.warn("Image file %s does not exist." % fullpath)
             return None
 
+        return self._image_cache.getOrLoad((os.path.abspath(fullpath), mtime),
+                                           lambda: self.decodeImage(fullpath))
+
+    def decodeImage(self, fullpath):
+        """Decode the image file ``fullpath`` without caching it."""
         if _use_pil:
             im = Image.open(fullpath)
             return np.asarray(im)
@@ -165,27 +476,43 @@ class AnnotationContainer:
         """
         Load the video referenced to by the filename, and return frame
         ``frame_number``.  In the default implementation this will try to load
-        the video from a path relative to the label files directory.
+        the video from a path relative to the label files directory.  Decoded
+        frames are kept in the ``imageCache()``.
         """
         fullpath = str(self._fullpath(filename))
-        if not os.path.exists(fullpath) and not os.path.exists(fullpath.split('%')[0]):
+        # Image sequences are given by a printf pattern in their directory
+        if not os.path.exists(fullpath) and not \
+                ('%' in fullpath and os.path.isdir(os.path.dirname(fullpath.split('%')[0]) or '.')):
             LOG.warn("Video file %s does not exist." % fullpath)
             return None
 
-        # get video source from cache or load from file
-        if fullpath in self._video_cache:
-            vidsrc = self._video_cache[fullpath]
-        else:
-            vidsrc = okv.createVideoSourceFromString(fullpath)
-            vidsrc = okv.toRandomAccessVideoSource(vidsrc)
-            self._video_cache[fullpath] = vidsrc
+        return self._image_cache.getOrLoad((os.path.abspath(fullpath), frame_number),
+                                           lambda: self.decodeFrame(fullpath, frame_number))
+
+    def decodeFrame(self, fullpath, frame_number):
+        """
+        Decode frame ``frame_number`` of the video ``fullpath``.  The video
+        sources are not thread-safe, so frames are decoded one at a time.
+        """
+        with self._video_lock:
+            return self._decodeFrame(fullpath, frame_number)
 
-        # get requested frame
-        if not vidsrc.getFrame(frame_number):
+    def _decodeFrame(self, fullpath, frame_number):
+        image = self.videoSources().getFrame(fullpath, frame_number)
+        if image is None:
             LOG.warn("Frame %d could not be loaded from video source %s" % (frame_number, fullpath))
-            return None
+        return image
 
-        return vidsrc.getImage()
+    def videoSources(self):
+        """
+        The ``VideoSourceCache`` of the open video sources.  At most
+        ``config.VIDEO_CACHE_SOURCES`` videos are kept open.
+        """
+        if self._video_cache is None:
+            from sloth.conf import config
+            self._video_cache = VideoSourceCache(config.VIDEO_CACHE_SOURCES,
+                                                 config.VIDEO_FRAME_BUFFER)
+        return self._video_cache
 
 
 class PickleContainer(AnnotationContainer):
@@ -197,8 +524,11 @@ class PickleContainer(AnnotationContainer):
         """
         Overwritten to read pickle files.
         """
-        f = open(fname, "rb")
-        return pickle.load(f)
+        f = self.openInput(fname)
+        try:
+            return pickle.load(f)
+        finally:
+            f.close()
 
     def serializeToFile(self, fname, annotations):
         """
@@ -269,9 +599,10 @@ class OkapiAnnotationContainer(AnnotationContainer):
 
         for f in annotations:
             fileitem = okapy.AnnotationFileItem()
-            if f.has_key('class'):
-                f['type'] = f['class']
-                del f['class']
+            # The file items may be shared with the model, don't modify them
+            f = dict(f)
+            if 'class' in f:
+                f['type'] = f.pop('class')
             fileitem = self.convertDictToAnnotationPropertiesMap(fileitem, f)
             if fileitem.isImage():
                 if f.has_key('annotations'):
@@ -298,36 +629,272 @@ class OkapiAnnotationContainer(AnnotationContainer):
 class JsonContainer(AnnotationContainer):
     """
     Simple container which writes the annotations to disk in JSON format.
+
+    The output format is defined by the class attributes ``indent``,
+    ``separators`` and ``sort_keys`` (see ``json.dump``), and ``compression``,
+    which can be None, ``'gzip'`` or ``'zstd'``.  Compressed files are
+    recognized automatically when reading.  If ``orjson`` is installed, it is
+    used for encoding compact, unindented output.
     """
 
+    indent = 4
+    separators = (',', ': ')
+    sort_keys = True
+    compression = None
+
+    _gzip_magic = b"\x1f\x8b"
+    _zstd_magic = b"\x28\xb5\x2f\xfd"
+
+    def openFile(self, fname, mode):
+        """
+        Open the file ``fname`` in binary ``mode`` ('rb' or 'wb').  Handles
+        the (de)compression of the data.
+        """
+        if mode == "rb":
+            f = self.openInput(fname)
+            magic = f.read(4)
+            f.seek(0)
+            if magic.startswith(self._gzip_magic):
+                return gzip.GzipFile(fileobj=f, mode="rb")
+            if magic == self._zstd_magic:
+                if zstandard is None:
+                    raise ImproperlyConfigured("Reading %s needs the python module zstandard" % fname)
+                return zstandard.ZstdDecompressor().stream_reader(f)
+            return f
+        if self.compression == 'gzip':
+            return gzip.open(fname, mode, 6)
+        if self.compression == 'zstd':
+            if zstandard is None:
+                raise ImproperlyConfigured("Writing %s needs the python module zstandard" % fname)
+            return zstandard.ZstdCompressor(level=3).stream_writer(open(fname, mode))
+        return open(fname, mode)
+
+    def encode(self, annotations):
+        """
+        Encode the annotations as JSON in UTF-8.
+        """
+        if orjson is not None and self.indent is None:
+            try:
+                data = orjson.dumps(annotations, default=_plainValue,
+                                    option=orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+                # orjson writes NaN and Infinity as null, json keeps them
+                if b"null" not in data or not _hasNonFinite(annotations):
+                    return data
+            except TypeError:
+                # e.g. non-string keys, which are supported by json
+                pass
+        data = json.dumps(annotations, indent=self.indent,
+                          separators=self.separators, sort_keys=self.sort_keys,
+                          default=_plainValue)
+        if self.indent is not None:
+            data += "\n"
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        return data
+
     def parseFromFile(self, fname):
         """
         Overwritten to read JSON files.
         """
-        f = open(fname, "r")
-        return json.load(f)
+        f = self.openFile(fname, "rb")
+        try:
+            if orjson is not None and isinstance(f, mmap.mmap):
+                # Decode directly from the mapping
+                view = memoryview(f)
+                try:
+                    return orjson.loads(view)
+                except ValueError:
+                    # e.g. NaN or Infinity, which orjson does not accept
+                    pass
+                finally:
+                    view.release()
+            data = f.read()
+        finally:
+            f.close()
+        if orjson is not None:
+            try:
+                return orjson.loads(data)
+            except ValueError:
+                pass
+        return json.loads(data.decode("utf-8"))
 
     def serializeToFile(self, fname, annotations):
         """
         Overwritten to write JSON files.
         """
-        f = open(fname, "w")
-        json.dump(annotations, f, indent=4, separators=(',', ': '), sort_keys=True)
-        f.write("\n")
+        data = self.encode(annotations)
+        f = self.openFile(fname, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+
+class CompactJsonContainer(JsonContainer):
+    """
+    Container which writes compact JSON without indentation and with unsorted
+    keys, which is considerably smaller and faster to write.
+    """
+
+    indent = None
+    separators = (',', ':')
+    sort_keys = False
+
+
+class GzipJsonContainer(CompactJsonContainer):
+    """
+    Container which writes gzip compressed, compact JSON.
+    """
+
+    compression = 'gzip'
+
+
+class ZstdJsonContainer(CompactJsonContainer):
+    """
+    Container which writes zstd compressed, compact JSON (needs the python
+    module ``zstandard``).
+    """
+
+    compression = 'zstd'
+
+
+class StreamingJsonContainer(JsonContainer):
+    """
+    Container which reads JSON files incrementally.  Instead of decoding the
+    whole file at once, the file items of the top-level list are decoded one
+    after the other and returned as an iterator.  This allows the model to
+    show the first images while the rest of the file is still being parsed,
+    and bounds the memory needed for parsing by the size of the largest file
+    item instead of the size of the file.  Files are written in the same
+    format as by the ``JsonContainer``.
+    """
+
+    # Number of bytes read from the file at once
+    chunk_size = 1 << 16
+
+    _whitespace = re.compile(r'[ \t\n\r]*')
+
+    def parseFromFile(self, fname):
+        """
+        Overwritten to return an iterator over the file items.
+        """
+        f = self.openFile(fname, "rb")
+        return self.iterFileItems(f)
+
+    def iterFileItems(self, f):
+        """
+        Generator yielding the elements of the JSON list in file object ``f``
+        one at a time.  An InvalidArgumentException is raised for files which
+        do not contain a list at the top level.  The file object is closed
+        when the generator is exhausted.
+        """
+        decoder = json.JSONDecoder()
+        textdecoder = codecs.getincrementaldecoder("utf-8")()
+        buf = u""
+        pos = 0
+        eof = False
+        started = False
+        expect_value = True
+        read_size = self.chunk_size
+
+        try:
+            while True:
+                pos = self._whitespace.match(buf, pos).end()
+
+                # Need more data if the buffer is exhausted
+                need_data = pos >= len(buf)
+                if not need_data and started and expect_value and buf[pos] != ']':
+                    try:
+                        item, end = decoder.raw_decode(buf, pos)
+                        # A value ending exactly at the buffer end (e.g. a
+                        # number) might continue in the next chunk
+                        need_data = end >= len(buf) and not eof
+                    except ValueError:
+                        if eof:
+                            raise
+                        need_data = True
+                    if not need_data:
+                        yield item
+                        pos = end
+                        expect_value = False
+                        read_size = self.chunk_size
+                        continue
+                    # Read larger chunks while one item does not fit
+                    read_size *= 2
+
+                if need_data:
+                    if eof:
+                        if not started:
+                            return
+                        raise ValueError("Unexpected end of JSON file")
+                    data = f.read(read_size)
+                    buf = buf[pos:]
+                    pos = 0
+                    if data:
+                        buf += textdecoder.decode(data)
+                    else:
+                        buf += textdecoder.decode(b"", True)
+                        eof = True
+                    continue
+
+                c = buf[pos]
+                if not started:
+                    if c != '[':
+                        raise InvalidArgumentException(
+                            "%s does not contain a list of file items" % getattr(f, "name", "JSON file"))
+                    started = True
+                    pos += 1
+                elif c == ']':
+                    return
+                elif not expect_value and c == ',':
+                    expect_value = True
+                    pos += 1
+                else:
+                    raise ValueError("Unexpected character %r at position %d in JSON list" % (c, pos))
+        finally:
+            f.close()
 
 
 class MsgpackContainer(AnnotationContainer):
     """
-    Simple container which writes the annotations to disk in Msgpack format.
+    Container which writes the annotations to disk in Msgpack format, one
+    record per file item.  When loading, the records are unpacked one after
+    the other and an iterator over the file items is returned, so that the
+    model can show the first images before the whole file has been read.
+    Files containing a single array of all file items, as written by earlier
+    versions, are read as well.
     """
 
+    # Number of bytes read from the file at once
+    read_size = 1 << 16
+
     def parseFromFile(self, fname):
         """
-        Overwritten to read Msgpack files.
+        Overwritten to return an iterator over the file items.
         """
         import msgpack
-        f = open(fname, "r")
-        return msgpack.load(f)
+        f = self.openInput(fname)
+        return self.iterFileItems(f)
+
+    def iterFileItems(self, f):
+        """
+        Generator yielding the file items in the Msgpack file object ``f`` one
+        at a time.  The file object is closed when the generator is exhausted.
+        """
+        import msgpack
+        try:
+            first = f.read(1)
+            f.seek(0)
+            unpacker = msgpack.Unpacker(f, raw=False, read_size=self.read_size)
+            if first[:1] in (b"\xdc", b"\xdd") or b"\x90" <= first[:1] <= b"\x9f":
+                # A single array of all file items
+                for i in range(unpacker.read_array_header()):
+                    yield unpacker.unpack()
+            else:
+                for fileitem in unpacker:
+                    yield fileitem
+        finally:
+            f.close()
 
     def serializeToFile(self, fname, annotations):
         """
@@ -335,8 +902,280 @@ class MsgpackContainer(AnnotationContainer):
         """
         # TODO make all image filenames relative to the label file
         import msgpack
-        f = open(fname, "w")
-        msgpack.dump(annotations, f)
+        packer = msgpack.Packer(use_bin_type=True, default=_plainValue)
+        with open(fname, "wb") as f:
+            for fileitem in annotations:
+                f.write(packer.pack(fileitem))
+
+
+class SlothDbFileItems(Sequence):
+    """
+    Read-only sequence of the file items in a slothdb file.  Only the offset
+    index is read on construction, each file item is decoded from disk when
+    it is accessed.  If ``f`` is a memory map, the records are sliced
+    directly from the mapping.
+    """
+
+    def __init__(self, f, name):
+        self._f = f
+        self._lock = threading.Lock()
+
+        f.seek(0)
+        if f.read(len(SlothDbContainer.magic)) != SlothDbContainer.magic:
+            raise InvalidArgumentException("%s is not a slothdb file" % name)
+        f.seek(-SlothDbContainer.footer.size, os.SEEK_END)
+        index_offset, count, magic = SlothDbContainer.footer.unpack(f.read(SlothDbContainer.footer.size))
+        if magic != SlothDbContainer.magic:
+            raise InvalidArgumentException("%s is truncated or corrupt" % name)
+        f.seek(index_offset)
+        self._offsets = np.frombuffer(f.read(8 * (count + 1)), dtype='<u8')
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("file item index out of range")
+        return json.loads(self.encodedItem(index).decode("utf-8"))
+
+    def encodedItem(self, index):
+        """Return the record of the file item at ``index`` without decoding it."""
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        if isinstance(self._f, mmap.mmap):
+            return self._f[start:end]
+        with self._lock:
+            self._f.seek(start)
+            return self._f.read(end - start)
+
+    def close(self):
+        """Close the file.  The file items cannot be accessed afterwards."""
+        self._f.close()
+
+
+class SlothDbContainer(AnnotationContainer):
+    """
+    Container for an indexed binary format with random access to single file
+    items.  The file consists of one JSON encoded record per file item,
+    followed by an index of the record offsets.  Loading only reads the index;
+    the annotation model decodes the file items when they are accessed, so
+    opening even very large label files is fast and memory usage depends on
+    the number of visited images.
+    """
+
+    magic = b"SLOTHDB1"
+    footer = struct.Struct("<QQ8s")
+
+    # serializeToFile() accepts any sequence of file items, and copies the
+    # records of unmodified file items of a ``FileItemSnapshot``
+    serializes_sequences = True
+
+    def clear(self):
+        """
+        Overwritten to close the files of the loaded file items.
+        """
+        for items in getattr(self, '_file_items', ()):
+            items.close()
+        AnnotationContainer.clear(self)
+        self._file_items = []
+
+    def parseFromFile(self, fname):
+        """
+        Overwritten to return a lazily decoding sequence of file items.
+        """
+        f = self.openInput(fname)
+        try:
+            items = SlothDbFileItems(f, fname)
+        except Exception:
+            f.close()
+            raise
+        self._file_items.append(items)
+        return items
+
+    def serializeToFile(self, fname, annotations):
+        """
+        Overwritten to write slothdb files.
+        """
+        encoded = getattr(annotations, 'encodedItem', None)
+        with open(fname, "wb") as f:
+            f.write(self.magic)
+            offsets = []
+            for i in range(len(annotations)):
+                offsets.append(f.tell())
+                data = encoded(i) if encoded is not None else None
+                if data is None:
+                    data = json.dumps(annotations[i], separators=(',', ':'),
+                                      default=_plainValue).encode("utf-8")
+                f.write(data)
+            offsets.append(f.tell())
+            index_offset = offsets[-1]
+            f.write(np.asarray(offsets, dtype='<u8').tobytes())
+            f.write(self.footer.pack(index_offset, len(offsets) - 1, self.magic))
+
+
+def _loadShard(args):
+    """
+    Load the file items of one shard.  Runs in the worker processes of the
+    ``ShardedContainer``.
+    """
+    container_class, filename, use_mmap = args
+    container = container_class()
+    try:
+        return list(container.load(filename, use_mmap=use_mmap))
+    finally:
+        container.clear()
+
+
+class ShardedContainer(AnnotationContainer):
+    """
+    Container for label sets split into several shard files.  The label file
+    is a manifest listing the shard files, one per line and relative to the
+    directory of the manifest.  Each shard is loaded and saved by the
+    container registered for its filename in ``config.CONTAINERS``.
+
+    The shards are parsed in parallel by a pool of ``processes`` worker
+    processes (default: the number of CPUs), and their file items are
+    concatenated.  The workers are spawned instead of forked, since forking
+    the GUI process with its running threads is not safe.  When saving, only
+    the shards whose file items changed are written.  New label sets are
+    split into shards of ``shard_size`` file items, written in the format of
+    ``shard_extension``.
+    """
+
+    processes = None
+    shard_size = 1000
+    shard_extension = ".json"
+
+    def clear(self):
+        AnnotationContainer.clear(self)
+        self._shards = []
+        self._shard_dir = None
+
+    def _shardContainerClass(self, filename):
+        from sloth.conf import config
+        return type(AnnotationContainerFactory(config.CONTAINERS).create(filename))
+
+    def readManifest(self, fname):
+        """
+        Return the shard filenames listed in the manifest ``fname``.  Empty
+        lines and lines starting with # are ignored.
+        """
+        shards = []
+        with open(fname, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    shards.append(line)
+        return shards
+
+    def parseFromFile(self, fname):
+        """
+        Overwritten to load the shards listed in the manifest.
+        """
+        basedir = os.path.dirname(fname)
+        names = self.readManifest(fname)
+        jobs = [(self._shardContainerClass(name), os.path.join(basedir, name), self._use_mmap)
+                for name in names]
+
+        if len(jobs) > 1 and self.processes != 1:
+            if hasattr(multiprocessing, 'get_context'):
+                pool = multiprocessing.get_context('spawn').Pool(self.processes)
+            else:
+                pool = multiprocessing.Pool(self.processes)
+            try:
+                items = pool.map(_loadShard, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            items = [_loadShard(job) for job in jobs]
+
+        self._shards = list(zip(names, items))
+        self._shard_dir = basedir
+        annotations = []
+        for shard_items in items:
+            annotations.extend(shard_items)
+        return annotations
+
+    def _splitShards(self, annotations):
+        """
+        Assign the file items to the shards they were loaded from.  File
+        items are recognized by identity, which holds for all file items
+        the model passes through unmodified.  Modified and new file items are
+        assigned according to their position relative to the known items.
+        Returns a list with the file items of each shard.
+        """
+        owner = {}
+        for s, (name, items) in enumerate(self._shards):
+            for i, item in enumerate(items):
+                owner[id(item)] = (s, i)
+        known = [owner.get(id(item)) for item in annotations]
+
+        # The shard of the next known file item for every position
+        following = [None] * len(annotations)
+        shard = None
+        for pos in range(len(annotations) - 1, -1, -1):
+            following[pos] = shard
+            if known[pos] is not None:
+                shard = known[pos][0]
+
+        split = [[] for n in range(len(self._shards))]
+        s, i = 0, -1
+        for pos, item in enumerate(annotations):
+            if known[pos] is not None:
+                s, i = known[pos]
+            elif i + 1 >= len(self._shards[s][1]) and s + 1 < len(self._shards) and \
+                    (following[pos] is None or s + 1 <= following[pos]):
+                # Past the end of the shard, continue with the next one
+                s, i = s + 1, 0
+            else:
+                i += 1
+            split[s].append(item)
+        return split
+
+    def _shardChanged(self, old, new):
+        if len(old) != len(new):
+            return True
+        for a, b in zip(old, new):
+            if a is not b and a != b:
+                return True
+        return False
+
+    def serializeToFile(self, fname, annotations):
+        """
+        Overwritten to write the changed shards and the manifest.
+        """
+        annotations = list(annotations)
+        basedir = os.path.dirname(fname)
+        if self._shards:
+            split = self._splitShards(annotations)
+            names = [name for name, items in self._shards]
+        else:
+            # The names of new shards are derived from the manifest, save()
+            # passes the temporary file next to it
+            base = os.path.splitext(os.path.basename(fname))[0]
+            if base.endswith(".saving"):
+                base = base[:-len(".saving")]
+            split = [annotations[i:i + self.shard_size]
+                     for i in range(0, max(len(annotations), 1), self.shard_size)]
+            names = ["%s-%05d%s" % (base, n, self.shard_extension) for n in range(len(split))]
+
+        written = 0
+        for n, (name, items) in enumerate(zip(names, split)):
+            if basedir == self._shard_dir and n < len(self._shards) and \
+                    not self._shardChanged(self._shards[n][1], items):
+                continue
+            container = self._shardContainerClass(name)()
+            container.save(items, os.path.join(basedir, name))
+            written += 1
+        LOG.info("Wrote %d of %d shards" % (written, len(names)))
+
+        with open(fname, "w") as f:
+            for name in names:
+                f.write(name + "\n")
+        self._shards = list(zip(names, split))
+        self._shard_dir = basedir
 
 
 class YamlContainer(AnnotationContainer):
@@ -355,8 +1194,11 @@ class YamlContainer(AnnotationContainer):
         """
         Overwritten to write YAML files.
         """
+        class Dumper(yaml.Dumper):
+            pass
+        Dumper.add_multi_representer(Mapping, Dumper.represent_dict)
         f = open(fname, "w")
-        yaml.dump(annotations, f)
+        yaml.dump(annotations, f, Dumper=Dumper)
 
 
 class FileNameListContainer(AnnotationContainer):
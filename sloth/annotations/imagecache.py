@@ -0,0 +1,267 @@
+"""
+The imagecache module keeps recently decoded images and video frames in
+memory, so that going back and forth between images does not decode them
+again.  The cache is bounded by the number of bytes of the cached images and
+evicts the least recently used images first.  ``ImagePrefetcher`` decodes
+images in background threads before they are requested.
+
+All containers share one cache, ``sharedImageCache()``, whose size is set by
+``config.IMAGE_CACHE_SIZE``.  Thus the scene, the plugins and the commands
+all profit from images decoded by one of them.
+"""
+import threading
+from collections import OrderedDict, deque
+import logging
+LOG = logging.getLogger(__name__)
+
+
+def imageBytes(image):
+    """Return the memory used by the decoded ``image`` in bytes."""
+    nbytes = getattr(image, 'nbytes', None)
+    if nbytes is None:
+        try:
+            nbytes = len(image)
+        except TypeError:
+            nbytes = 0
+    return nbytes
+
+
+class _PendingLoad(object):
+    """An image which is being decoded by a thread of ``ImageCache.getOrLoad()``."""
+    __slots__ = ('event', 'image', 'done')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.image = None
+        self.done = False
+
+
+class ImageCache(object):
+    """
+    LRU cache of decoded images with a budget of ``max_bytes`` bytes.  The
+    cache can be used from several threads.
+
+    The cached numpy arrays are made read-only, since they are returned to
+    every caller requesting the same image.
+    """
+
+    def __init__(self, max_bytes=0):
+        self._lock = threading.Lock()
+        self._images = OrderedDict()
+        self._loading = {}
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._last_fits = True
+        self.resetStatistics()
+
+    def maxBytes(self):
+        return self._max_bytes
+
+    def setMaxBytes(self, max_bytes):
+        """Set the budget of the cache, evicting images if necessary."""
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, key):
+        return key in self._images
+
+    def get(self, key, default=None):
+        """
+        Return the image cached for ``key`` and mark it as most recently
+        used, or ``default`` if it is not cached.
+        """
+        with self._lock:
+            try:
+                image, nbytes = self._images.pop(key)
+            except KeyError:
+                self._misses += 1
+                return default
+            self._images[key] = (image, nbytes)
+            self._hits += 1
+            return image
+
+    def put(self, key, image):
+        """
+        Cache ``image`` for ``key``.  Images larger than the budget are not
+        cached.  Returns the image.
+        """
+        if image is None:
+            return image
+        nbytes = imageBytes(image)
+        try:
+            image.setflags(write=False)
+        except (AttributeError, ValueError):
+            pass
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._last_fits = nbytes <= self._max_bytes
+            if nbytes > self._max_bytes:
+                return image
+            self._images[key] = (image, nbytes)
+            self._bytes += nbytes
+            self._evict()
+        return image
+
+    def getOrLoad(self, key, load):
+        """
+        Return the image cached for ``key``, or call ``load()`` to decode the
+        image and cache it.  If another thread is decoding the same image,
+        e.g. the ``ImagePrefetcher``, its result is awaited instead of
+        decoding the image twice.
+        """
+        while True:
+            image = self.get(key)
+            if image is not None:
+                return image
+            with self._lock:
+                pending = self._loading.get(key)
+                if pending is None:
+                    pending = self._loading[key] = _PendingLoad()
+                    break
+            pending.event.wait()
+            if pending.done:
+                # Also returned if the image was too large to be cached
+                return pending.image
+            # The other thread failed to load the image, try it here
+        try:
+            image = self.put(key, load())
+            pending.image = image
+            pending.done = True
+            return image
+        finally:
+            with self._lock:
+                if self._loading.get(key) is pending:
+                    del self._loading[key]
+            pending.event.set()
+
+    def lastImageFits(self):
+        """
+        Whether the image last put into the cache fitted into the budget.
+        Images next to a large image are usually as large, so they are not
+        worth prefetching if it did not.
+        """
+        return self._last_fits
+
+    def discard(self, key):
+        """Remove the image cached for ``key``, if any."""
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def _evict(self):
+        while self._bytes > self._max_bytes and self._images:
+            key, (image, nbytes) = self._images.popitem(last=False)
+            self._bytes -= nbytes
+            self._evictions += 1
+
+    def resetStatistics(self):
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def statistics(self):
+        """
+        Return a dict with the number of ``hits``, ``misses`` and
+        ``evictions`` since the last ``resetStatistics()``, and the current
+        number of cached ``images`` and their ``bytes``.
+        """
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': float(self._hits) / requests if requests else 0.0,
+                'evictions': self._evictions,
+                'images': len(self._images),
+                'bytes': self._bytes,
+                'max_bytes': self._max_bytes,
+            }
+
+
+class ImagePrefetcher(object):
+    """
+    Decodes images in ``num_threads`` background threads.  ``prefetch()``
+    takes a list of functions loading one image each, usually into an
+    ``ImageCache``, ordered by priority.  Each call replaces the requests
+    which have not been started yet, so that stale requests are dropped
+    when the user jumps to another image.  Requests which are already
+    running are finished.
+    """
+
+    def __init__(self, num_threads=2):
+        self._num_threads = num_threads
+        self._threads = []
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def prefetch(self, loaders):
+        with self._condition:
+            self._queue.clear()
+            self._queue.extend(loaders)
+            while len(self._threads) < min(self._num_threads, len(self._queue)):
+                thread = threading.Thread(target=self._run, name="ImagePrefetcher")
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Drop all requests which have not been started yet."""
+        with self._condition:
+            self._queue.clear()
+
+    def pending(self):
+        return len(self._queue)
+
+    def stop(self):
+        """Cancel all requests and terminate the threads."""
+        with self._condition:
+            self._queue.clear()
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                load = self._queue.popleft()
+            try:
+                load()
+            except Exception:
+                LOG.exception("Prefetching an image failed")
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def sharedImageCache():
+    """
+    Return the image cache shared by all containers.  It is created on first
+    use with a budget of ``config.IMAGE_CACHE_SIZE`` bytes.
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            from sloth.conf import config
+            _shared_cache = ImageCache(config.IMAGE_CACHE_SIZE)
+        return _shared_cache
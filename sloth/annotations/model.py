@@ -5,26 +5,83 @@ import os.path
 import time
 import logging
 import copy
-from collections import MutableMapping
+import itertools
+import math
+import contextlib
+from collections import OrderedDict
+import numpy as np
+try:
+    from collections.abc import Mapping, MutableMapping, Sequence
+except ImportError:
+    from collections import Mapping, MutableMapping, Sequence
 from PyQt4.QtGui import QTreeView, QItemSelection, QItemSelectionModel, QSortFilterProxyModel, QBrush
-from PyQt4.QtCore import QModelIndex, QAbstractItemModel, Qt, pyqtSignal, QVariant, QObject
+from PyQt4.QtCore import QModelIndex, QAbstractItemModel, Qt, pyqtSignal, QVariant, QObject, QTimer, QPoint
+from sloth.core.exceptions import NotImplementedException
 
 LOG = logging.getLogger(__name__)
 
 ItemRole, DataRole, ImageRole = [Qt.UserRole + ur + 1 for ur in range(3)]
 
+# Roles which need the model item.  All other roles are answered for children
+# that are not yet converted to model items from their data, such that the
+# views do not create model items for all rows they display.
+_ITEM_ROLES = (ItemRole, DataRole)
+
+
+class ModelItem(object):
+    __slots__ = ('_loaded', '_num_unloaded', '_model', '_parent', '_row',
+                 '_row_epoch', '_row_shifts', '_children')
 
-class ModelItem:
     def __init__(self):
+        if hasattr(self, "_children"):
+            # Already initialized through another base class
+            return
         self._loaded = True
+        # Number of children which are not yet converted to model items
+        self._num_unloaded = 0
         self._model = None
         self._parent = None
         self._row = -1
-        if not hasattr(self, "_children"):
-            self._children = []
+        # Number of row shifts of the parent already applied to _row
+        self._row_epoch = 0
+        # Row shifts (pos, delta) of insertions and deletions of children
+        # which are not yet applied to the cached rows of the children
+        self._row_shifts = ()
+        self._children = []
+
+    def _setUnloadedChildren(self, items):
+        """
+        Append ``items`` as placeholders for children which are converted to
+        model items by ``_createChild()`` when they are accessed.  A tuple
+        of placeholders given to an item without children is used as is,
+        and can be shared by several items until they are modified.
+        """
+        if isinstance(items, tuple) and len(self._children) == 0:
+            self._children = items
+        else:
+            self._mutableChildren().extend(items)
+        self._num_unloaded += len(items)
+        self._loaded = self._num_unloaded == 0
+
+    def _mutableChildren(self):
+        """Return the list of children for modification."""
+        if isinstance(self._children, tuple):
+            self._children = list(self._children)
+        return self._children
+
+    def _createChild(self, pos):
+        """
+        Create the model item for the placeholder at ``pos``.  Must be
+        implemented by subclasses with unloaded children.
+        """
+        raise NotImplementedException(
+            "You need to implement _createChild() in subclasses with unloaded children")
 
     def _load(self, index):
-        pass
+        self.replaceChild(index, self._createChild(index))
+        self._num_unloaded -= 1
+        if self._num_unloaded == 0:
+            self._loaded = True
 
     def _ensureLoaded(self, index):
         if not self._loaded:
@@ -37,8 +94,15 @@ class ModelItem:
 
     def _ensureAllLoaded(self):
         if not self._loaded:
-            for i in range(len(self._children)):
-                self._ensureLoaded(i)
+            for pos, child in enumerate(self._mutableChildren()):
+                if not isinstance(child, ModelItem):
+                    item = self._createChild(pos)
+                    self._setChildRow(item, pos)
+                    self._children[pos] = item
+                    if self._model is not None:
+                        item._attachToModel(self._model)
+            self._num_unloaded = 0
+            self._loaded = True
             return True
         return False
 
@@ -46,15 +110,72 @@ class ModelItem:
         return len(self._children) > 0
 
     def childHasChildren(self, row):
+        unloaded = self._unloadedChild(row)
+        if unloaded is not None:
+            cls, data = unloaded
+            return cls._rowCountOf(data) > 0
         return self.childAt(row).hasChildren()
 
+    def _unloadedChild(self, pos):
+        """
+        Return the model item class and the data of the child at ``pos`` if
+        it is not yet created, else None.  The class methods ``_displayOf``,
+        ``_colorOf``, ``_flagsOf`` and ``_rowCountOf`` of the class provide
+        the data of the child for the views without creating it.
+        """
+        return None
+
     def row(self):
+        parent = self._parent
+        if parent is not None and self._row_epoch < len(parent._row_shifts):
+            # Apply the insertions and deletions since the row was cached
+            row = self._row
+            for pos, delta in parent._row_shifts[self._row_epoch:]:
+                if row >= pos:
+                    row += delta
+            self._row = row
+            self._row_epoch = len(parent._row_shifts)
         return self._row
 
+    def _setChildRow(self, item, row):
+        item._parent = self
+        item._row = row
+        item._row_epoch = len(self._row_shifts)
+
+    def _shiftRows(self, pos, delta):
+        """
+        Record that the children from row ``pos`` on moved by ``delta`` rows.
+        Instead of renumbering all following children on every insertion or
+        deletion, the shifts are applied when a row is requested.  Once the
+        number of pending shifts exceeds the square root of the number of
+        children, all children are renumbered.
+
+        Looking up a row therefore costs O(sqrt(n)) for n children, and the
+        renumbering costs amortized O(sqrt(n)) per insertion or deletion,
+        not O(log n).  The insertion or deletion in the list of children
+        itself moves O(n) references, but in a single memmove.
+        """
+        if not self._row_shifts:
+            self._row_shifts = []
+        self._row_shifts.append((pos, delta))
+        if len(self._row_shifts) > max(16, int(math.sqrt(len(self._children)))):
+            self._updateRows()
+
+    def _updateRows(self):
+        for i, child in enumerate(self._children):
+            if isinstance(child, ModelItem):
+                child._row = i
+                child._row_epoch = 0
+        self._row_shifts = ()
+
     def rowCount(self):
         return len(self._children)
 
     def childRowCount(self, pos):
+        unloaded = self._unloadedChild(pos)
+        if unloaded is not None:
+            cls, data = unloaded
+            return cls._rowCountOf(data)
         return self.childAt(pos).rowCount()
 
     def children(self):
@@ -80,14 +201,45 @@ class ModelItem:
             return None
 
     def childData(self, role=Qt.DisplayRole, row=0, column=0):
+        if role not in _ITEM_ROLES:
+            unloaded = self._unloadedChild(row)
+            if unloaded is not None:
+                cls, data = unloaded
+                if role == Qt.DisplayRole:
+                    return cls._displayOf(self, data, column)
+                if role == Qt.BackgroundRole:
+                    c = cls._colorOf(data)
+                    return QBrush(c) if c is not None else None
+                # The model items answer no other roles
+                return None
         return self.childAt(row).data(role, column)
 
     def flags(self, column):
         return Qt.ItemIsEnabled | Qt.ItemIsSelectable
 
     def childFlags(self, row, column):
+        unloaded = self._unloadedChild(row)
+        if unloaded is not None:
+            cls, data = unloaded
+            return cls._flagsOf(data, column)
         return self.childAt(row).flags(column)
 
+    def _mappingChildClass(self):
+        """The class of the items created for unloaded children given as dicts."""
+        return None
+
+    @staticmethod
+    def _displayOf(parent, data, column):
+        return ""
+
+    @staticmethod
+    def _colorOf(data):
+        return None
+
+    @staticmethod
+    def _flagsOf(data, column):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
     def setData(self, value, role=Qt.DisplayRole, column=0):
         return False
 
@@ -97,13 +249,14 @@ class ModelItem:
 
     def getPreviousSibling(self, step=1):
         # clip, instead of wrap around
-        if self._row - step < 0:
-            return self.getSibling(self._row)
+        row = self.row()
+        if row - step < 0:
+            return self.getSibling(row)
         else:
-            return self.getSibling(self._row-step)
+            return self.getSibling(row-step)
 
     def getNextSibling(self, step=1):
-        return self.getSibling(self._row+step)
+        return self.getSibling(self.row()+step)
 
     def getSibling(self, row):
         if self._parent is not None:
@@ -128,7 +281,7 @@ class ModelItem:
             return QModelIndex()
         if column >= self._model.columnCount():
             return QModelIndex()
-        return self._model.createIndex(self._row, column, self._parent)
+        return self._model.createIndex(self.row(), column, self._parent)
 
     def addChildSorted(self, item, signalModel=True):
         self.insertChild(-1, item, signalModel=signalModel)
@@ -137,53 +290,54 @@ class ModelItem:
         self.insertChild(-1, item, signalModel=signalModel)
 
     def replaceChild(self, pos, item):
-        item._parent = self
-        item._row    = pos
-        self._children[pos] = item
+        self._setChildRow(item, pos)
+        self._mutableChildren()[pos] = item
         if self._model is not None:
             self._children[pos]._attachToModel(self._model)
 
     def insertChild(self, pos, item, signalModel=True):
-        if pos >= 0:
-            next_row = pos
-        else:
-            next_row = len(self._children)
-        if self._model is not None and signalModel:
-            self._model.beginInsertRows(self.index(), next_row, next_row)
-
-        item._parent = self
-        item._row    = next_row
-        self._children.insert(next_row, item)
-
-        if pos >= 0:
-            for i, c in enumerate(self._children):
-                c._row = i
-
-        if self._model is not None:
-            item._attachToModel(self._model)
-            if signalModel:
-                self._model.endInsertRows()
-
-    def appendChildren(self, items, signalModel=True):
+        self.insertChildren(pos, [item], signalModel=signalModel)
+
+    def insertChildren(self, pos, items, signalModel=True):
+        """
+        Insert the model items ``items`` before the child at ``pos``, or
+        append them if ``pos`` is negative.  The model is notified of the
+        insertion with a single range of rows.
+        """
         #for item in items:
             #assert isinstance(item, ModelItem)
             #assert item.model() is None
             #assert item.parent() is None
-
-        next_row = len(self._children)
+        if len(items) == 0:
+            return
+        if pos >= 0:
+            next_row = pos
+        else:
+            next_row = len(self._children)
         if self._model is not None and signalModel:
             self._model.beginInsertRows(self.index(), next_row, next_row + len(items) - 1)
 
+        index = self._modelIndex()
+        if index is not None:
+            for item in items:
+                index.addChild(self, item)
+
+        following = next_row < len(self._children)
+        self._mutableChildren()[next_row:next_row] = items
+        if following:
+            self._shiftRows(next_row, len(items))
         for i, item in enumerate(items):
-            item._parent = self
-            item._row = next_row + i
-            self._children.append(item)
+            self._setChildRow(item, next_row + i)
 
         if self._model is not None:
             for item in items:
                 item._attachToModel(self._model)
             if signalModel:
                 self._model.endInsertRows()
+        self._markDirty()
+
+    def appendChildren(self, items, signalModel=True):
+        self.insertChildren(-1, items, signalModel=signalModel)
 
     def delete(self):
         if self._parent is None:
@@ -191,70 +345,232 @@ class ModelItem:
         else:
             self._parent.deleteChild(self)
 
+    def _childRow(self, item):
+        row = item.row()
+        if row < 0 or row >= len(self._children) or self._children[row] is not item:
+            raise ValueError("item is not a child of this item")
+        return row
+
     def deleteChild(self, arg):
         # Grandchildren are considered deleted automatically
         if isinstance(arg, ModelItem):
-            return self.deleteChild(self._children.index(arg))
+            return self.deleteChild(self._childRow(arg))
         else:
             if arg < 0 or arg >= len(self._children):
                 raise IndexError("child index out of range")
-            self._ensureLoaded(arg)
+            self._removeRows(arg, arg + 1)
+            self._markDirty()
+
+    def deleteChildren(self, args):
+        """
+        Delete several children, given as model items or rows.  The model is
+        notified once for each contiguous range of rows.
+        """
+        rows = set()
+        for arg in args:
+            if isinstance(arg, ModelItem):
+                rows.add(self._childRow(arg))
+            elif arg < 0 or arg >= len(self._children):
+                raise IndexError("child index out of range")
+            else:
+                rows.add(arg)
+        if len(rows) == 0:
+            return
+
+        # Remove the ranges from the end, so that the rows of the remaining
+        # ranges do not change
+        rows = sorted(rows, reverse=True)
+        end = start = rows[0]
+        for row in rows[1:] + [None]:
+            if row is not None and row == start - 1:
+                start = row
+                continue
+            self._removeRows(start, end + 1)
+            if row is not None:
+                end = start = row
+        self._markDirty()
 
-            if self._model is not None:
-                self._model.beginRemoveRows(self.index(), arg, arg)
+    def _removeRows(self, start, end):
+        index = self._modelIndex()
+        if index is not None:
+            for pos in range(start, end):
+                index.addChild(self, self._rawChild(pos), -1)
 
-            del self._children[arg]
+        if not self._loaded:
+            for child in self._children[start:end]:
+                if not isinstance(child, ModelItem):
+                    self._num_unloaded -= 1
+            self._loaded = self._num_unloaded == 0
 
-            # Update cached row numbers
-            for i, c in enumerate(self._children):
-                c._row = i
+        if self._model is not None:
+            self._model.beginRemoveRows(self.index(), start, end - 1)
 
-            if self._model is not None:
-                self._model.endRemoveRows()
+        del self._mutableChildren()[start:end]
+        if start < len(self._children):
+            self._shiftRows(start, start - end)
+
+        if self._model is not None:
+            self._model.endRemoveRows()
 
     def deleteAllChildren(self):
-        self._ensureAllLoaded()
+        if len(self._children) == 0:
+            return
+        index = self._modelIndex()
+        if index is not None:
+            for pos in range(len(self._children)):
+                index.addChild(self, self._rawChild(pos), -1)
         if self._model is not None:
             self._model.beginRemoveRows(self.index(), 0, len(self._children) - 1)
 
         self._children = []
+        self._num_unloaded = 0
+        self._loaded = True
+        self._row_shifts = ()
 
         if self._model is not None:
             self._model.endRemoveRows()
+        self._markDirty()
 
     def getColor(self):
         return None
 
+    def _rawChild(self, pos):
+        """
+        Return the child at ``pos``, which is either a model item or the
+        data of an unloaded child.
+        """
+        return self._children[pos]
+
+    def _isAttached(self):
+        """Whether the item is part of the tree of its model."""
+        item = self
+        while item._parent is not None:
+            parent = item._parent
+            row = item.row()
+            if row < 0 or row >= len(parent._children) or parent._children[row] is not item:
+                return False
+            item = parent
+        return isinstance(item, RootModelItem)
+
+    def _modelIndex(self):
+        """
+        Return the index of the model which needs to be updated for changes
+        of the children, or None.
+        """
+        if self._model is None or self._model._index is None:
+            return None
+        if not self._isAttached():
+            return None
+        return self._model._index
+
+    def _markDirty(self):
+        """
+        Called when the item or one of its children was modified.  The
+        modification is propagated up to the file item.
+        """
+        if self._parent is not None:
+            self._parent._markDirty()
+
 
 class RootModelItem(ModelItem):
+    # Number of file items pulled at once from a file item iterator
+    fetch_batch_size = 1000
+    # Number of file items decoded from a random access source which are
+    # kept for the queries of the views on unloaded children
+    decoded_cache_size = 256
+
     def __init__(self, model, files):
         ModelItem.__init__(self)
         self._model = model
-        self._toload = []
-        for f in files:
-            self._toload.append(f)
-            self._children.append(f)
-        self._loaded = False
+        self._pending = None
+        self._source = None
+        self._decoded = OrderedDict()
+        if isinstance(files, (list, tuple)):
+            self._setUnloadedChildren(files)
+        elif isinstance(files, Sequence):
+            # Random access containers decode file items on access, keep
+            # only the position in the source as placeholder
+            self._source = files
+            self._setUnloadedChildren(range(len(files)))
+        else:
+            # Containers which parse incrementally hand out an iterator,
+            # file items are then fetched in batches on demand
+            self._pending = iter(files)
+            self.fetchMore()
+
+    def _fileInfo(self, pos):
+        """Return the raw file item for the unloaded child at ``pos``."""
+        index = self._children[pos]
+        if self._source is None or isinstance(index, dict):
+            return index
+        # The placeholder is the position in the source, which does not
+        # change when rows are inserted or removed
+        fileinfo = self._decoded.pop(index, None)
+        if fileinfo is None:
+            fileinfo = self._source[index]
+            while len(self._decoded) >= self.decoded_cache_size:
+                self._decoded.popitem(last=False)
+        self._decoded[index] = fileinfo
+        return fileinfo
+
+    def canFetchMore(self):
+        return self._pending is not None
+
+    def fetchMore(self, count=None):
+        """
+        Append up to ``count`` further file items from the file item
+        iterator.  Returns the number of appended items.
+        """
+        if self._pending is None:
+            return 0
+        if count is None:
+            count = self.fetch_batch_size
 
-    def _load(self, index):
-        self._toload.remove(self._children[index])
-        fi = FileModelItem.create(self._children[index])
-        self.replaceChild(index, fi)
-        if len(self._toload) == 0:
-            self._loaded = True
+        try:
+            fileinfos = list(itertools.islice(self._pending, count))
+        except Exception:
+            self._pending = None
+            raise
+        if len(fileinfos) < count:
+            self._pending = None
+
+        if len(fileinfos) > 0:
+            next_row = len(self._children)
+            fetching = self._model is not None and self._model._fetching
+            if self._model is not None:
+                # Fetched items are no modification of the annotations
+                self._model._fetching = True
+                self._model.beginInsertRows(self.index(), next_row, next_row + len(fileinfos) - 1)
+            self._setUnloadedChildren(fileinfos)
+            if self._model is not None:
+                self._model.endInsertRows()
+                self._model._fetching = fetching
+        return len(fileinfos)
+
+    def fetchAll(self):
+        while self.canFetchMore():
+            self.fetchMore()
+
+    def children(self):
+        self.fetchAll()
+        return ModelItem.children(self)
+
+    def _createChild(self, pos):
+        item = FileModelItem.create(self._fileInfo(pos))
+        if self._source is not None and not isinstance(self._children[pos], dict):
+            # The model item may modify the file item
+            del self._decoded[self._children[pos]]
+        return item
 
-    def childHasChildren(self, pos):
+    def _rawChild(self, pos):
         if isinstance(self._children[pos], ModelItem):
-            return self._children[pos].hasChildren()
-        else:
-            # Hack to speed things up...
-            return True
+            return self._children[pos]
+        return self._fileInfo(pos)
 
-    def childFlags(self, row, column):
-        if isinstance(self._children[row], ModelItem):
-            return self._children[row].flags(column)
-        else:
-            return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+    def _unloadedChild(self, pos):
+        if isinstance(self._children[pos], ModelItem):
+            return None
+        return FileModelItem, self._fileInfo(pos)
 
     def appendChild(self, item, signalModel=True):
         if isinstance(item, FileModelItem):
@@ -278,47 +594,206 @@ class RootModelItem(ModelItem):
         LOG.debug("Creation of ModelItems: %.2fs, addition to model: %.2fs" % (diff1, diff2))
 
     def numFiles(self):
-        return len(self.children())
+        self.fetchAll()
+        return len(self._children)
 
     def numAnnotations(self):
-        count = 0
-        for ann in self._model.iterator(AnnotationModelItem):
-            count += 1
-        return count
+        return self._model.numAnnotations()
 
     def getAnnotations(self):
-        return [child.getAnnotations() for child in self.children()
-                if hasattr(child, 'getAnnotations')]
+        """
+        Return the annotations of all file items.  File items which have
+        never been loaded or modified are passed through as read from the
+        label file, without materializing the model items.  The returned
+        structures must therefore not be modified.
+        """
+        self.fetchAll()
+        annotations = []
+        for pos, child in enumerate(self._children):
+            if isinstance(child, ModelItem):
+                if hasattr(child, 'getAnnotations'):
+                    annotations.append(child.getAnnotations())
+            else:
+                annotations.append(self._fileInfo(pos))
+        return annotations
+
+    def snapshotAnnotations(self):
+        """
+        Return a ``FileItemSnapshot`` of the annotations of all file items.
+        Like ``getAnnotations()``, but file items which are still in a
+        random access source, e.g. a slothdb file, are only decoded when the
+        snapshot is read, so that this can be done in a background thread.
+        """
+        self.fetchAll()
+        items = []
+        for pos, child in enumerate(self._children):
+            if isinstance(child, ModelItem):
+                if hasattr(child, 'getAnnotations'):
+                    items.append(child.getAnnotations())
+            else:
+                items.append(child)
+        return FileItemSnapshot(items, self._source)
+
+    def _markDirty(self):
+        # Changes of the file list are tracked by the model
+        pass
+
+
+class FileItemSnapshot(Sequence):
+    """
+    Read-only sequence of the file items of a model at one point in time.
+    The entries are file items, or positions in the random access ``source``
+    of the model, which are decoded when they are accessed.
+
+    ``encodedItem(index)`` returns the file item as stored in the source,
+    if the source provides it, so that containers can write unmodified file
+    items without decoding them.  ``setProgressCallback()`` registers a
+    function which is called with the number of accessed and the number of
+    all file items while the snapshot is read.
+    """
+
+    def __init__(self, items, source=None):
+        self._items = items
+        self._source = source
+        self._progress = None
+        self._reported = -1
+
+    def __len__(self):
+        return len(self._items)
+
+    def setProgressCallback(self, progress):
+        self._progress = progress
+        self._reported = -1
+
+    def _report(self, index):
+        # Report at most 100 times
+        if self._progress is not None:
+            percent = 100 * (index + 1) // max(len(self._items), 1)
+            if percent != self._reported:
+                self._reported = percent
+                self._progress(index + 1, len(self._items))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        item = self._items[index]
+        if self._source is not None and not isinstance(item, Mapping):
+            item = self._source[item]
+        self._report(index % max(len(self._items), 1))
+        return item
+
+    def encodedItem(self, index):
+        """
+        Return the file item at ``index`` as encoded in the source, or None
+        if it was modified or the source cannot provide it.
+        """
+        item = self._items[index]
+        encoded = getattr(self._source, 'encodedItem', None)
+        if encoded is None or isinstance(item, Mapping):
+            return None
+        data = encoded(item)
+        if data is not None:
+            self._report(index % max(len(self._items), 1))
+        return data
+
+
+# Interned sets of hidden keys, shared by all items with the same hidden keys
+_hidden_keys = {}
+
+# Interned tuples of the visible keys, which are shared as placeholders for
+# the key/value rows by all items with the same keys
+_row_keys = {}
+
+
+def _hiddenKeys(hidden):
+    hidden = frozenset(hidden or []).union((None, 'class', 'unlabeled', 'unconfirmed'))
+    return _hidden_keys.setdefault(hidden, hidden)
+
+
+def _numKeyRows(data, hidden, children=None):
+    """
+    Return the number of rows of an item created from ``data``: its visible
+    keys, and the entries of the key ``children``.
+    """
+    hidden = _hiddenKeys(hidden)
+    rows = sum(1 for key in data if key not in hidden and key != children)
+    if children is not None:
+        rows += len(data.get(children, ()))
+    return rows
 
 
 class KeyValueModelItem(ModelItem, MutableMapping):
-    def __init__(self, hidden=None, properties=None):
+    __slots__ = ('_dict', '_shared', '_hidden', '_seen')
+
+    def __init__(self, hidden=None, properties=None, shared=False):
+        """
+        If ``shared`` is True, ``properties`` is used until the first
+        modification instead of being copied.  It is then never modified.
+        """
         ModelItem.__init__(self)
-        self._dict = {}
-        self._items = {}
-        self._hidden = set(hidden or [])
-        self._hidden.update({None, 'class', 'unlabeled', 'unconfirmed'})
+        self._hidden = _hiddenKeys(hidden)
         self._seen = False
-
-        # dummy key/value so that pyqt does not convert the dict
-        # into a QVariantMap while communicating with the Views
-        self._dict[None] = None
+        self._shared = shared and properties is not None
+        if self._shared:
+            self._dict = properties
+        else:
+            self._dict = {}
+            # dummy key/value so that pyqt does not convert the dict
+            # into a QVariantMap while communicating with the Views
+            self._dict[None] = None
         if properties is not None:
-            self._dict.update(properties)
-            items_to_add = []
-            for key in self._dict.keys():
-                if key not in self._hidden:
-                    item = KeyValueRowModelItem(key)
-                    self._items[key] = item
-                    items_to_add.append(item)
-            items_to_add.sort(key=lambda x: x.key())
-            self.appendChildren(items_to_add, False)
+            if not self._shared:
+                self._dict.update(properties)
+            # The rows of the keys are created when they are accessed, e.g.
+            # when the item is expanded in the tree view
+            keys = tuple(sorted(key for key in self._dict.keys() if key not in self._hidden))
+            self._setUnloadedChildren(_row_keys.setdefault(keys, keys))
+
+    def _createChild(self, pos):
+        return KeyValueRowModelItem(self._children[pos])
+
+    def _unloadedChild(self, pos):
+        child = self._children[pos]
+        if isinstance(child, ModelItem):
+            return None
+        if isinstance(child, Mapping):
+            cls = self._mappingChildClass()
+            return (cls, child) if cls is not None else None
+        return KeyValueRowModelItem, child
+
+    def _childKey(self, child):
+        """
+        Return the key of the row ``child``, which is either a key/value row
+        or the key of a row not yet created, or None for other children.
+        """
+        if isinstance(child, KeyValueRowModelItem):
+            return child.key()
+        if isinstance(child, (ModelItem, Mapping)):
+            return None
+        return child
+
+    def _keyRow(self, key):
+        """
+        Return the row of ``key``, or None if it has no row.  The key rows
+        are the first children, so only the rows of the visible keys are
+        searched, not the annotations or frames following them.
+        """
+        if key in self._hidden or key not in self._dict:
+            return None
+        for pos, child in enumerate(self._children):
+            child_key = self._childKey(child)
+            if child_key == key:
+                return pos
+            if child_key is None:
+                break
+        return None
 
     def addChildSorted(self, item, signalModel=True):
         if isinstance(item, KeyValueRowModelItem):
             next_row = 0
             for child in self._children:
-                if not isinstance(child, KeyValueRowModelItem) or child.key() > item.key():
+                key = self._childKey(child)
+                if key is None or key > item.key():
                     break
                 next_row += 1
 
@@ -326,46 +801,68 @@ class KeyValueModelItem(ModelItem, MutableMapping):
         else:
             self.appendChild(item, signalModel)
 
+    def _writableDict(self):
+        """
+        Return the properties for modification, copying shared ones.  Shared
+        views which write through to their storage, such as the records of
+        an ``AnnotationTable``, are not copied.
+        """
+        if self._shared and not getattr(self._dict, 'writable_view', False):
+            d = {None: None}
+            d.update(self._dict)
+            self._dict = d
+            self._shared = False
+        return self._dict
+
     # Methods for MutableMapping
     def __len__(self):
-        return len(self._dict)
+        return len(self._dict) - (None in self._dict)
 
     def __iter__(self):
-        return iter(self._dict.keys())
+        return (key for key in self._dict.keys() if key is not None)
 
     def __getitem__(self, key):
         return self._dict[key]
 
     def _emitDataChanged(self, key=None):
-        if self.model() is not None:
-            if key is not None and key in self._items:
-                index_tl = self._items[key].index()
-                index_br = self._items[key].index(1)
-            else:
-                index_tl = self.index()
-                index_br = self.index(1)
-            self.model().dataChanged.emit(index_tl, index_br)
+        model = self.model()
+        if model is not None:
+            row = self._keyRow(key) if key is not None else None
+            if row is not None and isinstance(self._children[row], ModelItem):
+                model.itemChanged(self._children[row])
+            elif self._parent is not None:
+                model.itemChanged(self)
 
     def __setitem__(self, key, value, signalModel=True):
         if key not in self._dict:
-            self._dict[key] = value
+            self._writableDict()[key] = value
             if key not in self._hidden:
-                self._items[key] = KeyValueRowModelItem(key)
-                self.addChildSorted(self._items[key], signalModel=signalModel)
+                # The views need to know about the new row in any case
+                self.addChildSorted(KeyValueRowModelItem(key))
+            self._markDirty()
             if signalModel:
                 self._emitDataChanged(key)
         elif self._dict[key] != value:
-            self._dict[key] = value
+            self._writableDict()[key] = value
+            self._markDirty()
             # TODO: Emit for hidden key/values?
             if signalModel:
                 self._emitDataChanged(key)
 
     def __delitem__(self, key):
-        del self._dict[key]
-        if key in self._items:
-            self.deleteChild(self._items[key])
+        row = self._keyRow(key)
+        del self._writableDict()[key]
+        self._markDirty()
+        if row is not None:
+            self.deleteChild(row)
 
     def update(self, kvs):
+        """
+        Set several keys at once.  The changes are reported to the model
+        with one dataChanged signal for the item, which makes the views
+        repaint the key rows as well.  Rows of new keys are still signaled
+        as inserted.
+        """
         for key, value in kvs.items():
             self.__setitem__(key, value, False)
         self._emitDataChanged()
@@ -387,7 +884,8 @@ class KeyValueModelItem(ModelItem, MutableMapping):
 
     def setUnlabeled(self, val):
         if val:
-            self._dict['unlabeled'] = val
+            self._writableDict()['unlabeled'] = val
+            self._markDirty()
         else:
             if 'unlabeled' in self._dict:
                 del self['unlabeled']
@@ -398,7 +896,8 @@ class KeyValueModelItem(ModelItem, MutableMapping):
 
     def setUnconfirmed(self, val):
         if val:
-            self._dict['unconfirmed'] = val
+            self._writableDict()['unconfirmed'] = val
+            self._markDirty()
         else:
             if 'unconfirmed' in self._dict:
                 del self['unconfirmed']
@@ -406,23 +905,70 @@ class KeyValueModelItem(ModelItem, MutableMapping):
 
 
 class FileModelItem(KeyValueModelItem):
-    def __init__(self, fileinfo, hidden=None):
+    def __init__(self, fileinfo, hidden=None, raw=None):
         if not hidden: hidden = ['filename']
+        # The file item as read from the label file.  As long as the item is
+        # not modified, it is passed through instead of being serialized
+        # from the model items.
+        self._raw = raw
+        self._version = 0
+        self._saved_version = 0
         KeyValueModelItem.__init__(self, hidden=hidden, properties=fileinfo)
 
+    def _markDirty(self):
+        if self._model is not None:
+            self._version += 1
+            self._raw = None
+            self._model._setFileChanged(self)
+
+    def isDirty(self):
+        """Whether the file item was modified since the last save."""
+        return self._version != self._saved_version
+
+    def version(self):
+        """Counter which is increased on every modification."""
+        return self._version
+
+    def markClean(self, version=None):
+        """
+        Mark the file item as saved.  If ``version`` is given, the item stays
+        dirty if it was modified after this version.
+        """
+        if version is None:
+            version = self._version
+        self._saved_version = version
+
     def data(self, role=Qt.DisplayRole, column=0):
         if role == Qt.DisplayRole:
-            if column == 0:
-                return ('* ' if not self._seen else '') + os.path.basename(self['filename'])
-            elif column == 1 and self.isUnlabeled():
-                return '[unlabeled]'
+            return self._fileDisplay(self, column, self._seen)
         return ModelItem.data(self, role, column)
 
-    def getColor(self):
-        if self.isUnlabeled():
+    @staticmethod
+    def _fileDisplay(fileinfo, column, seen):
+        if column == 0:
+            return ('* ' if not seen else '') + os.path.basename(fileinfo['filename'])
+        elif column == 1 and fileinfo.get('unlabeled'):
+            return '[unlabeled]'
+        return ""
+
+    @staticmethod
+    def _displayOf(parent, fileinfo, column):
+        return FileModelItem._fileDisplay(fileinfo, column, False)
+
+    @staticmethod
+    def _colorOf(fileinfo):
+        if fileinfo.get('unlabeled'):
             return Qt.red
         return None
 
+    @staticmethod
+    def _rowCountOf(fileinfo):
+        children = 'frames' if fileinfo.get('class') == 'video' else 'annotations'
+        return _numKeyRows(fileinfo, ['filename'], children)
+
+    def getColor(self):
+        return self._colorOf(self)
+
     @staticmethod
     def create(fileinfo):
         if fileinfo['class'] == 'image':
@@ -432,16 +978,25 @@ class FileModelItem(KeyValueModelItem):
 
 
 class ImageModelItem(ModelItem):
+    __slots__ = ()
+
     def __init__(self, annotations):
         ModelItem.__init__(self)
-        items_to_add = [AnnotationModelItem(ann) for ann in annotations]
+        items_to_add = [AnnotationModelItem(ann, shared=True) for ann in annotations]
         self.appendChildren(items_to_add, False)
 
+    def _mappingChildClass(self):
+        return AnnotationModelItem
+
     def addAnnotation(self, ann, signalModel=True):
         self.addChildSorted(AnnotationModelItem(ann), signalModel=signalModel)
 
+    def addAnnotations(self, anns, signalModel=True):
+        """Append the annotations ``anns`` with a single model update."""
+        self.appendChildren([AnnotationModelItem(ann) for ann in anns], signalModel=signalModel)
+
     def annotations(self):
-        for child in self._children:
+        for child in self.children():
             if isinstance(child, AnnotationModelItem):
                 yield child
 
@@ -453,22 +1008,15 @@ class ImageModelItem(ModelItem):
 class ImageFileModelItem(FileModelItem, ImageModelItem):
     def __init__(self, fileinfo):
         self._annotation_data = fileinfo.get("annotations", [])
-        if "annotations" in fileinfo:
-            del fileinfo["annotations"]
-        FileModelItem.__init__(self, fileinfo)
+        properties = dict((k, v) for k, v in fileinfo.items() if k != "annotations")
+        FileModelItem.__init__(self, properties, raw=fileinfo)
         ImageModelItem.__init__(self, [])
-        self._toload = []
-        for ann in self._annotation_data:
-            self._children.append(ann)
-            self._toload.append(ann)
-        self._loaded = False        
+        self._setUnloadedChildren(self._annotation_data)
 
-    def _load(self, index):
-        self._toload.remove(self._children[index])
-        ann = AnnotationModelItem(self._children[index])
-        self.replaceChild(index, ann)
-        if len(self._toload) == 0:
-            self._loaded = True
+    def _createChild(self, pos):
+        if isinstance(self._children[pos], Mapping):
+            return AnnotationModelItem(self._children[pos], shared=True)
+        return FileModelItem._createChild(self, pos)
 
     def data(self, role=Qt.DisplayRole, column=0):
         if role == DataRole:
@@ -476,6 +1024,8 @@ class ImageFileModelItem(FileModelItem, ImageModelItem):
         return FileModelItem.data(self, role, column)
 
     def getAnnotations(self):
+        if self._raw is not None:
+            return self._raw
         self._ensureAllLoaded()
         fi = KeyValueModelItem.getAnnotations(self)
         fi['annotations'] = [child.getAnnotations() for child in self.children()
@@ -486,26 +1036,36 @@ class ImageFileModelItem(FileModelItem, ImageModelItem):
 class VideoFileModelItem(FileModelItem):
     def __init__(self, fileinfo):
         frameinfos = fileinfo.get("frames", [])
-        if "frames" in fileinfo:
-            del fileinfo["frames"]
-        FileModelItem.__init__(self, fileinfo)
+        properties = dict((k, v) for k, v in fileinfo.items() if k != "frames")
+        FileModelItem.__init__(self, properties, raw=fileinfo)
+        # The frames are created when they are accessed
+        self._setUnloadedChildren(frameinfos)
 
-        items_to_add = [FrameModelItem(frameinfo) for frameinfo in frameinfos]
-        self.appendChildren(items_to_add, False)
+    def _createChild(self, pos):
+        if isinstance(self._children[pos], Mapping):
+            return FrameModelItem(self._children[pos])
+        return FileModelItem._createChild(self, pos)
+
+    def _mappingChildClass(self):
+        return FrameModelItem
 
     def getAnnotations(self):
-        self._ensureAllLoaded()
+        if self._raw is not None:
+            return self._raw
         fi = KeyValueModelItem.getAnnotations(self)
-        fi['frames'] = [child.getAnnotations() for child in self.children()]
+        # Frames which were never accessed are passed through
+        fi['frames'] = [child.getAnnotations() if isinstance(child, ModelItem) else child
+                        for child in self._children if isinstance(child, (FrameModelItem, Mapping))]
         return fi
 
 
 class FrameModelItem(ImageModelItem, KeyValueModelItem):
+    __slots__ = ()
+
     def __init__(self, frameinfo):
         annotations = frameinfo.get("annotations", [])
-        if "annotations" in frameinfo:
-            del frameinfo["annotations"]
-        KeyValueModelItem.__init__(self, properties=frameinfo)
+        properties = dict((k, v) for k, v in frameinfo.items() if k != "annotations")
+        KeyValueModelItem.__init__(self, properties=properties)
         ImageModelItem.__init__(self, annotations)
 
     def framenum(self):
@@ -516,17 +1076,30 @@ class FrameModelItem(ImageModelItem, KeyValueModelItem):
 
     def data(self, role=Qt.DisplayRole, column=0):
         if role == Qt.DisplayRole:
-            if column == 0:
-                return "%d / %.3f" % (self.framenum(), self.timestamp())
-            elif column == 1 and self.isUnlabeled():
-                return '[unlabeled]'
+            return self._displayOf(self._parent, self, column)
         return ImageModelItem.data(self, role, column)
 
-    def getColor(self):
-        if self.isUnlabeled():
+    @staticmethod
+    def _displayOf(parent, frame, column):
+        if column == 0:
+            return "%d / %.3f" % (int(frame.get('num', -1)), float(frame.get('timestamp', -1)))
+        elif column == 1 and frame.get('unlabeled'):
+            return '[unlabeled]'
+        return ""
+
+    @staticmethod
+    def _colorOf(frame):
+        if frame.get('unlabeled'):
             return Qt.red
         return None
 
+    @staticmethod
+    def _rowCountOf(frame):
+        return _numKeyRows(frame, None, 'annotations')
+
+    def getColor(self):
+        return self._colorOf(self)
+
     def getAnnotations(self):
         fi = KeyValueModelItem.getAnnotations(self)
         fi['annotations'] = [child.getAnnotations() for child in self.children()
@@ -535,33 +1108,69 @@ class FrameModelItem(ImageModelItem, KeyValueModelItem):
 
 
 class AnnotationModelItem(KeyValueModelItem):
-    def __init__(self, annotation):
-        KeyValueModelItem.__init__(self, properties=annotation)
+    __slots__ = ()
+
+    def __init__(self, annotation, shared=False):
+        KeyValueModelItem.__init__(self, properties=annotation, shared=shared)
+
+    def __setitem__(self, key, value, signalModel=True):
+        if key == 'class':
+            index = self._modelIndex()
+            if index is not None:
+                index.addAnnotation(self, -1)
+                KeyValueModelItem.__setitem__(self, key, value, signalModel)
+                index.addAnnotation(self)
+                return
+        KeyValueModelItem.__setitem__(self, key, value, signalModel)
+
+    def __delitem__(self, key):
+        if key == 'class':
+            index = self._modelIndex()
+            if index is not None:
+                index.addAnnotation(self, -1)
+                KeyValueModelItem.__delitem__(self, key)
+                index.addAnnotation(self)
+                return
+        KeyValueModelItem.__delitem__(self, key)
 
     # Delegated from QAbstractItemModel
     def data(self, role=Qt.DisplayRole, column=0):
         if role == Qt.DisplayRole:
-            if column == 0:
-                try:
-                    return self['class']
-                except KeyError:
-                    LOG.error('Could not find key class in annotation item. Please check your label file.')
-                    return '<error - no class set>'
-            elif column == 1 and self.isUnconfirmed():
-                return '[unconfirmed]'
-            else:
-                return ""
+            return self._displayOf(self._parent, self, column)
         elif role == DataRole:
-            return self._annotation
+            return self._dict
         return ModelItem.data(self, role, column)
 
-    def getColor(self):
-        if self.isUnconfirmed():
+    @staticmethod
+    def _displayOf(parent, annotation, column):
+        if column == 0:
+            try:
+                return annotation['class']
+            except KeyError:
+                LOG.error('Could not find key class in annotation item. Please check your label file.')
+                return '<error - no class set>'
+        elif column == 1 and annotation.get('unconfirmed'):
+            return '[unconfirmed]'
+        else:
+            return ""
+
+    @staticmethod
+    def _colorOf(annotation):
+        if annotation.get('unconfirmed'):
             return Qt.red
         return None
 
+    @staticmethod
+    def _rowCountOf(annotation):
+        return _numKeyRows(annotation, None)
+
+    def getColor(self):
+        return self._colorOf(self)
+
 
 class KeyValueRowModelItem(ModelItem):
+    __slots__ = ('_key', '_read_only')
+
     def __init__(self, key, read_only=True):
         ModelItem.__init__(self)
         self._key = key
@@ -572,15 +1181,28 @@ class KeyValueRowModelItem(ModelItem):
 
     def data(self, role=Qt.DisplayRole, column=0):
         if role == Qt.DisplayRole:
-            if column == 0:
-                return self._key
-            elif column == 1:
-                return self.parent()[self._key]
-            else:
-                return None
+            return self._displayOf(self.parent(), self._key, column)
         else:
             return ModelItem.data(self, role, column)
 
+    @staticmethod
+    def _displayOf(parent, key, column):
+        if column == 0:
+            return key
+        elif column == 1:
+            return parent[key]
+        else:
+            return None
+
+    @staticmethod
+    def _flagsOf(key, column):
+        # Rows created for unloaded keys are read only
+        return Qt.NoItemFlags
+
+    @staticmethod
+    def _rowCountOf(key):
+        return 0
+
     def flags(self, column):
         if self._read_only:
             return Qt.NoItemFlags
@@ -599,6 +1221,103 @@ class KeyValueRowModelItem(ModelItem):
         return False
 
 
+class AnnotationIndex:
+    """
+    Counts of the file items by class, of the frames, and of the annotations
+    by class in an ``AnnotationModel``.  The counts are taken from the model
+    items, or from the data of children which are not yet loaded, so that
+    no model items need to be created.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.frames = 0
+        self.annotations = {}
+
+    def _count(self, counts, key, sign):
+        count = counts.get(key, 0) + sign
+        if count:
+            counts[key] = count
+        else:
+            del counts[key]
+
+    def addAnnotation(self, ann, sign=1):
+        self._count(self.annotations, ann.get('class'), sign)
+
+    def addImage(self, image, sign=1):
+        """Count the annotations of an image or frame."""
+        if isinstance(image, ModelItem):
+            for child in image._children:
+                if isinstance(child, (AnnotationModelItem, Mapping)):
+                    self.addAnnotation(child, sign)
+        else:
+            for ann in image.get('annotations', []):
+                self.addAnnotation(ann, sign)
+
+    def addFrame(self, frame, sign=1):
+        self.frames += sign
+        self.addImage(frame, sign)
+
+    def addFile(self, fileinfo, sign=1):
+        self._count(self.files, fileinfo.get('class'), sign)
+        if isinstance(fileinfo, VideoFileModelItem):
+            for child in fileinfo._children:
+                if isinstance(child, (FrameModelItem, Mapping)):
+                    self.addFrame(child, sign)
+        elif isinstance(fileinfo, ModelItem) or fileinfo.get('class') != 'video':
+            self.addImage(fileinfo, sign)
+        else:
+            for frame in fileinfo.get('frames', []):
+                self.addFrame(frame, sign)
+
+    def addChild(self, parent, child, sign=1):
+        """
+        Count the child ``child`` of ``parent``, which is either a model item
+        or the data of an unloaded child.
+        """
+        if isinstance(child, FileModelItem) or \
+                (isinstance(parent, RootModelItem) and not isinstance(child, ModelItem)):
+            self.addFile(child, sign)
+        elif isinstance(child, FrameModelItem) or \
+                (isinstance(parent, VideoFileModelItem) and isinstance(child, Mapping)):
+            self.addFrame(child, sign)
+        elif isinstance(child, (AnnotationModelItem, Mapping)):
+            self.addAnnotation(child, sign)
+
+
+def _annotationData(fileinfo):
+    """
+    Yield the annotations of the file item ``fileinfo``, which is either a
+    model item or the data of an unloaded file.  Annotations which are not
+    loaded are yielded as their data.
+    """
+    if isinstance(fileinfo, VideoFileModelItem):
+        images = [child for child in fileinfo._children if isinstance(child, (FrameModelItem, Mapping))]
+    elif isinstance(fileinfo, ModelItem) or fileinfo.get('class') != 'video':
+        images = [fileinfo]
+    else:
+        images = fileinfo.get('frames', [])
+    for image in images:
+        if isinstance(image, ModelItem):
+            for child in image._children:
+                if isinstance(child, (AnnotationModelItem, Mapping)):
+                    yield child
+        else:
+            for ann in image.get('annotations', []):
+                yield ann
+
+
+# Types of the items which can be found below the items of a type, used to
+# skip subtrees which cannot contain the items searched by iterator()
+_DESCENDANT_TYPES = {
+    ImageFileModelItem: (AnnotationModelItem, KeyValueRowModelItem),
+    VideoFileModelItem: (FrameModelItem, AnnotationModelItem, KeyValueRowModelItem),
+    FrameModelItem: (AnnotationModelItem, KeyValueRowModelItem),
+    AnnotationModelItem: (KeyValueRowModelItem, ),
+    KeyValueRowModelItem: (),
+}
+
+
 class AnnotationModel(QAbstractItemModel):
     # signals
     dirtyChanged = pyqtSignal(bool, name='dirtyChanged')
@@ -609,6 +1328,14 @@ class AnnotationModel(QAbstractItemModel):
         start = time.time()
         self._annotations = annotations
         self._dirty = False
+        self._generation = 0
+        self._fetching = False
+        self._changed_files = {}
+        self._files_shifted = False
+        self._index = None
+        # Changed items per parent, collected during batchUpdate()
+        self._batch_depth = 0
+        self._batch_changes = {}
         self._root = RootModelItem(self, annotations)
         diff = time.time() - start
         LOG.info("Created AnnotationModel in %.2fs" % (diff, ))
@@ -617,6 +1344,11 @@ class AnnotationModel(QAbstractItemModel):
         self.rowsInserted.connect(self.onDataChanged)
         self.rowsRemoved.connect(self.onDataChanged)
 
+        # Track changes of the file list for incremental saving, changes of
+        # the file items themselves are reported by the items
+        self.rowsInserted.connect(self.onFileRowsInserted)
+        self.rowsRemoved.connect(self.onFileRowsRemoved)
+
     # QAbstractItemModel overloads
     def hasChildren(self, index=QModelIndex()):
         if index.column() > 0:
@@ -680,6 +1412,15 @@ class AnnotationModel(QAbstractItemModel):
         parent = self.parentFromIndex(index)
         return parent.childFlags(index.row(), index.column())
 
+    def canFetchMore(self, index=QModelIndex()):
+        if not index.isValid():
+            return self._root.canFetchMore()
+        return False
+
+    def fetchMore(self, index=QModelIndex()):
+        if not index.isValid():
+            self._root.fetchMore()
+
     def headerData(self, section, orientation, role):
         if orientation == Qt.Horizontal and role == Qt.DisplayRole:
             if section == 0:
@@ -702,7 +1443,129 @@ class AnnotationModel(QAbstractItemModel):
             self.dirtyChanged.emit(self._dirty)
 
     def onDataChanged(self, *args):
-        self.setDirty()
+        if not self._fetching:
+            self._generation += 1
+            self.setDirty()
+
+    def generation(self):
+        """Counter which is increased on every modification of the model."""
+        return self._generation
+
+    @contextlib.contextmanager
+    def batchUpdate(self):
+        """
+        Context manager which defers the dataChanged signals of the items
+        changed in its block.  When the outermost block is left, one
+        dataChanged signal is emitted per parent, covering the range of
+        rows of all its changed children.  Insertions and removals of rows
+        are still signaled immediately::
+
+            with model.batchUpdate():
+                for item in items:
+                    item.update(values)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flushChanges()
+
+    def itemChanged(self, item):
+        """
+        Report that the data of ``item`` changed, either immediately or at
+        the end of the current batchUpdate().
+        """
+        parent = item.parent()
+        if self._batch_depth > 0:
+            changes = self._batch_changes.get(id(parent))
+            if changes is None:
+                changes = self._batch_changes[id(parent)] = (parent, {})
+            changes[1][id(item)] = item
+        else:
+            row = item.row()
+            self.dataChanged.emit(self.createIndex(row, 0, parent),
+                                  self.createIndex(row, self.columnCount() - 1, parent))
+
+    def _flushChanges(self):
+        changes = self._batch_changes
+        self._batch_changes = {}
+        for parent, items in changes.values():
+            if not parent._isAttached():
+                # removed during the batch update
+                continue
+            rows = []
+            for item in items.values():
+                row = item.row()
+                if item.parent() is parent and 0 <= row < len(parent._children) and \
+                        parent._children[row] is item:
+                    rows.append(row)
+            if len(rows) > 0:
+                self.dataChanged.emit(self.createIndex(min(rows), 0, parent),
+                                      self.createIndex(max(rows), self.columnCount() - 1, parent))
+
+    def _setFileChanged(self, item):
+        self._changed_files[id(item)] = item
+
+    def onFileRowsInserted(self, index, first, last):
+        if not self._fetching and not index.isValid():
+            if last + 1 < self._root.rowCount():
+                # Rows of the following file items changed
+                self._files_shifted = True
+            for row in range(first, last + 1):
+                self._root.childAt(row)._markDirty()
+
+    def onFileRowsRemoved(self, index, first, last):
+        if not index.isValid():
+            # Rows of the following file items changed
+            self._files_shifted = True
+
+    def fileChanges(self):
+        """
+        Return the changes since the last call to ``clearFileChanges()`` as
+        list of (row, annotations) tuples, one per dirty file item, sorted
+        by row.  Returns None if file items have been removed or inserted
+        before other file items, in which case the changes cannot be
+        expressed per file item.
+        """
+        if self._files_shifted:
+            return None
+        # The changed file items are tracked by identity, their rows are
+        # looked up now
+        items = list(self._changed_files.values())
+        if not all(item._isAttached() for item in items):
+            return None
+        changes = [(item.row(), item.getAnnotations()) for item in items]
+        changes.sort(key=lambda change: change[0])
+        return changes
+
+    def saveState(self):
+        """
+        Return the modification state of the model, to be passed to
+        ``markSaved()`` once the annotations returned by ``getAnnotations()``
+        at the same time have been written.
+        """
+        versions = [(item, item.version()) for item in self._changed_files.values()]
+        return self._generation, versions
+
+    def markSaved(self, state):
+        """
+        Mark the model as saved in the given state.  Modifications that
+        happened after the state was taken stay dirty.
+        """
+        generation, versions = state
+        for item, version in versions:
+            item.markClean(version)
+            if not item.isDirty():
+                self._changed_files.pop(id(item), None)
+        if generation == self._generation:
+            self._files_shifted = False
+            self.setDirty(False)
+
+    def clearFileChanges(self):
+        """Mark all file items as saved."""
+        self.markSaved(self.saveState())
 
     def itemFromIndex(self, index):
         index = QModelIndex(index)  # explicitly convert from QPersistentModelIndex
@@ -716,6 +1579,68 @@ class AnnotationModel(QAbstractItemModel):
             return index.internalPointer()
         return self._root
 
+    def hasAnnotationIndex(self):
+        """Whether the ``AnnotationIndex`` has been built."""
+        return self._index is not None
+
+    def annotationIndex(self):
+        """
+        Return the ``AnnotationIndex`` of the model.  It is built on the first
+        call, which requires all file items to be fetched, and updated on
+        every change afterwards.
+        """
+        if self._index is None:
+            start = time.time()
+            self._root.fetchAll()
+            index = AnnotationIndex()
+            for pos in range(len(self._root._children)):
+                index.addChild(self._root, self._root._rawChild(pos))
+            self._index = index
+            LOG.debug("Built annotation index in %.2fs" % (time.time() - start))
+        return self._index
+
+    def numFiles(self, _class=None):
+        """The number of file items, optionally only of the given class."""
+        files = self.annotationIndex().files
+        if _class is None:
+            return sum(files.values())
+        return files.get(_class, 0)
+
+    def numFrames(self):
+        """The number of video frames."""
+        return self.annotationIndex().frames
+
+    def numAnnotations(self, _class=None):
+        """The number of annotations, optionally only of the given class."""
+        annotations = self.annotationIndex().annotations
+        if _class is None:
+            return sum(annotations.values())
+        return annotations.get(_class, 0)
+
+    def annotationClasses(self):
+        """Return a dict mapping the annotation classes to their counts."""
+        return dict(self.annotationIndex().annotations)
+
+    def iterAnnotationData(self):
+        """
+        Iterate over all annotations without creating model items.  Loaded
+        annotations are yielded as ``AnnotationModelItem``, the others as
+        their data, which must not be modified.
+        """
+        self._root.fetchAll()
+        for pos in range(len(self._root._children)):
+            for ann in _annotationData(self._root._rawChild(pos)):
+                yield ann
+
+    def _mayContain(self, item, _class):
+        types = _DESCENDANT_TYPES.get(type(item))
+        if types is None:
+            return True
+        for t in types:
+            if issubclass(t, _class):
+                return True
+        return False
+
     def iterator(self, _class=None, predicate=None, start=None, maxlevels=10000):
         # Visit all nodes
         level = 0
@@ -726,8 +1651,10 @@ class AnnotationModel(QAbstractItemModel):
                 if predicate is None or predicate(item):
                     yield item
 
-            # Get next item
-            if item.rowCount() > 0 and level < maxlevels:
+            # Get next item, subtrees which cannot contain items of _class
+            # are skipped without loading them
+            if item.rowCount() > 0 and level < maxlevels and \
+                    (_class is None or self._mayContain(item, _class)):
                 level += 1
                 item = item.childAt(0)
             else:
@@ -786,8 +1713,23 @@ class AnnotationSortFilterProxyModel(QSortFilterProxyModel):
 #######################################################################################
 
 class AnnotationTreeView(QTreeView):
+    """
+    Tree view of the annotation model.  The columns are resized with a delay
+    after rows were inserted or expanded, so that a burst of changes causes
+    a single resize.  All rows have the same height, so the view computes
+    the positions of the rows without asking the model for their sizes.  If
+    the model has more than ``large_model_rows`` top level rows, animations
+    and sorting are turned off, and the column widths are only grown to fit
+    the rows in the viewport instead of measuring all expanded rows.
+    """
     selectedItemsChanged = pyqtSignal(object)
 
+    # Number of top level rows above which the view switches to large mode
+    large_model_rows = 10000
+    # Delay in ms of resizing the columns after rows were inserted, expanded
+    # or scrolled into view
+    resize_delay = 200
+
     def __init__(self, parent=None):
         super(AnnotationTreeView, self).__init__(parent)
 
@@ -799,22 +1741,84 @@ class AnnotationTreeView(QTreeView):
         #self.setEditTriggers(QAbstractItemView.SelectedClicked)
         self.setSortingEnabled(True)
         self.setAnimated(True)
+        self._large = False
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(self.resize_delay)
+        self._resize_timer.timeout.connect(self.resizeColumns)
         self.expanded.connect(self.onExpanded)
+        self.verticalScrollBar().valueChanged.connect(self.onScrolled)
+
+    def isLargeModel(self):
+        return self._large
+
+    def updateMode(self):
+        """Switch between the normal and the large mode for the model size."""
+        model = self.model()
+        large = model is not None and model.rowCount(QModelIndex()) > self.large_model_rows
+        if large != self._large:
+            LOG.debug("Tree view in %s mode" % ("large model" if large else "normal"))
+            self._large = large
+            self.setAnimated(not large)
+            self.setSortingEnabled(not large)
+        if large and not self.uniformRowHeights():
+            # Otherwise the view queries the size of every row
+            self.setUniformRowHeights(True)
+
+    def scheduleResize(self):
+        """Resize the columns once no rows were inserted for a while."""
+        self._resize_timer.start()
 
     def resizeColumns(self):
-        for column in range(self.model().columnCount(QModelIndex())):
-            self.resizeColumnToContents(column)
+        if self.model() is None:
+            return
+        if self._large:
+            self.resizeColumnsToVisibleRows()
+        else:
+            for column in range(self.model().columnCount(QModelIndex())):
+                self.resizeColumnToContents(column)
+
+    def resizeColumnsToVisibleRows(self):
+        """
+        Grow the columns to fit the rows in the viewport.  Only the visible
+        rows are measured, so the cost does not depend on the model size.
+        """
+        columns = self.model().columnCount(QModelIndex())
+        widths = [self.columnWidth(column) for column in range(columns)]
+        height = self.viewport().height()
+        index = self.indexAt(QPoint(0, 0))
+        while index.isValid():
+            rect = self.visualRect(index)
+            if rect.top() > height:
+                break
+            for column in range(columns):
+                cell = index.sibling(index.row(), column)
+                width = self.sizeHintForIndex(cell).width()
+                # Include the indentation of the first column
+                width += self.visualRect(cell).left() - self.columnViewportPosition(column)
+                widths[column] = max(widths[column], width)
+            index = self.indexBelow(index)
+        for column, width in enumerate(widths):
+            if width > self.columnWidth(column):
+                self.setColumnWidth(column, width)
 
     def onExpanded(self):
-        self.resizeColumns()
+        self.scheduleResize()
+
+    def onScrolled(self, value):
+        if self._large:
+            self.scheduleResize()
 
     def setModel(self, model):
         QTreeView.setModel(self, model)
+        self.updateMode()
         self.resizeColumns()
 
     def rowsInserted(self, index, start, end):
         QTreeView.rowsInserted(self, index, start, end)
-        self.resizeColumns()
+        if not index.isValid():
+            self.updateMode()
+        self.scheduleResize()
 
     def setSelectedItems(self, items):
         #block = self.blockSignals(True)
@@ -837,6 +1841,11 @@ class AnnotationTreeView(QTreeView):
 
 # copy annotations from previous image
 class CopyAnnotations(QObject):
+    """
+    Copy the annotations of the previous images or frames to the current
+    one.  Annotations overlapping an annotation of the current image by more
+    than ``overlap_threshold`` (intersection over union) are not copied.
+    """
     def __init__(self, labeltool, class_filter=None, frame_range=1, overlap_threshold=None, prefix=''):
         QObject.__init__(self)
 
@@ -851,43 +1860,81 @@ class CopyAnnotations(QObject):
     def copy(self):
         current = self._labeltool.currentImage()
 
+        existing = self.filterAnnotations([dict(ann) for ann in current.annotations()])
+        to_add = []
         prev = current.getPreviousSibling()
         num_back = self._frame_range
 
         while num_back > 0 and prev is not None:
-            for annotation in self.getAnnotationsFiltered(prev):
-                LOG.debug("num_back: %d, annotation: %s", num_back, str(annotation))
-                # check for overlap with annotations in current
-                if self._overlap_threshold is not None:
-                    r1 = self.getRect(annotation)
-                    if r1 is not None:
-                        cont = False
-                        for curr_ann in self.getAnnotationsFiltered(current):
-                            r2 = self.getRect(curr_ann)
-                            if r2 is not None:
-                                o = self.overlap(r1, r2)
-                                LOG.debug("overlap between %s and %s: %f", str(r1), str(r2), o)
-                                if o > self._overlap_threshold:
-                                    cont = True
-                                    break
-                        if cont:
-                            continue # do not copy
-
-                # copy the annotation
-                current.addAnnotation(annotation)
+            candidates = self.getAnnotationsFiltered(prev)
+            to_add.extend(self.selectAnnotations(existing + to_add, candidates))
 
             prev = prev.getPreviousSibling()
             num_back -= 1
 
+        # copy the annotations in one update
+        current.addAnnotations([copy.deepcopy(ann) for ann in to_add])
+
+    def propagate(self, frames):
+        """
+        Copy the annotations of the frames ``frames``, given as dicts, to
+        the following frames in order, such that the annotations are
+        propagated through the whole video.  Returns the number of copied
+        annotations.
+        """
+        count = 0
+        for pos, frame in enumerate(frames):
+            existing = self.filterAnnotations(frame.get('annotations', []))
+            to_add = []
+            for prev in frames[max(pos - self._frame_range, 0):pos][::-1]:
+                candidates = self.filterAnnotations(prev.get('annotations', []))
+                to_add.extend(self.selectAnnotations(existing + to_add, candidates))
+            if len(to_add) > 0:
+                frame.setdefault('annotations', []).extend(copy.deepcopy(to_add))
+                count += len(to_add)
+        return count
+
+    def filterAnnotations(self, annotations):
+        # check class filter
+        if self._class_filter is None:
+            return list(annotations)
+        return [ann for ann in annotations if ann.get('class', None) in self._class_filter]
+
     def getAnnotationsFiltered(self, image_item):
-        annotations = []
-        for annotation in image_item.getAnnotations()['annotations']:
-            # check class filter
-            if self._class_filter is not None:
-                if annotation.get('class', None) not in self._class_filter:
-                    continue  # do not copy
-            annotations.append(annotation)
-        return annotations
+        return self.filterAnnotations([dict(ann) for ann in image_item.annotations()])
+
+    def selectAnnotations(self, current, candidates):
+        """
+        Return the annotations of ``candidates`` to copy to an image with the
+        annotations ``current``.  A candidate is not copied if it overlaps an
+        annotation of ``current`` or an earlier copied candidate by more than
+        the overlap threshold.  Annotations without rect are always copied.
+        """
+        if self._overlap_threshold is None or len(candidates) == 0:
+            return list(candidates)
+
+        rects = [self.getRect(ann) for ann in candidates]
+        with_rect = [i for i, r in enumerate(rects) if r is not None]
+        current_rects = [r for r in (self.getRect(ann) for ann in current) if r is not None]
+
+        # Overlaps with the current annotations, and between the candidates
+        blocked = np.zeros(len(candidates), dtype=bool)
+        pairs = np.zeros((len(candidates), len(candidates)), dtype=bool)
+        if len(with_rect) > 0:
+            cand_rects = [rects[i] for i in with_rect]
+            if len(current_rects) > 0:
+                blocked[with_rect] = (self.overlaps(cand_rects, current_rects) > self._overlap_threshold).any(axis=1)
+            pairs[np.ix_(with_rect, with_rect)] = self.overlaps(cand_rects, cand_rects) > self._overlap_threshold
+
+        selected = []
+        for i, ann in enumerate(candidates):
+            if rects[i] is not None:
+                if blocked[i]:
+                    LOG.debug("not copying overlapping annotation: %s", str(ann))
+                    continue
+                blocked |= pairs[i]
+            selected.append(ann)
+        return selected
 
     def getRect(self, annotation):
         keys = ['x', 'y', 'width', 'height']
@@ -896,6 +1943,20 @@ class CopyAnnotations(QObject):
                 return None
         return [annotation[self._prefix + key] for key in keys]
 
+    def overlaps(self, rects1, rects2):
+        """
+        Return the matrix of the overlaps of all rects ``rects1`` with all
+        rects ``rects2``, given as (x, y, width, height).
+        """
+        r1 = np.asarray(rects1, dtype=float).reshape(-1, 1, 4)
+        r2 = np.asarray(rects2, dtype=float).reshape(1, -1, 4)
+        w = np.minimum(r1[..., 0] + r1[..., 2], r2[..., 0] + r2[..., 2]) - np.maximum(r1[..., 0], r2[..., 0])
+        h = np.minimum(r1[..., 1] + r1[..., 3], r2[..., 1] + r2[..., 3]) - np.maximum(r1[..., 1], r2[..., 1])
+        ia = np.maximum(w, 0) * np.maximum(h, 0)
+        union = r1[..., 2] * r1[..., 3] + r2[..., 2] * r2[..., 3] - ia
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, ia / union, 0.)
+
     def overlap(self, r1, r2):
         ia = float(self.area(self.intersect(r1, r2)))
         union = self.area(r1) + self.area(r2) - ia
@@ -913,6 +1974,17 @@ class CopyAnnotations(QObject):
 
 # interpolate annotations between two annotated images
 class InterpolateRange(QObject):
+    """
+    Interpolate the annotations of the frames between the current frame and
+    the previous labeled frame.  The annotations of the two labeled frames
+    are matched by their ``id`` key if all of them have one, otherwise by
+    their ``class`` and ``type``.  Numeric values and ``;``-separated lists
+    of numbers are interpolated for all frames and objects at once.
+    """
+
+    # Key used to match the annotations of the first and the last frame
+    id_key = 'id'
+
     def __init__(self, labeltool):
         QObject.__init__(self)
 
@@ -944,6 +2016,10 @@ class InterpolateRange(QObject):
         return False
 
     def interpolate(self, p1, p2, step, steps):
+        """
+        Interpolate between ``p1`` and ``p2``.  Called with numpy arrays of
+        the values of all objects and a column of all steps.
+        """
         xr = p2 - p1
         xnew = p1+(xr/(steps+1))*step
         return xnew
@@ -954,6 +2030,110 @@ class InterpolateRange(QObject):
                 return False
         return True
 
+    def matchAnnotations(self, fann, lann):
+        """
+        Return a list of (first, last) pairs of the matching annotations of
+        the first and the last frame, or None if they cannot be matched.
+        Annotations of the first frame without a match are paired with None,
+        and are copied unchanged into the frames in between.
+        """
+        key = self.id_key
+        if key is not None and len(fann) > 0 and \
+                all(key in ann for ann in fann) and all(key in ann for ann in lann):
+            lastById = dict((ann[key], ann) for ann in lann)
+            pairs = []
+            for ann in fann:
+                if ann[key] in lastById:
+                    pairs.append((ann, lastById[ann[key]]))
+                else:
+                    LOG.error("Error: could not find label with %s %s, not interpolating it" % (key, ann[key]))
+                    pairs.append((ann, None))
+            return pairs
+
+        if len(fann) != len(lann): # TODO needed?
+            LOG.error("Error: Annotation count differs in first and last labeled frames, aborting")
+            return None
+        pairs = []
+        for ann in fann:
+            # find which "last annotation" matches a certain first
+            match = None
+            for l in lann:
+                if l.get('type') == ann.get('type') and l.get('class') == ann.get('class'):
+                    match = l
+            if match is None:
+                LOG.error("Error: could not find matching label, not interpolating it")
+            pairs.append((ann, match))
+        return pairs
+
+    def _parseValues(self, fvalue, lvalue):
+        """
+        Return the numbers to interpolate of a value in the first and the
+        last frame, and whether it is a list of numbers, or None if the value
+        is not interpolated.
+        """
+        if type(fvalue) in (float, int):
+            if type(lvalue) not in (float, int):
+                return None
+            return [fvalue], [lvalue], False
+        if isinstance(fvalue, str) and ";" in fvalue: # assume its a multi-value list?
+            frawVals = fvalue.split(";")
+            lrawVals = lvalue.split(";") if isinstance(lvalue, str) else []
+            if len(frawVals) != len(lrawVals):
+                raise ValueError("multi-value objects on first/last frame differ")
+            if not self.getStrNumType(frawVals[0]):
+                raise ValueError("unknown type in multi-value label field, neither int nor float")
+            return [float(v) for v in frawVals], [float(v) for v in lrawVals], True
+        return None
+
+    def interpolateAnnotations(self, pairs, steps):
+        """
+        Return the annotations of ``steps`` frames between the matched
+        annotations ``pairs``, as list of lists of annotations per frame.
+        The values are interpolated with one array operation for all frames
+        and objects.
+        """
+        # Concatenate the values of all objects and keys, the layout stores
+        # where the values of each object and key are found
+        fvals = []
+        lvals = []
+        layout = []
+        for i, (fann, lann) in enumerate(pairs):
+            if lann is None:
+                continue
+            for key, value in fann.items():
+                if key not in lann or key == self.id_key:
+                    continue
+                values = self._parseValues(value, lann[key])
+                if values is None:
+                    continue
+                layout.append((i, key, len(fvals), len(values[0]), values[2]))
+                fvals.extend(values[0])
+                lvals.extend(values[1])
+
+        step = np.arange(1, steps + 1, dtype=float).reshape(-1, 1)
+        values = self._interp_func(np.array(fvals, dtype=float), np.array(lvals, dtype=float), step, steps)
+        values = np.broadcast_to(values, (steps, len(fvals))).tolist()
+
+        # Only values which are not immutable need to be copied for each frame
+        immutable = (str, int, float, bool, type(None))
+        mutable = [[key for key, value in fann.items() if not isinstance(value, immutable)]
+                   for fann, lann in pairs]
+        frames = []
+        for row in values:
+            anns = []
+            for (fann, lann), keys in zip(pairs, mutable):
+                ann = dict(fann)
+                for key in keys:
+                    ann[key] = copy.deepcopy(ann[key])
+                anns.append(ann)
+            for i, key, start, length, multi in layout:
+                if multi:
+                    anns[i][key] = ";".join("%s" % v for v in row[start:start + length])
+                else:
+                    anns[i][key] = row[start]
+            frames.append(anns)
+        return frames
+
     def interpolateRange(self):
         last = self._lt.currentImage()
         first = None
@@ -971,7 +2151,7 @@ class InterpolateRange(QObject):
             steps += 1
             prev = prev.getPreviousSibling()
             # only one "roundtrip", as first frame in set wraps to last
-            if steps > len(self._lt.annotations())+1:
+            if steps > last.parent().rowCount() + 1:
                 LOG.info("Couldn't find previous labeled frame")
                 return False
             toInterp.append(prev)
@@ -979,75 +2159,25 @@ class InterpolateRange(QObject):
         first = prev
         toInterp.reverse()
         toInterp = toInterp[1:]
+        if len(toInterp) == 0:
+            return True
 
-        # TODO: make fuzzy matcher to match annotation objects together...
-        fann = first.getAnnotations()['annotations']
-        lann = last.getAnnotations()['annotations']
-        if len(fann) != len(lann): # TODO needed?
-            LOG.error("Error: Annotation count differs in first and last labeled frames, aborting")
+        fann = [dict(ann) for ann in first.annotations()]
+        lann = [dict(ann) for ann in last.annotations()]
+        pairs = self.matchAnnotations(fann, lann)
+        if pairs is None:
+            return False
+        try:
+            toInterpAnns = self.interpolateAnnotations(pairs, len(toInterp))
+        except ValueError as e:
+            LOG.error("Error: %s, aborting" % str(e))
             return False
-        steps = len(toInterp)
-        # create list of annotations to inject into each in-between frame
-        toInterpAnns = []
-        for i in toInterp:
-            toInterpAnns.append(copy.deepcopy(fann))
-
-        for i in range(len(fann)):
-            LOG.debug("trying annotation %s at idx %s"%(fann[i], i))
-            # find which "last annotation" matches a certain first
-            lannIdx = None
-            for l in range(len(lann)):
-                if lann[l]['type'] == fann[i]['type'] and lann[l]['class'] == fann[i]['class']:
-                    lannIdx = l
-            if lannIdx == None:
-                LOG.error("Error: could not find matching label, skipping")
-                continue
 
-            for attr in fann[i].keys():
-                firstV = None; lastV = None
-                if type(fann[i][attr]) in [type(float()), type(int())]:
-                    firstV = fann[i][attr]
-                    lastV = lann[lannIdx][attr]
-                    for j in range(len(toInterpAnns)):
-                        interp = self._interp_func(firstV, lastV, j+1, steps)
-                        toInterpAnns[j][i][attr] = interp
-
-                if type(fann[i][attr])==type(str()) and ";" in fann[i][attr]: # assume its a multi-value list?
-                    frawVals = fann[i][attr].split(";")
-                    lrawVals = lann[lannIdx][attr].split(";")
-                    if len(frawVals) != len(lrawVals):
-                        LOG.error("Error: multi-value objects on first/last frame differ, aborting")
-                        return False
-
-                    test = frawVals[0]
-                    vtype = getStrNumType(test)
-                    if not vtype:
-                        LOG.error("Error, unknown type in multi-value label field, neither int nor float, aborting")
-                        return False
-
-                    fVals = []
-                    lVals = []
-                    for v in range(len(frawVals)):
-                        fVals.append( vtype(frawVals[v]) )
-                        lVals.append( vtype(lrawVals[v]) )
-
-                    # write back to toInterpAnns
-                    for j in range(len(toInterpAnns)):
-                        resVal = ""
-                        for v in range(len(frawVals)):
-                            interp = self._interp_func(fVals[v], lVals[v], j+1, steps)
-                            resVal += "%s;"%interp
-                        resVal = resVal[:-1]
-                        toInterpAnns[j][i][attr] = resVal
-
-        for i in range(len(toInterp)):
-            # first clear existing annotations, as our overwrite check allowed us to
-            toInterp[i].deleteAllChildren()
-            # then add new ones
-            for ann in toInterpAnns[i]:
-                toInterp[i].addAnnotation(ann)
+        with last.model().batchUpdate():
+            for frame, anns in zip(toInterp, toInterpAnns):
+                # first remove the existing annotations, as our overwrite check
+                # allowed us to, then add the new ones in one update
+                frame.deleteChildren(list(frame.annotations()))
+                frame.addAnnotations(anns)
 
         return True
-
-
-
@@ -0,0 +1,409 @@
+"""
+The video module manages the video sources the containers read frames from.
+
+``VideoSourceCache`` keeps a bounded number of video sources open and closes
+the least recently used one when the limit is reached.  Each open source is
+wrapped by a ``BufferedVideoSource``, which remembers the position of the
+decoder and the last decoded frames.  Stepping forward frame by frame then
+continues decoding from the current position instead of seeking, and
+stepping back by a few frames is answered from the buffer.
+
+A video source implements the interface of ``VideoSource``.  The backend
+used for a video is chosen by ``VideoSourceFactory`` from
+``config.VIDEO_BACKENDS``.  Besides okapy, there are backends for image
+sequences given by a printf pattern (``ImageSequenceSource``), which need no
+video library, and for videos decoded by an ``ffmpeg`` process
+(``FFmpegVideoSource``).
+"""
+import os
+import re
+import json
+import fnmatch
+import subprocess
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from sloth.core.exceptions import ImproperlyConfigured, NotImplementedException
+from sloth.core.utils import import_callable
+import logging
+LOG = logging.getLogger(__name__)
+
+try:
+    import okapy
+    import okapy.videoio as okv
+except ImportError:
+    okapy = None
+    okv = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def _which(program):
+    """Return the path of the executable ``program``, or None."""
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(path, program)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+class VideoSource(object):
+    """
+    Interface of the video sources.  ``read()`` decodes the next frame, and
+    ``seek()`` moves the decoder to another frame, which is usually much more
+    expensive.  Sources are created with the filename of the video.
+    """
+
+    @classmethod
+    def available(cls):
+        """Whether the libraries or programs needed by the backend exist."""
+        return True
+
+    def timestamps(self):
+        """
+        Return the timestamps of all frames in seconds.  The default
+        implementation decodes the whole video and returns the frame numbers.
+        """
+        timestamps = []
+        if self.seek(0):
+            while self.read() is not None:
+                timestamps.append(float(len(timestamps)))
+        return timestamps
+
+    def seek(self, frame_number):
+        """
+        Position the source such that ``read()`` returns frame
+        ``frame_number``.  Returns False if the frame does not exist.
+        """
+        raise NotImplementedException("You need to implement seek() in your video source")
+
+    def read(self):
+        """Decode and return the next frame, or None at the end of the video."""
+        raise NotImplementedException("You need to implement read() in your video source")
+
+    def close(self):
+        """Release the file handles and the decoder of the source."""
+        pass
+
+
+class OkapyVideoSource(VideoSource):
+    """Video source reading videos with ``okapy.videoio``."""
+
+    @classmethod
+    def available(cls):
+        return okv is not None
+
+    def __init__(self, filename):
+        if okv is None:
+            raise RuntimeError("okapy is needed for loading videos.")
+        self._vidsrc = okv.toRandomAccessVideoSource(okv.createVideoSourceFromString(filename))
+        self._sought = False
+
+    def timestamps(self):
+        # FIXME: OKAPI should provide a method to get all timestamps at once
+        # try to convert to iseq, getting all timestamps will be significantly faster
+        iseq = okv.toImageSeqReader(self._vidsrc)
+        if iseq is not None:
+            return list(iseq.getTimestamps())
+        timestamps = []
+        self._sought = False
+        while self._vidsrc.getNextFrame():
+            timestamps.append(self._vidsrc.getTimestamp())
+        return timestamps
+
+    def seek(self, frame_number):
+        # The random access source decodes the frame when seeking
+        self._sought = self._vidsrc.getFrame(frame_number)
+        return self._sought
+
+    def read(self):
+        if self._sought:
+            self._sought = False
+        elif not self._vidsrc.getNextFrame():
+            return None
+        image = self._vidsrc.getImage()
+        # The video source may reuse its frame buffer for the next frame
+        if isinstance(image, np.ndarray) and not image.flags.owndata:
+            image = image.copy()
+        return image
+
+    def close(self):
+        self._vidsrc = None
+
+
+def decodeImage(filename):
+    """Decode the image file ``filename`` with PIL or okapy."""
+    if Image is not None:
+        return np.asarray(Image.open(filename))
+    if okapy is not None:
+        return okapy.loadImage(filename)
+    raise RuntimeError("Could neither find PIL nor okapy for loading images.")
+
+
+class ImageSequenceSource(VideoSource):
+    """
+    Video source for a sequence of image files given by a printf pattern,
+    e.g. ``frames/img%05d.png``.  The frames are the files in the directory
+    matching the pattern, sorted by their number, so the sequence may start
+    at any number and have gaps.  When reading forward, the next
+    ``threads`` images are decoded in parallel.  The timestamps are the
+    frame numbers divided by ``fps``.
+    """
+    fps = 25.0
+
+    def __init__(self, filename, threads=None):
+        self._filename = filename
+        self._files = self.listFiles(filename)
+        if threads is None:
+            from sloth.conf import config
+            threads = config.VIDEO_DECODE_THREADS
+        self._pool = ThreadPool(threads) if threads > 1 else None
+        self._window = max(threads, 1)
+        self._pending = {}
+        self._position = 0
+
+    @classmethod
+    def listFiles(cls, pattern):
+        """Return the files matching the printf ``pattern``, sorted by number."""
+        dirname, basename = os.path.split(pattern)
+        match = re.search(r'%(0?)(\d*)d', basename)
+        if match is None:
+            return [pattern] if os.path.exists(pattern) else []
+        digits = r'\d{%s}' % match.group(2) if match.group(1) else r'\d+'
+        regex = re.compile(re.escape(basename[:match.start()]) + '(' + digits + ')' +
+                           re.escape(basename[match.end():]) + '$')
+        numbered = []
+        for name in os.listdir(dirname or '.'):
+            m = regex.match(name)
+            if m is not None:
+                numbered.append((int(m.group(1)), os.path.join(dirname, name)))
+        numbered.sort()
+        return [name for number, name in numbered]
+
+    def numFrames(self):
+        return len(self._files)
+
+    def timestamps(self):
+        return [i / self.fps for i in range(len(self._files))]
+
+    def seek(self, frame_number):
+        if not 0 <= frame_number < len(self._files):
+            return False
+        if frame_number != self._position:
+            # Decodes which are already running are dropped
+            self._pending = {}
+            self._position = frame_number
+        return True
+
+    def read(self):
+        position = self._position
+        if position >= len(self._files):
+            return None
+        self._position += 1
+        if self._pool is None:
+            return decodeImage(self._files[position])
+
+        for n in range(position, min(position + self._window, len(self._files))):
+            if n not in self._pending:
+                self._pending[n] = self._pool.apply_async(decodeImage, (self._files[n], ))
+        return self._pending.pop(position).get()
+
+    def close(self):
+        self._pending = {}
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+class FFmpegVideoSource(VideoSource):
+    """
+    Video source decoding videos with an ``ffmpeg`` process into RGB frames.
+    The video is probed with ``ffprobe``.  Seeking restarts the process at
+    the time of the frame, assuming a constant frame rate.
+    """
+
+    @classmethod
+    def available(cls):
+        return _which('ffmpeg') is not None and _which('ffprobe') is not None
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._process = None
+        self._position = None
+        output = subprocess.check_output(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'stream=width,height,avg_frame_rate', '-of', 'json', filename])
+        stream = json.loads(output.decode('utf-8'))['streams'][0]
+        self._width = int(stream['width'])
+        self._height = int(stream['height'])
+        num, den = stream.get('avg_frame_rate', '25/1').split('/')
+        self._fps = float(num) / float(den) if float(den) and float(num) else 25.0
+
+    def timestamps(self):
+        output = subprocess.check_output(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=pts_time', '-of', 'csv=p=0', self._filename])
+        timestamps = [float(line) for line in output.decode('utf-8').split()
+                      if line.strip() and line.strip() != 'N/A']
+        return sorted(timestamps)
+
+    def seek(self, frame_number):
+        if frame_number < 0:
+            return False
+        self._stop()
+        self._process = subprocess.Popen(
+            ['ffmpeg', '-v', 'error', '-ss', '%.6f' % (frame_number / self._fps),
+             '-i', self._filename, '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+            stdout=subprocess.PIPE)
+        self._position = frame_number
+        return True
+
+    def read(self):
+        if self._process is None and not self.seek(0):
+            return None
+        size = self._width * self._height * 3
+        data = self._process.stdout.read(size)
+        if len(data) < size:
+            return None
+        self._position += 1
+        return np.frombuffer(data, dtype=np.uint8).reshape(self._height, self._width, 3)
+
+    def _stop(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.stdout.close()
+            self._process.wait()
+            self._process = None
+
+    def close(self):
+        self._stop()
+
+
+class VideoSourceFactory(object):
+    """
+    Creates the video source for a filename from a list of ``(pattern,
+    backend)`` pairs.  The first backend whose pattern matches the filename
+    and which is ``available()`` is used.  Backends can be given as class or
+    as module path.
+    """
+
+    def __init__(self, backends):
+        self._backends = []
+        for pattern, backend in backends:
+            if type(backend) == str:
+                backend = import_callable(backend)
+            self._backends.append((pattern, backend))
+
+    def backend(self, filename):
+        for pattern, backend in self._backends:
+            if fnmatch.fnmatch(filename, pattern) and backend.available():
+                return backend
+        raise ImproperlyConfigured("No video backend available for %s" % filename)
+
+    def create(self, filename):
+        return self.backend(filename)(filename)
+
+
+def openVideoSource(filename):
+    """Open ``filename`` with the backend chosen from ``config.VIDEO_BACKENDS``."""
+    from sloth.conf import config
+    return VideoSourceFactory(config.VIDEO_BACKENDS).create(filename)
+
+
+class BufferedVideoSource(object):
+    """
+    Wraps a ``VideoSource`` and keeps the last ``buffer_size`` decoded frames
+    in a ring buffer.  Frames up to ``max_skip`` frames after the current
+    position are reached by decoding forward instead of seeking.
+    """
+
+    def __init__(self, source, buffer_size=8, max_skip=None):
+        self._source = source
+        self._frames = deque(maxlen=max(buffer_size, 1))
+        self._position = None
+        self._max_skip = buffer_size if max_skip is None else max_skip
+        self.seeks = 0
+
+    def source(self):
+        return self._source
+
+    def getFrame(self, frame_number):
+        """Return frame ``frame_number``, or None if it cannot be decoded."""
+        for number, image in self._frames:
+            if number == frame_number:
+                return image
+
+        position = self._position
+        if position is None or not (position <= frame_number <= position + self._max_skip):
+            self.seeks += 1
+            if not self._source.seek(frame_number):
+                self._position = None
+                return None
+            position = frame_number
+
+        image = None
+        while position <= frame_number:
+            image = self._source.read()
+            if image is None:
+                self._position = None
+                return None
+            self._frames.append((position, image))
+            position += 1
+        self._position = position
+        return image
+
+    def clearBuffer(self):
+        """Drop the buffered frames, but keep the decoder position."""
+        self._frames.clear()
+
+    def close(self):
+        self._frames.clear()
+        self._position = None
+        self._source.close()
+
+
+class VideoSourceCache(object):
+    """
+    LRU cache of at most ``max_sources`` open video sources.  The sources are
+    created by ``open_source(filename)``, which defaults to
+    ``openVideoSource``.  Only the most recently used source keeps its
+    frame buffer, so that the memory for buffered frames does not grow with
+    the number of open videos.
+    """
+
+    def __init__(self, max_sources=8, buffer_size=8, open_source=None):
+        self._sources = OrderedDict()
+        self._max_sources = max(max_sources, 1)
+        self._buffer_size = buffer_size
+        self._open_source = open_source or openVideoSource
+
+    def __len__(self):
+        return len(self._sources)
+
+    def __contains__(self, filename):
+        return filename in self._sources
+
+    def get(self, filename):
+        """Return the ``BufferedVideoSource`` of ``filename``, opening it if needed."""
+        source = self._sources.pop(filename, None)
+        if source is None:
+            source = BufferedVideoSource(self._open_source(filename), self._buffer_size)
+            while len(self._sources) >= self._max_sources:
+                old_filename, old = self._sources.popitem(last=False)
+                LOG.debug("Closing video source %s" % old_filename)
+                old.close()
+        if self._sources:
+            self._sources[next(reversed(self._sources))].clearBuffer()
+        self._sources[filename] = source
+        return source
+
+    def getFrame(self, filename, frame_number):
+        return self.get(filename).getFrame(frame_number)
+
+    def close(self):
+        """Close all video sources."""
+        for source in self._sources.values():
+            source.close()
+        self._sources.clear()
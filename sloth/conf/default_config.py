@@ -106,12 +106,111 @@ HOTKEYS = (
 # to such a class.
 CONTAINERS = (
     ('*.json',       'sloth.annotations.container.JsonContainer'),
+    ('*.json.gz',    'sloth.annotations.container.GzipJsonContainer'),
+    ('*.json.zst',   'sloth.annotations.container.ZstdJsonContainer'),
     ('*.msgpack',    'sloth.annotations.container.MsgpackContainer'),
     ('*.yaml',       'sloth.annotations.container.YamlContainer'),
     ('*.pickle',     'sloth.annotations.container.PickleContainer'),
+    ('*.slothdb',    'sloth.annotations.container.SlothDbContainer'),
+    ('*.shards',     'sloth.annotations.container.ShardedContainer'),
     ('*.sloth-init', 'sloth.annotations.container.FileNameListContainer'),
 )
 
+# SAVE_JOURNAL
+#
+# If True, saving to the label file that is currently open only appends the
+# changed images and videos to a journal file next to the label file
+# (<labelfile>.journal) instead of rewriting the whole label file.  The
+# journal is applied when the label file is loaded.
+SAVE_JOURNAL = False
+
+# SAVE_JOURNAL_COMPACT
+#
+# Maximum number of records in the journal.  If a save would exceed this
+# number, the label file is rewritten completely and the journal is removed.
+SAVE_JOURNAL_COMPACT = 1000
+
+# LOAD_MMAP
+#
+# If True, label files are memory-mapped when they are loaded instead of being
+# read into memory.  This reduces the memory usage and the time needed to open
+# very large label files, in particular for containers which decode the
+# images and videos on demand (such as the slothdb container).
+LOAD_MMAP = False
+
+# COLUMNAR_ANNOTATIONS
+#
+# If True, the coordinates, classes and flags of the annotations are stored
+# in numpy arrays (see sloth.annotations.columnar) instead of one dict per
+# annotation.  This reduces the memory usage of large label sets and speeds
+# up bulk operations on the annotations.
+COLUMNAR_ANNOTATIONS = False
+
+# IMAGE_CACHE_SIZE
+#
+# Maximum memory in bytes used for caching decoded images and video frames.
+# The least recently used images are evicted first.  The cache is shared by
+# the scene, the plugins and the commands.  Set to 0 to disable the cache.
+IMAGE_CACHE_SIZE = 512 * 1024 * 1024
+
+# PREFETCH_NEXT, PREFETCH_PREVIOUS
+#
+# Number of images/frames after and before the current image which are
+# decoded in the background into the image cache, so that stepping to them
+# does not wait for the decoding.  Requires IMAGE_CACHE_SIZE > 0.
+PREFETCH_NEXT = 2
+PREFETCH_PREVIOUS = 1
+
+# PREFETCH_THREADS
+#
+# Number of threads decoding the prefetched images.  Set to 0 to disable
+# prefetching.
+PREFETCH_THREADS = 2
+
+# VIDEO_CACHE_SOURCES
+#
+# Maximum number of videos which are kept open for loading frames.  When the
+# limit is reached, the least recently used video is closed.
+VIDEO_CACHE_SOURCES = 8
+
+# VIDEO_FRAME_BUFFER
+#
+# Number of decoded frames buffered for the current video.  Stepping back
+# within the buffer does not decode frames again, and stepping forward by up
+# to this number of frames decodes forward instead of seeking in the video.
+VIDEO_FRAME_BUFFER = 8
+
+# VIDEO_BACKENDS
+#
+# A tuple of tuples (pattern, backend) of the backends decoding videos.  The
+# first backend whose pattern matches the video filename and whose libraries
+# or programs are installed is used.  Backends implement the interface of
+# sloth.annotations.video.VideoSource and can either be given directly or
+# their module path be specified as string.
+VIDEO_BACKENDS = (
+    ('*%*', 'sloth.annotations.video.ImageSequenceSource'),
+    ('*',   'sloth.annotations.video.OkapyVideoSource'),
+    ('*',   'sloth.annotations.video.FFmpegVideoSource'),
+)
+
+# VIDEO_DECODE_THREADS
+#
+# Number of threads decoding the images of image sequences in parallel when
+# the frames are read forward.
+VIDEO_DECODE_THREADS = 4
+
+# TILED_IMAGE_SIZE
+#
+# Images whose width or height exceeds this number of pixels are displayed
+# in tiles, of which only the visible ones are converted to pixmaps at the
+# resolution matching the zoom level (see sloth.gui.tiledimage).
+TILED_IMAGE_SIZE = 8192
+
+# IMAGE_TILE_CACHE
+#
+# Maximum number of tile pixmaps of 512x512 pixels kept for tiled images.
+IMAGE_TILE_CACHE = 256
+
 # PLUGINS
 #
 # A list/tuple of classes implementing the sloth plugin interface.  The
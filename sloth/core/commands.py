@@ -149,11 +149,11 @@ class MergeFilesCommand(BaseCommand):
         logger.info("merging %s and %s into %s" % (input1, input2, output))
         logger.debug("loading annotations from %s" % input1)
         container1 = self.labeltool._container_factory.create(input1)
-        an1 = container1.load(input1)
+        an1 = list(container1.load(input1))
 
         logger.debug("loading annotations from %s" % input2)
         container2 = self.labeltool._container_factory.create(input2)
-        an2 = container2.load(input2)
+        an2 = list(container2.load(input2))
 
         logger.debug("merging annotations of %s and %s" % (input1, input2))
         an3 = self.merge_annotations(an1, an2)
@@ -207,6 +207,56 @@ class MergeFilesCommand(BaseCommand):
         return an1
 
 
+class CopyAnnotationsCommand(BaseCommand):
+    """
+    Propagate the annotations of the videos in a label file through the
+    frames.  Each frame receives the annotations of the previous frames that
+    do not overlap with its own annotations, like "Copy from previous" in the
+    GUI applied to every frame in order.
+
+    The result is written to <output>, or back to the label file if no output
+    is given.
+    """
+    args = '<labelfile> [<output>]'
+    help = __doc__.strip()
+    option_list = BaseCommand.option_list + (
+        make_option('--class', action='append', dest='classes', default=None,
+            help='Only copy annotations of this class.  Can be given multiple times.'),
+        make_option('--frames', type='int', default=1,
+            help='Number of previous frames to copy from (default: 1).'),
+        make_option('--overlap', type='float', default=0.5,
+            help='Do not copy annotations which overlap an annotation of the frame by more than this '
+                 'intersection over union (default: 0.5).'),
+        make_option('--prefix', default='',
+            help='Prefix of the x, y, width and height keys of the rects.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) not in (1, 2):
+            raise CommandError("Usage: %s" % self.args)
+        from sloth.annotations.model import CopyAnnotations
+
+        input = args[0]
+        output = args[1] if len(args) > 1 else input
+        logger.debug("loading annotations from %s" % input)
+        container = self.labeltool._container_factory.create(input)
+        annotations = list(container.load(input))
+
+        copier = CopyAnnotations(self.labeltool, class_filter=options['classes'],
+                                 frame_range=options['frames'],
+                                 overlap_threshold=options['overlap'],
+                                 prefix=options['prefix'])
+        count = 0
+        for item in annotations:
+            if item.get('class') == 'video':
+                count += copier.propagate(item.get('frames', []))
+        logger.info("copied %d annotations" % count)
+
+        logger.debug("saving annotations to %s" % output)
+        out_container = self.labeltool._container_factory.create(output)
+        out_container.save(annotations, output)
+
+
 def _make_writeable(filename):
     """
     Make sure that the file is writeable. Useful if our source is
@@ -240,3 +290,4 @@ register_command('createconfig', CreateConfigCommand())
 register_command('dumplabels', DumpLabelsCommand())
 register_command('appendfiles', AppendFilesCommand())
 register_command('mergefiles', MergeFilesCommand())
+register_command('copyannotations', CopyAnnotationsCommand())
@@ -3,10 +3,15 @@ This is the core labeltool module.
 """
 import os
 import sys
+import copy
+import functools
 from PyQt4.QtGui import *
 from PyQt4.QtCore import *
 from sloth.annotations.model import *
 from sloth.annotations.container import AnnotationContainerFactory, AnnotationContainer
+from sloth.annotations.columnar import AnnotationTable
+from sloth.annotations.imagecache import sharedImageCache, ImagePrefetcher
+from sloth.annotations.video import openVideoSource
 from sloth.conf import config
 from sloth.core.cli import LaxOptionParser, BaseCommand
 from sloth.core.utils import import_callable
@@ -17,10 +22,30 @@ import logging
 
 LOG = logging.getLogger(__name__)
 
-try:
-    import okapy.videoio as okv
-except ImportError:
-    pass
+
+class SaveWorker(QThread):
+    """
+    Thread which writes a snapshot of the annotations to disk, so that the
+    GUI stays responsive while large label files are saved.  ``progress``
+    is emitted with the number of written and of all file items.
+    """
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, job, msg, model, state, parent=None):
+        QThread.__init__(self, parent)
+        self.job = job
+        self.msg = msg
+        self.model = model
+        self.state = state
+        self.success = False
+
+    def run(self):
+        try:
+            self.job(self.progress.emit)
+            self.success = True
+        except Exception as e:
+            LOG.error("Saving failed: %s" % e)
+            self.msg = "Error: Saving failed (%s)" % str(e)
 
 
 class LabelTool(QObject):
@@ -67,9 +92,14 @@ class LabelTool(QObject):
 
         self._container_factory = None
         self._container = AnnotationContainer()
+        self._source_container = None
         self._current_image = None
         self._model = AnnotationModel([])
+        self._table = None
+        self._table_cache = None
         self._mainwindow = None
+        self._save_worker = None
+        self._prefetcher = None
 
     def main_help_text(self):
         """
@@ -206,6 +236,7 @@ class LabelTool(QObject):
 
         # Instatiate container factory
         self._container_factory = AnnotationContainerFactory(config.CONTAINERS)
+        sharedImageCache().setMaxBytes(config.IMAGE_CACHE_SIZE)
 
     def loadPlugins(self, plugins):
         self._plugins = []
@@ -222,12 +253,23 @@ class LabelTool(QObject):
     ###___________________________________________________________________________________________
     def loadAnnotations(self, fname, handleErrors=True):
         fname = str(fname)  # convert from QString
+        self.waitForSave()
 
         try:
             self._container = self._container_factory.create(fname)
-            self._model = AnnotationModel(self._container.load(fname))
-            msg = "Successfully loaded %s (%d files, %d annotations)" % \
-                  (fname, self._model.root().numFiles(), self._model.root().numAnnotations())
+            annotations = self._container.load(fname, use_mmap=config.LOAD_MMAP)
+            self._table = self._table_cache = None
+            if config.COLUMNAR_ANNOTATIONS:
+                self._table, annotations = AnnotationTable.fromFileItems(annotations, attach=True)
+            self._model = AnnotationModel(annotations)
+            self._setSourceContainer(self._container)
+            if self._table is not None:
+                self._table_cache = (self._model.generation(), self._table)
+            if self._model.root().canFetchMore():
+                # The remaining file items are fetched in the background
+                msg = "Loading %s..." % fname
+            else:
+                msg = "Successfully loaded %s (%s)" % (fname, self._countsText())
         except Exception as e:
             if handleErrors:
                 msg = "Error: Loading failed (%s)" % str(e)
@@ -237,35 +279,155 @@ class LabelTool(QObject):
         self.statusMessage.emit(msg)
         self.annotationsLoaded.emit()
 
+    def finishLoading(self):
+        """
+        Report the loaded annotations once the background loading of a
+        label file is finished.
+        """
+        self.statusMessage.emit("Successfully loaded %s (%s)" % (self.getCurrentFilename(), self._countsText()))
+
     def annotations(self):
         if self._model is None:
             return None
         return self._model.root().getAnnotations()
 
-    def saveAnnotations(self, fname):
+    def annotationTable(self):
+        """
+        Return an ``AnnotationTable`` of the current annotations for bulk
+        operations such as statistics.  The table is rebuilt only if the
+        annotations were modified since the last call.
+        """
+        generation = self._model.generation()
+        if self._table_cache is None or self._table_cache[0] != generation:
+            table = AnnotationTable.fromFileItems(self.annotations())[0]
+            self._table_cache = (generation, table)
+        return self._table_cache[1]
+
+    def saveAnnotations(self, fname, background=False):
+        """
+        Save the annotations to ``fname``.  If ``background`` is True, only
+        a snapshot of the annotations is taken here and the file is written
+        by a worker thread; the result is reported by ``statusMessage``.
+        """
+        self.waitForSave()
         success = False
         try:
-            # create new container if the filename is different
-            if fname != self._container.filename():
-                self._container = self._container_factory.create(fname)
-
-            # Get annotations dict
-            ann = self._model.root().getAnnotations()
-
-            self._container.save(ann, fname)
-            #self._model.writeback() # write back changes that are cached in the model itself, e.g. mask updates
-            msg = "Successfully saved %s (%d files, %d annotations)" % \
-                  (fname, self._model.root().numFiles(), self._model.root().numAnnotations())
+            state = self._model.saveState()
+            job, msg = self._prepareSave(fname, background)
+            if background:
+                worker = SaveWorker(job, msg, self._model, state)
+                worker.finished.connect(functools.partial(self._finishSave, worker))
+                worker.progress.connect(functools.partial(self._reportSaveProgress, fname))
+                self._save_worker = worker
+                self.statusMessage.emit("Saving %s..." % fname)
+                worker.start()
+                return True
+            job()
             success = True
-            self._model.setDirty(False)
+            self._model.markSaved(state)
         except Exception as e:
             msg = "Error: Saving failed (%s)" % str(e)
 
         self.statusMessage.emit(msg)
         return success
 
+    def _prepareSave(self, fname, background=False):
+        """
+        Take a snapshot of the annotations for saving them to ``fname``.
+        Returns a function writing the snapshot, which takes an optional
+        progress callback, and the status message to display when it was
+        written.  For a ``background`` save the snapshot must not share
+        columnar annotations with the model, which are modified in place.
+
+        File items which are still in a random access source, e.g. a
+        slothdb file, are not decoded here but by the returned function,
+        and containers supporting it copy their records without decoding.
+        """
+        # create new container if the filename is different
+        if fname != self._container.filename():
+            self._container = self._container_factory.create(fname)
+            changes = None
+        elif config.SAVE_JOURNAL:
+            changes = self._model.fileChanges()
+            if changes is not None and \
+               self._container.journalLength() + len(changes) > config.SAVE_JOURNAL_COMPACT:
+                # Compact the journal into the label file
+                changes = None
+        else:
+            changes = None
+
+        container = self._container
+        if changes is not None:
+            msg = "Successfully saved %s (%d changed files)" % (fname, len(changes))
+            return lambda progress=None: container.saveIncremental(changes, fname), msg
+        else:
+            # Get annotations dict
+            ann = self._model.root().snapshotAnnotations()
+            if background and self._table is not None:
+                ann = copy.deepcopy(list(ann))
+            #self._model.writeback() # write back changes that are cached in the model itself, e.g. mask updates
+            msg = "Successfully saved %s (%s)" % (fname, self._countsText())
+
+            def job(progress=None):
+                annotations = ann
+                if hasattr(annotations, 'setProgressCallback'):
+                    annotations.setProgressCallback(progress)
+                if not container.serializes_sequences:
+                    annotations = list(annotations)
+                container.save(annotations, fname)
+            return job, msg
+
+    def _countsText(self):
+        """
+        The number of files, and of annotations if they are already counted.
+        Counting them would decode all file items of lazily loaded files.
+        """
+        if self._model.hasAnnotationIndex():
+            return "%d files, %d annotations" % (self._model.root().numFiles(),
+                                                 self._model.root().numAnnotations())
+        return "%d files" % self._model.root().numFiles()
+
+    def _reportSaveProgress(self, fname, done, total):
+        self.statusMessage.emit("Saving %s... %d%%" % (fname, 100 * done // max(total, 1)))
+
+    def _finishSave(self, worker):
+        if worker is not self._save_worker:
+            # Already handled by waitForSave()
+            return
+        self._save_worker = None
+        if worker.success:
+            # Only changes contained in the snapshot are marked as saved
+            worker.model.markSaved(worker.state)
+        self.statusMessage.emit(worker.msg)
+
+    def waitForSave(self):
+        """
+        Wait until a save running in the background has finished.  Returns
+        False if it failed.
+        """
+        worker = self._save_worker
+        if worker is None:
+            return True
+        worker.wait()
+        self._finishSave(worker)
+        return worker.success
+
+    def _setSourceContainer(self, container):
+        """
+        Set the container the file items of the model were loaded from.  The
+        container of the previous model is cleared, which closes the label
+        file if its file items were read on access.  This is not necessarily
+        the current container, which is replaced when saving under a new name.
+        """
+        if self._source_container is not None and self._source_container is not container:
+            self._source_container.clear()
+        self._source_container = container
+
     def clearAnnotations(self):
+        self.waitForSave()
+        self._setSourceContainer(None)
         self._model = AnnotationModel([])
+        self._table = self._table_cache = None
         #self._model.setBasedir("")
         self.statusMessage.emit('')
         self.annotationsLoaded.emit()
@@ -335,13 +497,60 @@ class LabelTool(QObject):
         if image != self._current_image:
             self._current_image = image
             self.currentImageChanged.emit()
+            self.prefetchImages()
 
     def getImage(self, item):
+        """
+        Return the decoded image or video frame of ``item``.  Recently used
+        images are cached, see ``imageCache()``.
+        """
+        return self._imageLoader(item)()
+
+    def _imageLoader(self, item):
+        """Return a function loading the image of ``item``."""
         if item['class'] == 'frame':
             video = item.parent()
-            return self._container.loadFrame(video['filename'], item['num'])
+            return functools.partial(self._container.loadFrame, video['filename'], item['num'])
         else:
-            return self._container.loadImage(item['filename'])
+            return functools.partial(self._container.loadImage, item['filename'])
+
+    def prefetchImages(self):
+        """
+        Decode the next ``config.PREFETCH_NEXT`` and the previous
+        ``config.PREFETCH_PREVIOUS`` images or frames of the current image in
+        the background, nearest first.  Requests for the images around the
+        previous current image which have not been started are dropped.
+        Nothing is prefetched if the current image did not fit into the
+        cache, since the images around it would be decoded in vain.
+        """
+        if self._current_image is None or config.PREFETCH_THREADS <= 0 or \
+                self.imageCache().maxBytes() <= 0:
+            return
+        if not self.imageCache().lastImageFits():
+            if self._prefetcher is not None:
+                self._prefetcher.cancel()
+            return
+        if self._prefetcher is None:
+            self._prefetcher = ImagePrefetcher(config.PREFETCH_THREADS)
+
+        row = self._current_image.row()
+        rows = []
+        for distance in range(1, max(config.PREFETCH_NEXT, config.PREFETCH_PREVIOUS) + 1):
+            if distance <= config.PREFETCH_NEXT:
+                rows.append(row + distance)
+            if distance <= config.PREFETCH_PREVIOUS and row - distance >= 0:
+                rows.append(row - distance)
+
+        loaders = []
+        for r in rows:
+            item = self._current_image.getSibling(r)
+            if isinstance(item, ImageModelItem):
+                loaders.append(self._imageLoader(item))
+        self._prefetcher.prefetch(loaders)
+
+    def imageCache(self):
+        """The cache of decoded images used by ``getImage()``."""
+        return self._container.imageCache()
 
     def getAnnotationFilePatterns(self):
         return self._container_factory.patterns()
@@ -361,35 +570,20 @@ class LabelTool(QObject):
             'frames': [],
         }
 
-        # FIXME: OKAPI should provide a method to get all timestamps at once
         # FIXME: Some dialog should be displayed, telling the user that the
         # video is being loaded/indexed and that this might take a while
         LOG.info("Importing frames from %s. This may take a while..." % fname)
-        video = okv.createVideoSourceFromString(fname)
-        video = okv.toRandomAccessVideoSource(video)
-
-        # try to convert to iseq, getting all timestamps will be significantly faster
-        iseq = okv.toImageSeqReader(video)
-        if iseq is not None:
-            timestamps = iseq.getTimestamps()
-            LOG.debug("Adding %d frames" % len(timestamps))
-            fileitem['frames'] = [{'annotations': [], 'num': i,
-                                   'timestamp': ts, 'class': 'frame'}
-                                  for i, ts in enumerate(timestamps)]
-        else:
-            i = 0
-            while video.getNextFrame():
-                LOG.debug("Adding frame %d" % i)
-                ts = video.getTimestamp()
-                frame = {'annotations': [],
-                         'num': i,
-                         'timestamp': ts,
-                         'class': 'frame'
-                }
-                fileitem['frames'].append(frame)
-                i += 1
-
-        self._model._root.appendFileItem(fileitem)
+        video = openVideoSource(fname)
+        try:
+            timestamps = video.timestamps()
+        finally:
+            video.close()
+        LOG.debug("Adding %d frames" % len(timestamps))
+        fileitem['frames'] = [{'annotations': [], 'num': i,
+                               'timestamp': ts, 'class': 'frame'}
+                              for i, ts in enumerate(timestamps)]
+
+        return self._model._root.appendFileItem(fileitem)
 
     ###
     ### GUI functions
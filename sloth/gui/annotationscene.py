@@ -3,6 +3,7 @@ from sloth.items import *
 from sloth.core.exceptions import InvalidArgumentException
 from sloth.annotations.model import AnnotationModelItem
 from sloth.utils import toQImage
+from sloth.gui.tiledimage import TiledImageItem
 from sloth.conf import config
 import logging
 import functools
@@ -64,6 +65,10 @@ class AnnotationScene(QGraphicsScene):
     def sceneItem(self):
         return self._scene_item
 
+    def image(self):
+        """The decoded image of the current image item, or None."""
+        return self._image
+
     def setCurrentImage(self, current_image):
         """
         Set the index of the model which denotes the current image to be
@@ -83,10 +88,15 @@ class AnnotationScene(QGraphicsScene):
             current_image._seen = True
             assert self._image_item.model() == self._model
             self._image      = self._labeltool.getImage(self._image_item)
-            self._pixmap     = QPixmap(toQImage(self._image))
-            self._scene_item = QGraphicsPixmapItem(self._pixmap)
+            if self._image is not None and max(self._image.shape[:2]) > config.TILED_IMAGE_SIZE:
+                # Only the visible tiles are converted to pixmaps
+                self._pixmap     = None
+                self._scene_item = TiledImageItem(self._image, config.IMAGE_TILE_CACHE)
+            else:
+                self._pixmap     = QPixmap(toQImage(self._image))
+                self._scene_item = QGraphicsPixmapItem(self._pixmap)
             self._scene_item.setZValue(-1)
-            self.setSceneRect(0, 0, self._pixmap.width(), self._pixmap.height())
+            self.setSceneRect(self._scene_item.boundingRect())
             self.addItem(self._scene_item)
 
             self.insertItems(0, len(self._image_item.children())-1)
@@ -119,8 +129,16 @@ class AnnotationScene(QGraphicsScene):
         # therefore we need to determine the unique set of model items first
         # must use a dict for hashing instead of a set, because objects are not hashable
         modelitems_to_delete = dict((id(item.modelItem()), item.modelItem()) for item in self.selectedItems())
+
+        # delete the children of each parent at once
+        parents = {}
         for item in modelitems_to_delete.values():
-            item.delete()
+            parent = item.parent()
+            parents.setdefault(id(parent), (parent, []))[1].append(item)
+        for parent, items in parents.values():
+            if parent is None:
+                raise RuntimeError("Trying to delete orphan")
+            parent.deleteChildren(items)
 
     def onInserterFinished(self):
         self.sender().inserterFinished.disconnect(self.onInserterFinished)
@@ -323,12 +341,27 @@ class AnnotationScene(QGraphicsScene):
     # this is the implemenation of the scene as a view of the model
     #
     def dataChanged(self, indexFrom, indexTo):
-        if self._image_item is None or self._image_item.index() != indexFrom.parent().parent():
+        if self._image_item is None:
+            return
+        parent = self._model.parentFromIndex(indexFrom)
+        if parent is self._image_item:
+            # annotations of the current image
+            changed = [parent.childAt(row) for row in range(indexFrom.row(), indexTo.row() + 1)]
+        elif parent.parent() is self._image_item:
+            # key/value rows of an annotation
+            changed = [parent]
+        else:
             return
 
-        item = self.itemFromIndex(indexFrom.parent())
-        if item is not None:
-            item.dataChanged()
+        # look up the graphics items of all changed annotations at once
+        items = {}
+        for item in self.items():
+            if hasattr(item, 'modelItem'):
+                items.setdefault(id(item.modelItem()), item)
+        for model_item in changed:
+            item = items.get(id(model_item))
+            if item is not None:
+                item.dataChanged()
 
     def rowsInserted(self, index, first, last):
         if self._image_item is None or self._image_item.index() != index:
@@ -417,7 +450,7 @@ class AnnotationScene(QGraphicsScene):
     # enumerate polygon annotation corners and rectangle annotation corners
     def enumerateCorners(self):
         # calculate font size
-        fontsize = (self._pixmap.width()+self._pixmap.height())/150
+        fontsize = (self.sceneRect().width()+self.sceneRect().height())/150
 
         # decorate the paint() method with our enumerating paint
         self.enumeratePolygonItems(fontsize)
@@ -23,43 +23,37 @@ GUIDIR=os.path.join(os.path.dirname(__file__))
 LOG=logging.getLogger(__name__)
 
 class BackgroundLoader(QObject):
+    """
+    Fetches the file items of incrementally parsed label files when the GUI
+    is idle.  The model answers the views without creating model items, so
+    the items are not created in advance.
+    """
     finished = pyqtSignal()
 
     def __init__(self, model, statusbar, progress):
         QObject.__init__(self)
-        self._max_levels = 3
         self._model = model
         self._statusbar = statusbar
         self._message_displayed = False
         self._progress = progress
         self._progress.setMinimum(0)
-        self._progress.setMaximum(1000 * self._max_levels)
+        self._progress.setMaximum(1)
+        self._progress.setValue(0)
         self._progress.setMaximumWidth(150)
 
-        self._level = 1
-        self._iterator = self._model.iterator(maxlevels=self._level)
-        self._pos = 0
-        self._rows = self._model.root().rowCount() + 1
-        self._next_rows = 0
-
     def load(self):
         if not self._message_displayed:
             self._statusbar.showMessage("Loading annotations...", 5000)
             self._message_displayed = True
-        if self._level <= self._max_levels and self._rows > 0:
+        if self._model.canFetchMore():
             try:
-                item = next(self._iterator)
-                self._next_rows += item.rowCount()
-                self._pos += 1
-                self._progress.setValue(int((float(self._pos) / float(self._rows) + self._level - 1) * 1000))
-            except StopIteration:
-                self._level += 1
-                self._iterator = self._model.iterator(maxlevels=self._level)
-                self._pos = 0
-                self._rows = self._next_rows
-                self._next_rows = 1
+                self._model.fetchMore()
+            except Exception as e:
+                LOG.error("Error while loading annotations: %s" % e)
+                self._statusbar.showMessage("Error: Loading failed (%s)" % e, 5000)
         else:
             LOG.debug("Loading finished...")
+            self._progress.setValue(1)
             self.finished.emit()
 
 class MainWindow(QMainWindow):
@@ -103,7 +97,7 @@ class MainWindow(QMainWindow):
 
     def stopBackgroundLoading(self, forced=False):
         if not forced:
-            self.statusBar().showMessage("Background loading finished", 5000)
+            self.labeltool.finishLoading()
         self.idletimer.stop()
         if self.loader is not None:
             self.idletimer.timeout.disconnect(self.loader.load)
@@ -127,9 +121,10 @@ class MainWindow(QMainWindow):
         self.onFitToWindowModeChanged()
         self.treeview.scrollTo(new_image.index())
 
-        img = self.labeltool.getImage(new_image)
+        # The scene has decoded the image already
+        img = self.scene.image()
 
-        if img == None:
+        if img is None:
             self.controls.setFilename("")
             self.selectionmodel.setCurrentIndex(new_image.index(), QItemSelectionModel.ClearAndSelect|QItemSelectionModel.Rows)
             return
@@ -381,7 +376,7 @@ class MainWindow(QMainWindow):
             if reply == QMessageBox.Cancel:
                 return False
             elif reply == QMessageBox.Yes:
-                return self.fileSave()
+                return self.fileSave() and self.labeltool.waitForSave()
         return True
 
     def fileNew(self):
@@ -407,7 +402,7 @@ class MainWindow(QMainWindow):
         filename = self.labeltool.getCurrentFilename()
         if filename is None:
             return self.fileSaveAs()
-        return self.labeltool.saveAnnotations(filename)
+        return self.labeltool.saveAnnotations(filename, background=True)
 
     def fileSaveAs(self):
         fname = '.'  # self.annotations.filename() or '.'
@@ -417,7 +412,7 @@ class MainWindow(QMainWindow):
                 "%s annotation files (%s)" % (APP_NAME, format_str))
 
         if len(str(fname)) > 0:
-            return self.labeltool.saveAnnotations(str(fname))
+            return self.labeltool.saveAnnotations(str(fname), background=True)
         return False
 
     def addMediaFile(self):
@@ -469,7 +464,7 @@ class MainWindow(QMainWindow):
     ### global event handling
     ###______________________________________________________________________________
     def closeEvent(self, event):
-        if self.okToContinue():
+        if self.okToContinue() and self.labeltool.waitForSave():
             self.saveApplicationSettings()
         else:
             event.ignore()
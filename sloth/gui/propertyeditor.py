@@ -221,12 +221,19 @@ class DefaultAttributeHandler(QGroupBox, AbstractAttributeHandler):
         LOG.debug("Button %s: %s clicked" % (attr, val))
         button = self._buttons[val]
 
-        # Update model item
-        for item in self._current_items:
-            if button.isChecked():
-                item[attr] = val
-            else:
-                item[attr] = None
+        # Update model items, with one notification of the model
+        def updateItems():
+            for item in self._current_items:
+                if button.isChecked():
+                    item[attr] = val
+                else:
+                    item[attr] = None
+        model = self._current_items[0].model() if len(self._current_items) > 0 else None
+        if model is not None:
+            with model.batchUpdate():
+                updateItems()
+        else:
+            updateItems()
 
         # Unpress all other buttons
         for v, but in self._buttons.items():
@@ -321,7 +328,7 @@ class PropertyEditor(QWidget):
         if len(attrs) > 0:
             start = time.time()
             attr2vals = {}
-            for item in new_model.iterator(AnnotationModelItem):
+            for item in new_model.iterAnnotationData():
                 for attr in attrs:
                     if attr in item:
                         if attr not in attr2vals:
@@ -0,0 +1,150 @@
+"""
+Display of very large images.  Converting a whole image of e.g. 20000x20000
+pixels into one QPixmap takes seconds and gigabytes, and every repaint scales
+the full pixmap.  ``TiledImageItem`` instead cuts the image into tiles, and
+only converts the tiles which are visible, at the resolution which fits the
+current scale of the view.  The lower resolutions are computed on demand by
+``ImagePyramid``.
+"""
+import math
+from collections import OrderedDict
+import numpy as np
+from PyQt4.QtCore import QRectF
+from PyQt4.QtGui import QGraphicsItem, QPixmap, QStyleOptionGraphicsItem
+from sloth.utils import toQImage
+
+
+def downsample(image, rows_per_chunk=512):
+    """
+    Return ``image`` with half the width and height, each pixel being the
+    mean of 2x2 pixels.  An odd last row or column is dropped.  The image is
+    processed in chunks of rows to bound the temporary memory.
+    """
+    h, w = image.shape[:2]
+    h2, w2 = h // 2, w // 2
+    out = np.empty((h2, w2) + image.shape[2:], dtype=image.dtype)
+    acc_type = np.uint16 if image.dtype == np.uint8 else np.float64
+    for row in range(0, h2, rows_per_chunk):
+        end = min(row + rows_per_chunk, h2)
+        a = image[2 * row:2 * end, :2 * w2]
+        acc = a[0::2, 0::2].astype(acc_type)
+        acc += a[1::2, 0::2]
+        acc += a[0::2, 1::2]
+        acc += a[1::2, 1::2]
+        if acc_type is np.uint16:
+            acc += 2
+            acc >>= 2
+        else:
+            acc /= 4
+        out[row:end] = acc
+    return out
+
+
+class ImagePyramid(object):
+    """
+    The levels of an image at decreasing resolution.  Level ``n`` has
+    ``1 / 2**n`` of the width and height of the image, and is computed when
+    it is first requested by averaging 2x2 pixels of the finest computed
+    level.  If levels in between have not been computed, that level is
+    subsampled first, so that e.g. zooming out of a huge image does not read
+    all of its pixels.  The smallest level fits into ``min_size`` pixels.
+    """
+
+    def __init__(self, image, min_size=512):
+        self._levels = {0: image}
+        size = max(image.shape[:2])
+        self.num_levels = 1
+        while size > min_size:
+            size //= 2
+            self.num_levels += 1
+
+    def width(self):
+        return self._levels[0].shape[1]
+
+    def height(self):
+        return self._levels[0].shape[0]
+
+    def level(self, n):
+        level = self._levels.get(n)
+        if level is None:
+            m = max(k for k in self._levels if k < n)
+            step = 1 << (n - m - 1)
+            level = downsample(self._levels[m][::step, ::step])
+            level = self._levels[n] = level[:self.height() >> n, :self.width() >> n]
+        return level
+
+    def levelForScale(self, scale):
+        """Return the coarsest level with at least one pixel per screen pixel."""
+        if scale <= 0 or scale >= 1:
+            return 0
+        return min(int(math.floor(math.log(1.0 / scale, 2))), self.num_levels - 1)
+
+    def tile(self, n, tx, ty, size):
+        """Return the tile ``(tx, ty)`` of ``size`` pixels of level ``n``."""
+        level = self.level(n)
+        return np.ascontiguousarray(level[ty * size:(ty + 1) * size, tx * size:(tx + 1) * size])
+
+    def tileRange(self, n, size, left, top, right, bottom):
+        """
+        Return the ranges of the tile columns and rows of level ``n`` which
+        intersect the rectangle given in pixels of the image.
+        """
+        h, w = self.height() >> n, self.width() >> n
+        span = float(size << n)
+        columns = range(max(int(left // span), 0),
+                        min(int(math.ceil(right / span)), int(math.ceil(w / float(size)))))
+        rows = range(max(int(top // span), 0),
+                     min(int(math.ceil(bottom / span)), int(math.ceil(h / float(size)))))
+        return columns, rows
+
+
+class TiledImageItem(QGraphicsItem):
+    """
+    Graphics item showing an image as tiles of ``tile_size`` pixels.  When
+    painted, the level of the ``ImagePyramid`` matching the scale of the view
+    is chosen, and only the tiles in the exposed rectangle are drawn.  The
+    tiles are converted to pixmaps when they are first drawn, and the
+    ``max_tiles`` most recently drawn pixmaps are kept.
+    """
+    tile_size = 512
+
+    def __init__(self, image, max_tiles=256, parent=None):
+        QGraphicsItem.__init__(self, parent)
+        self._pyramid = ImagePyramid(image, self.tile_size)
+        self._tiles = OrderedDict()
+        self._max_tiles = max_tiles
+        self._rect = QRectF(0, 0, self._pyramid.width(), self._pyramid.height())
+        # Needed for option.exposedRect
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def pyramid(self):
+        return self._pyramid
+
+    def boundingRect(self):
+        return self._rect
+
+    def tilePixmap(self, n, tx, ty):
+        key = (n, tx, ty)
+        pixmap = self._tiles.pop(key, None)
+        if pixmap is None:
+            tile = self._pyramid.tile(n, tx, ty, self.tile_size)
+            # toQImage wraps the tile, which QPixmap.fromImage copies
+            pixmap = QPixmap.fromImage(toQImage(tile))
+            while len(self._tiles) >= self._max_tiles:
+                self._tiles.popitem(last=False)
+        self._tiles[key] = pixmap
+        return pixmap
+
+    def paint(self, painter, option, widget=None):
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        n = self._pyramid.levelForScale(scale)
+        exposed = option.exposedRect
+        columns, rows = self._pyramid.tileRange(n, self.tile_size, exposed.left(), exposed.top(),
+                                                exposed.right(), exposed.bottom())
+        factor = 1 << n
+        span = self.tile_size << n
+        for ty in rows:
+            for tx in columns:
+                pixmap = self.tilePixmap(n, tx, ty)
+                target = QRectF(tx * span, ty * span, pixmap.width() * factor, pixmap.height() * factor)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
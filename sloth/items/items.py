@@ -114,7 +114,8 @@ class BaseItem(QAbstractGraphicsShapeItem):
     def onDataChanged(self, indexFrom, indexTo):
         # FIXME why is this not updated, when changed graphically via attribute box ?
         #print "onDataChanged", self._model_item.index(), indexFrom, indexTo, indexFrom.parent()
-        if indexFrom == self._model_item.index():
+        index = self._model_item.index()
+        if indexFrom.parent() == index.parent() and indexFrom.row() <= index.row() <= indexTo.row():
             self.changeColor()
             #print "hit"
             # self._text_item.setHtml(self._compile_text())
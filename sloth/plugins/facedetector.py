@@ -19,6 +19,7 @@ class Worker(QThread):
         for i, item in enumerate(self.model.iterator(ImageModelItem)):
             img = self.labeltool.getImage(item)
             faces = self.det.detectFaces(img)
+            anns = []
             for face in faces:
                 ann = {
                         'class':    'face',
@@ -28,7 +29,8 @@ class Worker(QThread):
                         'height':   face.box.height,
                         'det_conf': face.conf,
                         }
-                item.addAnnotation(ann)
+                anns.append(ann)
+            item.addAnnotations(anns)
             self.valueChanged.emit(i+1)
             if self.canceled:
                 return
@@ -0,0 +1,71 @@
+import copy
+import numpy as np
+from sloth.annotations.columnar import AnnotationTable, AnnotationRecord
+from sloth.annotations.container import JsonContainer, MsgpackContainer, SlothDbContainer
+
+
+def someAnnotations():
+    return [
+        {'class': 'image', 'filename': 'a.png',
+         'annotations': [{'class': 'rect', 'x': 10, 'y': 20.5, 'width': 30, 'height': 40},
+                         {'class': 'point', 'x': 1.5, 'y': 2.5, 'unconfirmed': True},
+                         {'class': 'polygon', 'xn': '1;2;3', 'yn': '4;5;6'}]},
+        {'class': 'video', 'filename': 'b.avi',
+         'frames': [{'num': 0, 'annotations': [{'class': 'rect', 'x': 1, 'y': 2, 'width': 3,
+                                                'height': 4, 'id': 7}]},
+                    {'num': 1, 'annotations': []}]},
+    ]
+
+
+def test_roundtrip():
+    annotations = someAnnotations()
+    table, fileitems = AnnotationTable.fromFileItems(copy.deepcopy(annotations), attach=True)
+    assert len(table) == 4
+    assert list(table.data['file']) == [0, 0, 0, 1]
+    assert list(table.data['frame']) == [-1, -1, -1, 0]
+    assert all(isinstance(ann, AnnotationRecord) for ann in fileitems[0]['annotations'])
+    assert fileitems == annotations
+    assert type(table.annotation(0)['x']) is int
+    assert type(table.annotation(0)['y']) is float
+
+
+def test_record_write_through():
+    table, fileitems = AnnotationTable.fromFileItems(someAnnotations(), attach=True)
+    record = fileitems[0]['annotations'][1]
+    record['x'] = 100
+    record['class'] = 'new'
+    record['x'] = 'not a number'
+    record['comment'] = 'foo'
+    del record['unconfirmed']
+    assert dict(record) == {'class': 'new', 'x': 'not a number', 'y': 2.5, 'comment': 'foo'}
+    assert np.isnan(table.data['x'][1])
+    assert table.className(table.data['class'][1]) == 'new'
+    assert 'unconfirmed' not in record
+
+    # Copies are plain dicts which are independent of the table
+    copied = copy.deepcopy(record)
+    assert type(copied) is dict and copied == record
+    copied['y'] = 0
+    assert record['y'] == 2.5
+
+
+def test_statistics_select():
+    table, fileitems = AnnotationTable.fromFileItems(someAnnotations())
+    stats = table.statistics()
+    assert stats['rect']['count'] == 2
+    assert stats['rect']['width'] == (16.5, 3.0, 30.0)
+    assert 'width' not in stats['point']
+
+    rects = table.select(table.mask(classes=['rect']))
+    assert len(rects) == 2
+    assert rects.annotation(1)['id'] == 7
+    assert np.allclose(rects.boxes(), [[10, 20.5, 40, 60.5], [1, 2, 4, 6]])
+
+
+def test_container_save(tmpdir):
+    table, fileitems = AnnotationTable.fromFileItems(someAnnotations(), attach=True)
+    for container, ext in ((JsonContainer, 'json'), (MsgpackContainer, 'msgpack'),
+                           (SlothDbContainer, 'slothdb')):
+        filename = str(tmpdir.join('labels.' + ext))
+        container().save(fileitems, filename)
+        assert list(container().load(filename)) == someAnnotations()
@@ -1,3 +1,4 @@
+import pytest
 from sloth.core.commands import *
 
 
@@ -112,3 +113,80 @@ def test_merge_command_same_file(tmpdir):
     assert len(merged_annotations) == 2
     assert len(merged_annotations[0]['annotations']) == 4
     assert len(merged_annotations[1]['annotations']) == 2
+
+
+class LabelToolMockup:
+    container_config = (('*', 'sloth.annotations.container.JsonContainer'),)
+    _container_factory = AnnotationContainerFactory(container_config)
+
+    def mainWindow(self):
+        return None
+
+
+def rect(x, y=0, w=10, h=10):
+    return {'class': 'rect', 'x': x, 'y': y, 'width': w, 'height': h}
+
+
+def test_copy_annotations_command(tmpdir):
+    pytest.importorskip("PyQt4")
+    import json
+    input_fname = str(tmpdir.join('input.json'))
+    output_fname = str(tmpdir.join('output.json'))
+    frames = [[rect(0), {'class': 'point', 'x': 5, 'y': 5}],
+              [rect(1)],
+              [],
+              [rect(50)]]
+    with open(input_fname, 'w') as f:
+        json.dump([{'class': 'image', 'filename': 'a.png', 'annotations': [rect(0)]},
+                   {'class': 'video', 'filename': 'a.avi',
+                    'frames': [{'num': i, 'annotations': anns} for i, anns in enumerate(frames)]}], f)
+
+    cc = CopyAnnotationsCommand()
+    cc.labeltool = LabelToolMockup()
+    cc.handle(input_fname, output_fname, classes=None, frames=1, overlap=0.5, prefix='')
+
+    output = json.load(open(output_fname))
+    assert output[0]['annotations'] == [rect(0)]
+    result = [frame['annotations'] for frame in output[1]['frames']]
+    # The rect of the first frame overlaps the one of the second frame
+    assert result[1] == [rect(1), {'class': 'point', 'x': 5, 'y': 5}]
+    assert result[2] == result[1]
+    assert result[3] == [rect(50)] + result[1]
+    # The label file itself is not changed
+    assert json.load(open(input_fname))[1]['frames'][2]['annotations'] == []
+
+    cc.handle(input_fname, output_fname, classes=['point'], frames=1, overlap=0.5, prefix='')
+    result = [frame['annotations'] for frame in json.load(open(output_fname))[1]['frames']]
+    assert result[2] == [{'class': 'point', 'x': 5, 'y': 5}]
+
+
+def test_copy_annotations_overlaps():
+    pytest.importorskip("PyQt4")
+    import random
+    from sloth.annotations.model import CopyAnnotations
+    copier = CopyAnnotations(LabelToolMockup(), overlap_threshold=0.3)
+
+    def scalarSelect(current, candidates):
+        selected = []
+        for ann in candidates:
+            r = copier.getRect(ann)
+            if r is not None:
+                others = [copier.getRect(other) for other in current + selected]
+                if any(copier.overlap(r, other) > 0.3 for other in others if other is not None):
+                    continue
+            selected.append(ann)
+        return selected
+
+    random.seed(17)
+    for i in range(200):
+        def randomAnnotations():
+            anns = []
+            for j in range(random.randint(0, 8)):
+                if random.random() < 0.2:
+                    anns.append({'class': 'point', 'x': j})
+                else:
+                    anns.append(rect(random.randint(0, 40), random.randint(0, 40),
+                                     random.randint(1, 20), random.randint(1, 20)))
+            return anns
+        current, candidates = randomAnnotations(), randomAnnotations()
+        assert copier.selectAnnotations(current, candidates) == scalarSelect(current, candidates)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""
+Benchmark loading and saving of synthetic label sets with all containers
+and the annotation model.
+
+Each measurement runs in a separate process, so that its peak resident
+memory can be reported.  One JSON record is written per measurement, e.g.::
+
+    python tests/container_benchmark.py --images 10000 --annotations 10 \\
+        --videos 10 --frames 500 --output results.jsonl
+
+Measurements:
+
+* ``save``: ``container.save()`` of the label set
+* ``open``: ``container.load()`` only, which for lazily loading containers
+  does not decode all file items
+* ``load``: ``container.load()`` and decoding of all file items
+* ``model``: constructing an ``AnnotationModel`` from ``container.load()``
+* ``materialize``: converting all file items and annotations of the loaded
+  model to model items, which should scale linearly with the number of
+  images.  The difference of ``peak_rss_kb`` and ``rss_before_kb`` is the
+  memory used by the model items, e.g. for 1M annotations with
+  ``--images 100000 --annotations 10 --containers PickleContainer``
+* ``getAnnotations``: ``AnnotationModel.root().getAnnotations()`` of the
+  loaded model, once for the unmodified model and once (``touched``) after
+  all file items have been converted to model items
+
+The model measurements need PyQt4 and are skipped if it is not installed.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CONTAINERS = (
+    ('JsonContainer',          '.json'),
+    ('CompactJsonContainer',   '.json'),
+    ('GzipJsonContainer',      '.json.gz'),
+    ('ZstdJsonContainer',      '.json.zst'),
+    ('StreamingJsonContainer', '.json'),
+    ('MsgpackContainer',       '.msgpack'),
+    ('PickleContainer',        '.pickle'),
+    ('YamlContainer',          '.yaml'),
+    ('SlothDbContainer',       '.slothdb'),
+    ('ShardedContainer',       '.shards'),
+)
+
+OPERATIONS = ('save', 'open', 'load', 'model', 'materialize', 'getAnnotations')
+
+
+def generateAnnotation(rnd):
+    kind = rnd.choice(('rect', 'point', 'polygon'))
+    if kind == 'rect':
+        return {'class': 'rect',
+                'x': rnd.uniform(0, 600), 'y': rnd.uniform(0, 400),
+                'width': rnd.uniform(10, 100), 'height': rnd.uniform(10, 100)}
+    elif kind == 'point':
+        return {'class': 'point',
+                'x': rnd.uniform(0, 640), 'y': rnd.uniform(0, 480)}
+    else:
+        n = rnd.randint(3, 12)
+        return {'class': 'polygon',
+                'xn': ";".join("%.2f" % rnd.uniform(0, 640) for i in range(n)),
+                'yn': ";".join("%.2f" % rnd.uniform(0, 480) for i in range(n))}
+
+
+def generateAnnotations(num_images, num_annotations, num_videos=0, num_frames=0, seed=0):
+    """
+    Generate a synthetic label set with ``num_images`` images and
+    ``num_videos`` videos of ``num_frames`` frames.  Each image and frame has
+    ``num_annotations`` annotations, which are a mix of rects, points and
+    polygons.
+    """
+    rnd = random.Random(seed)
+    annotations = []
+    for i in range(num_images):
+        annotations.append({
+            'class': 'image',
+            'filename': 'images/image%07d.jpg' % i,
+            'annotations': [generateAnnotation(rnd) for k in range(num_annotations)],
+        })
+    for i in range(num_videos):
+        frames = []
+        for f in range(num_frames):
+            frames.append({
+                'num': f,
+                'timestamp': f / 25.0,
+                'annotations': [generateAnnotation(rnd) for k in range(num_annotations)],
+            })
+        annotations.append({
+            'class': 'video',
+            'filename': 'videos/video%04d.avi' % i,
+            'frames': frames,
+        })
+    return annotations
+
+
+def maxRss():
+    """Peak resident memory of this process in KiB."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def fileSize(filename):
+    size = os.path.getsize(filename)
+    if filename.endswith('.shards'):
+        basedir = os.path.dirname(filename)
+        for line in open(filename):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                size += os.path.getsize(os.path.join(basedir, line))
+    return size
+
+
+def runOperation(container_name, operation, filename, datafile):
+    """
+    Run a single measurement in this process and return its record.
+    """
+    from sloth.annotations import container as containers
+    container = getattr(containers, container_name)()
+    rss_before = maxRss()
+
+    if operation == 'save':
+        with open(datafile) as f:
+            annotations = json.load(f)
+        rss_before = maxRss()
+        start = time.time()
+        container.save(annotations, filename)
+        elapsed = time.time() - start
+    elif operation == 'open':
+        start = time.time()
+        annotations = container.load(filename)
+        elapsed = time.time() - start
+    elif operation == 'load':
+        start = time.time()
+        annotations = list(container.load(filename))
+        elapsed = time.time() - start
+    else:
+        from sloth.annotations.model import AnnotationModel
+        if operation == 'model':
+            start = time.time()
+            model = AnnotationModel(container.load(filename))
+            elapsed = time.time() - start
+        elif operation == 'materialize':
+            model = AnnotationModel(container.load(filename))
+            model.root().fetchAll()
+            rss_before = maxRss()
+            start = time.time()
+            for item in model.root().children():
+                item.children()
+            elapsed = time.time() - start
+        else:
+            model = AnnotationModel(container.load(filename))
+            model.root().fetchAll()
+            start = time.time()
+            model.root().getAnnotations()
+            elapsed = time.time() - start
+
+            # Convert all file items to model items
+            for item in model.root().children():
+                item.children()
+            rss_before = maxRss()
+            start_touched = time.time()
+            model.root().getAnnotations()
+            elapsed_touched = time.time() - start_touched
+
+    record = {
+        'container': container_name,
+        'operation': operation,
+        'seconds': elapsed,
+        'rss_before_kb': rss_before,
+        'peak_rss_kb': maxRss(),
+    }
+    if operation == 'getAnnotations':
+        record['seconds_touched'] = elapsed_touched
+    return record
+
+
+def runIsolated(container_name, operation, filename, datafile):
+    """
+    Run a single measurement in a new process.  Returns the record, or a
+    record with an ``error`` entry if the measurement failed.
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), '--run',
+           container_name, operation, filename, datafile]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        lines = err.decode('utf-8', 'replace').strip().splitlines()
+        return {'container': container_name, 'operation': operation,
+                'error': lines[-1] if lines else 'exit code %d' % proc.returncode}
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=1000, help='number of images')
+    parser.add_argument('--annotations', type=int, default=10, help='annotations per image/frame')
+    parser.add_argument('--videos', type=int, default=0, help='number of videos')
+    parser.add_argument('--frames', type=int, default=100, help='frames per video')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--containers', nargs='+', default=[name for name, ext in CONTAINERS],
+                        help='containers to benchmark')
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS), choices=OPERATIONS,
+                        help='operations to benchmark')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    parser.add_argument('--keep', help='directory for the generated label files, which are kept')
+    parser.add_argument('--run', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(runOperation(*args.run)))
+        return
+
+    annotations = generateAnnotations(args.images, args.annotations,
+                                      args.videos, args.frames, args.seed)
+    num_files = len(annotations)
+    num_annotations = (args.images + args.videos * args.frames) * args.annotations
+
+    workdir = args.keep or tempfile.mkdtemp(prefix='sloth-benchmark-')
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+    datafile = os.path.join(workdir, 'data.json')
+    with open(datafile, 'w') as f:
+        json.dump(annotations, f)
+    del annotations
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    extensions = dict(CONTAINERS)
+    try:
+        for name in args.containers:
+            filename = os.path.join(workdir, 'labels-%s%s' % (name, extensions.get(name, '')))
+            # All load operations need the label file
+            operations = list(args.operations)
+            if 'save' not in operations:
+                operations.insert(0, 'save')
+            for operation in operations:
+                record = runIsolated(name, operation, filename, datafile)
+                if operation not in args.operations:
+                    if 'error' in record:
+                        break
+                    continue
+                record.update({'images': args.images, 'videos': args.videos,
+                               'frames': args.frames, 'annotations': num_annotations,
+                               'python': sys.version.split()[0]})
+                if 'error' not in record:
+                    if os.path.exists(filename):
+                        record['file_bytes'] = fileSize(filename)
+                        record['mb_per_second'] = record['file_bytes'] / 1e6 / max(record['seconds'], 1e-9)
+                    record['files_per_second'] = num_files / max(record['seconds'], 1e-9)
+                out.write(json.dumps(record, sort_keys=True) + "\n")
+                out.flush()
+                if operation == 'save' and 'error' in record:
+                    break
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if not args.keep:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import math
+import pytest
 from sloth.annotations.container import *
 
 
@@ -64,3 +66,268 @@ def test_YamlContainer(tmpdir):
     filename = os.path.join(str(tmpdir), "test_YamlContainer.yaml")
     container = YamlContainer()
     common_container_test(filename, container)
+
+
+def test_StreamingJsonContainer(tmpdir):
+    filename = os.path.join(str(tmpdir), "test_StreamingJsonContainer.json")
+    container = StreamingJsonContainer()
+    common_container_test(filename, container)
+
+    # read with small chunks so that items span several reads
+    container.chunk_size = 7
+    anns = container.load(filename)
+    assert not isinstance(anns, list)
+    assert list(anns) == someAnnotations()
+
+
+def test_StreamingJsonContainer_no_list(tmpdir):
+    filename = os.path.join(str(tmpdir), "test_StreamingJsonContainer.json")
+    with open(filename, "w") as f:
+        f.write('  {"a": [1, 2]}')
+    container = StreamingJsonContainer()
+    with pytest.raises(InvalidArgumentException):
+        list(container.load(filename))
+
+    with open(filename, "w") as f:
+        f.write('[]')
+    assert list(container.load(filename)) == []
+
+
+def test_SlothDbContainer(tmpdir):
+    filename = os.path.join(str(tmpdir), "test_SlothDbContainer.slothdb")
+    container = SlothDbContainer()
+    common_container_test(filename, container)
+
+    anns = container.load(filename)
+    original_anns = someAnnotations()
+    assert len(anns) == len(original_anns)
+    assert anns[3] == original_anns[3]
+    assert anns[-1] == original_anns[-1]
+    assert list(anns) == original_anns
+
+    # file items read lazily stay valid when the file is overwritten
+    container.save(original_anns[:2], filename)
+    assert anns[4] == original_anns[4]
+    assert len(container.load(filename)) == 2
+
+    # clearing the container closes the files of all loaded file items
+    reloaded = container.load(filename, use_mmap=True)
+    container.clear()
+    for items in (anns, reloaded):
+        with pytest.raises(ValueError):
+            items[0]
+
+
+def test_journal(tmpdir):
+    for container, ext in ((JsonContainer(), 'json'),
+                           (StreamingJsonContainer(), 'json'),
+                           (SlothDbContainer(), 'slothdb')):
+        filename = os.path.join(str(tmpdir), "test_journal." + ext)
+        anns = someAnnotations()
+        container.save(anns, filename)
+
+        anns[1]['annotations'] = []
+        new_file = {'filename': 'file5.png', 'type': 'image', 'annotations': []}
+        anns.append(new_file)
+        container.saveIncremental([(1, anns[1])])
+        container.saveIncremental([(5, new_file)])
+        assert container.journalLength() == 2
+        assert os.path.exists(container.journalFilename())
+
+        container.clear()
+        assert list(container.load(filename)) == anns
+        assert container.journalLength() == 2
+
+        # a full save merges the journal
+        container.save(anns, filename)
+        assert not os.path.exists(container.journalFilename())
+        assert container.journalLength() == 0
+        assert list(container.load(filename)) == anns
+
+
+def test_journal_partial_record(tmpdir):
+    filename = os.path.join(str(tmpdir), "test_journal_partial.json")
+    anns = someAnnotations()
+    container = JsonContainer()
+    container.save(anns, filename)
+    anns[1]['annotations'] = []
+    container.saveIncremental([(1, anns[1])])
+
+    # An interrupted save leaves an incomplete last record
+    with open(container.journalFilename(), "a") as f:
+        f.write('{"row":2,"item":{"filena')
+    anns[3]['annotations'] = []
+    container.saveIncremental([(3, anns[3])])
+
+    container.clear()
+    assert list(container.load(filename)) == anns
+    assert container.journalLength() == 2
+
+
+def test_journal_missing_row(tmpdir):
+    for container, ext in ((JsonContainer(), 'json'),
+                           (StreamingJsonContainer(), 'json'),
+                           (SlothDbContainer(), 'slothdb')):
+        filename = os.path.join(str(tmpdir), "test_journal_missing." + ext)
+        anns = someAnnotations()
+        container.save(anns, filename)
+        new_file = {'filename': 'file9.png', 'type': 'image', 'annotations': []}
+        container.saveIncremental([(6, new_file)])
+
+        container.clear()
+        with pytest.raises(InvalidArgumentException):
+            list(container.load(filename))
+
+
+def test_SlothDbContainer_copies_records(tmpdir):
+    filename = os.path.join(str(tmpdir), "test_copy.slothdb")
+    copyname = os.path.join(str(tmpdir), "test_copy2.slothdb")
+    anns = someAnnotations()
+    SlothDbContainer().save(anns, filename)
+    items = SlothDbContainer().load(filename)
+    assert items.encodedItem(1) == json.dumps(anns[1], separators=(',', ':')).encode("utf-8")
+    SlothDbContainer().save(items, copyname)
+    with open(filename, "rb") as a, open(copyname, "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_CompactJsonContainer(tmpdir):
+    filename = os.path.join(str(tmpdir), "test_CompactJsonContainer.json")
+    container = CompactJsonContainer()
+    common_container_test(filename, container)
+    assert JsonContainer().load(filename) == someAnnotations()
+
+
+def test_GzipJsonContainer(tmpdir):
+    filename = os.path.join(str(tmpdir), "test_GzipJsonContainer.json.gz")
+    container = GzipJsonContainer()
+    common_container_test(filename, container)
+
+    # compressed files are recognized by all JSON containers
+    assert JsonContainer().load(filename) == someAnnotations()
+    assert list(StreamingJsonContainer().load(filename)) == someAnnotations()
+
+
+def test_ZstdJsonContainer(tmpdir):
+    pytest.importorskip("zstandard")
+    filename = os.path.join(str(tmpdir), "test_ZstdJsonContainer.json.zst")
+    container = ZstdJsonContainer()
+    common_container_test(filename, container)
+    assert list(StreamingJsonContainer().load(filename)) == someAnnotations()
+
+
+def test_json_nonfinite(tmpdir):
+    containers = [('json', JsonContainer()),
+                  ('compact.json', CompactJsonContainer()),
+                  ('json.gz', GzipJsonContainer())]
+    if zstandard is not None:
+        containers.append(('json.zst', ZstdJsonContainer()))
+    anns = [{'filename': 'a.png', 'annotations': [
+        {'x': float('nan'), 'y': float('inf'), 'w': [float('-inf')], 'h': None}]}]
+
+    for ext, container in containers:
+        filename = os.path.join(str(tmpdir), "test_json_nonfinite." + ext)
+        container.save(anns, filename)
+        for use_mmap in (False, True):
+            ann = container.load(filename, use_mmap=use_mmap)[0]['annotations'][0]
+            assert math.isnan(ann['x'])
+            assert ann['y'] == float('inf')
+            assert ann['w'] == [float('-inf')]
+            assert ann['h'] is None
+
+
+def test_factory_compressed_patterns():
+    from sloth.conf import default_config
+    factory = AnnotationContainerFactory(default_config.CONTAINERS)
+    assert isinstance(factory.create("labels.json.gz"), GzipJsonContainer)
+    assert isinstance(factory.create("labels.json.zst"), ZstdJsonContainer)
+    assert type(factory.create("labels.json")) is JsonContainer
+
+
+def test_MsgpackContainer(tmpdir):
+    msgpack = pytest.importorskip("msgpack")
+    filename = os.path.join(str(tmpdir), "test_MsgpackContainer.msgpack")
+    container = MsgpackContainer()
+    common_container_test(filename, container)
+    assert list(container.load(filename)) == someAnnotations()
+
+    # single array of all file items
+    with open(filename, "wb") as f:
+        msgpack.pack(someAnnotations(), f, use_bin_type=True)
+    assert list(container.load(filename)) == someAnnotations()
+
+    container.save([], filename)
+    assert list(container.load(filename)) == []
+
+
+def test_load_mmap(tmpdir):
+    containers = [('json', JsonContainer()),
+                  ('json.gz', GzipJsonContainer()),
+                  ('pickle', PickleContainer()),
+                  ('slothdb', SlothDbContainer())]
+    try:
+        import msgpack
+        containers.append(('msgpack', MsgpackContainer()))
+    except ImportError:
+        pass
+
+    for ext, container in containers:
+        filename = os.path.join(str(tmpdir), "test_load_mmap." + ext)
+        container.save(someAnnotations(), filename)
+        assert list(container.load(filename, use_mmap=True)) == someAnnotations()
+
+        # empty files cannot be mapped
+        container.save([], filename)
+        assert list(container.load(filename, use_mmap=True)) == []
+
+
+def test_ShardedContainer(tmpdir):
+    basedir = str(tmpdir)
+    anns = someAnnotations()
+    shards = [anns[:2], anns[2:3], anns[3:]]
+    for n, items in enumerate(shards):
+        JsonContainer().save(items, os.path.join(basedir, "shard%d.json" % n))
+    filename = os.path.join(basedir, "test.shards")
+    with open(filename, "w") as f:
+        f.write("# test\nshard0.json\n\nshard1.json\nshard2.json\n")
+
+    container = ShardedContainer()
+    loaded = container.load(filename)
+    assert loaded == anns
+
+    # only the shard of the modified file item is written
+    for n in range(3):
+        os.utime(os.path.join(basedir, "shard%d.json" % n), (0, 0))
+    changed = list(loaded)
+    changed[2] = dict(changed[2], unlabeled=True)
+    container.save(changed, filename)
+    mtimes = [os.path.getmtime(os.path.join(basedir, "shard%d.json" % n)) for n in range(3)]
+    assert mtimes[0] == 0 and mtimes[1] != 0 and mtimes[2] == 0
+    assert JsonContainer().load(os.path.join(basedir, "shard1.json")) == [changed[2]]
+
+    # new file items are appended to the last shard, deleted ones removed
+    changed = changed[1:] + [{'filename': 'new.png', 'class': 'image', 'annotations': []}]
+    container.save(changed, filename)
+    assert ShardedContainer().load(filename) == changed
+    assert len(JsonContainer().load(os.path.join(basedir, "shard0.json"))) == 1
+    assert len(JsonContainer().load(os.path.join(basedir, "shard2.json"))) == 3
+
+    # a new manifest is split into shards of shard_size file items
+    container = ShardedContainer()
+    container.shard_size = 2
+    filename = os.path.join(basedir, "new.shards")
+    container.save(anns, filename)
+    assert container.readManifest(filename) == ["new-00000.json", "new-00001.json", "new-00002.json"]
+    assert ShardedContainer().load(filename) == anns
+
+
+def test_ShardedContainer_serializeToFile(tmpdir):
+    filename = os.path.join(str(tmpdir), "direct.shards")
+    container = ShardedContainer()
+    container.shard_size = 3
+    container.serializeToFile(filename, someAnnotations())
+    assert container.readManifest(filename) == ["direct-00000.json", "direct-00001.json"]
+
+    container = ShardedContainer()
+    container.processes = 2
+    assert container.load(filename) == someAnnotations()
@@ -0,0 +1,111 @@
+import os
+import time
+import threading
+import numpy as np
+from sloth.annotations.imagecache import ImageCache, ImagePrefetcher
+from sloth.annotations.container import JsonContainer
+
+
+def test_lru_eviction():
+    cache = ImageCache(max_bytes=300)
+    for key in 'abc':
+        cache.put(key, np.zeros(100, dtype=np.uint8))
+    assert cache.get('a') is not None
+    cache.put('d', np.zeros(100, dtype=np.uint8))
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache and 'd' in cache
+    assert cache.get('b') is None
+
+    # Images larger than the budget are not cached
+    cache.put('e', np.zeros(1000, dtype=np.uint8))
+    assert 'e' not in cache
+
+    stats = cache.statistics()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['evictions'] == 1
+    assert stats['images'] == 3
+    assert stats['bytes'] == 300
+
+    cache.setMaxBytes(100)
+    assert len(cache) == 1 and 'd' in cache
+
+
+def test_container_caches_images(tmpdir):
+    from PIL import Image
+    Image.fromarray(np.arange(12, dtype=np.uint8).reshape(3, 4)).save(str(tmpdir.join('a.png')))
+    labelfile = str(tmpdir.join('labels.json'))
+    container = JsonContainer()
+    container.save([], labelfile)
+    container.load(labelfile)
+    container.setImageCache(ImageCache(max_bytes=1000))
+
+    image = container.loadImage('a.png')
+    assert image.shape == (3, 4)
+    assert not image.flags.writeable
+    assert container.loadImage('a.png') is image
+    stats = container.imageCache().statistics()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+    # Changing the image file invalidates the cached image
+    os.utime(str(tmpdir.join('a.png')), (0, 0))
+    assert container.loadImage('a.png') is not image
+    assert container.loadImage('missing.png') is None
+
+
+def test_prefetcher():
+    cache = ImageCache(max_bytes=1000)
+    started = threading.Event()
+    release = threading.Event()
+    decoded = []
+
+    def load(key, block=False):
+        def decode():
+            if block:
+                started.set()
+                release.wait()
+            decoded.append(key)
+            return np.zeros(10, dtype=np.uint8)
+        return lambda: cache.getOrLoad(key, decode)
+
+    prefetcher = ImagePrefetcher(num_threads=1)
+    prefetcher.prefetch([load('a', block=True), load('b')])
+    started.wait()
+    # Replaces the requests which have not been started
+    prefetcher.prefetch([load('c')])
+    # Waits for the running decode instead of decoding 'a' again
+    threading.Timer(0.05, release.set).start()
+    assert cache.getOrLoad('a', lambda: 1 / 0) is not None
+    for i in range(100):
+        if 'c' in cache:
+            break
+        time.sleep(0.01)
+    prefetcher.stop()
+    assert decoded == ['a', 'c']
+
+
+def test_waiter_gets_uncached_image():
+    cache = ImageCache(max_bytes=10)
+    started = threading.Event()
+    release = threading.Event()
+    decoded = []
+
+    def decode():
+        started.set()
+        release.wait()
+        decoded.append('a')
+        return np.zeros(100, dtype=np.uint8)
+
+    thread = threading.Thread(target=cache.getOrLoad, args=('a', decode))
+    thread.start()
+    started.wait()
+    # The image is too large to be cached, but is handed to the waiter
+    threading.Timer(0.05, release.set).start()
+    assert cache.getOrLoad('a', lambda: 1 / 0).shape == (100, )
+    thread.join()
+    assert decoded == ['a']
+    assert 'a' not in cache
+    assert not cache.lastImageFits()
+
+    cache.put('b', np.zeros(10, dtype=np.uint8))
+    assert cache.lastImageFits()
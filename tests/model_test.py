@@ -1,14 +1,328 @@
 #!/usr/bin/env python
 import os, sys
-from PyQt4.QtGui import QApplication
-from sloth.gui import MainWindow
-from sloth.core.labeltool import LabelTool
-from sloth import APP_NAME, ORGANIZATION_NAME, ORGANIZATION_DOMAIN
-from pymodeltest.modeltest import ModelTest
+import random
+from PyQt4.QtCore import QModelIndex, Qt
+from sloth.annotations.model import AnnotationModel, ModelItem, FileModelItem, FrameModelItem, \
+    AnnotationModelItem, InterpolateRange
+from sloth.annotations.container import JsonContainer
 
 SAMPLE_DATA = os.path.join(os.path.dirname(__file__), 'data', 'example1_labels.json')
 
+
+def someFiles(n=5):
+    return [{'class': 'image', 'filename': 'f%d.png' % i,
+             'annotations': [{'class': 'rect', 'x': i}]} for i in range(n)]
+
+
+def test_incremental_save_insert(tmpdir):
+    filename = os.path.join(str(tmpdir), "labels.json")
+    container = JsonContainer()
+    container.save(someFiles(), filename)
+
+    model = AnnotationModel(container.load(filename))
+    model.root().appendFileItem({'class': 'image', 'filename': 'last.png', 'annotations': []})
+    changes = model.fileChanges()
+    assert [row for row, item in changes] == [5]
+    container.saveIncremental(changes, filename)
+    model.clearFileChanges()
+
+    # Inserting before other file items changes their rows
+    model.root().insertChild(1, FileModelItem.create(
+        {'class': 'image', 'filename': 'new.png', 'annotations': []}))
+    assert model.fileChanges() is None
+
+    # which requires a full save
+    container.save(model.root().getAnnotations(), filename)
+    model.clearFileChanges()
+    assert [f['filename'] for f in JsonContainer().load(filename)] == \
+        ['f0.png', 'new.png', 'f1.png', 'f2.png', 'f3.png', 'f4.png', 'last.png']
+
+
+
+def test_file_changes_rows():
+    model = AnnotationModel(someFiles())
+    model.root().childAt(3)['note'] = 'changed'
+    model.root().insertChild(0, FileModelItem.create(
+        {'class': 'image', 'filename': 'new.png', 'annotations': []}))
+    assert model.fileChanges() is None
+    model.clearFileChanges()
+
+    # The rows of changed file items are resolved when the changes are taken
+    model.root().childAt(4)['note'] = 'again'
+    model.root().appendFileItem({'class': 'image', 'filename': 'last.png', 'annotations': []})
+    changes = model.fileChanges()
+    assert [(row, item['filename']) for row, item in changes] == [(4, 'f3.png'), (6, 'last.png')]
+    assert changes[0][1]['note'] == 'again'
+
+    # A changed file item which was removed cannot be saved per row
+    model.clearFileChanges()
+    item = model.root().childAt(2)
+    item['note'] = 'removed'
+    model.root().deleteChild(item)
+    assert model.fileChanges() is None
+
+
+
+# Roles queried by the views and their delegates for every visible cell
+VIEW_ROLES = [Qt.DisplayRole, Qt.DecorationRole, Qt.ToolTipRole, Qt.StatusTipRole,
+              Qt.WhatsThisRole, Qt.FontRole, Qt.TextAlignmentRole, Qt.BackgroundRole,
+              Qt.ForegroundRole, Qt.CheckStateRole, Qt.SizeHintRole]
+
+
+def queryView(model, parent=QModelIndex()):
+    for row in range(model.rowCount(parent)):
+        for column in range(model.columnCount(parent)):
+            index = model.index(row, column, parent)
+            for role in VIEW_ROLES:
+                model.data(index, role)
+            model.flags(index)
+            model.hasChildren(index)
+            model.rowCount(index)
+
+
+def test_view_roles_keep_rows_unloaded():
+    model = AnnotationModel(someFiles(20))
+    queryView(model)
+    assert not any(isinstance(child, ModelItem) for child in model.root()._children)
+    assert model.data(model.index(2, 0), Qt.DisplayRole).endswith('f2.png')
+
+    # Expanding a file item creates it, but not its annotations
+    fileitem = model.root().childAt(2)
+    queryView(model, model.index(2, 0))
+    assert not any(isinstance(child, ModelItem) for child in fileitem._children)
+
+
+
+def newFile(name):
+    return FileModelItem.create({'class': 'image', 'filename': name, 'annotations': []})
+
+
+def test_insert_delete_rows():
+    random.seed(12)
+    model = AnnotationModel(someFiles(200))
+    root = model.root()
+    names = ['f%d.png' % i for i in range(200)]
+    created = []
+    for step in range(300):
+        op = random.random()
+        if op < 0.4:
+            pos = random.randint(0, len(names))
+            new = ['n%d_%d.png' % (step, i) for i in range(random.randint(1, 3))]
+            items = [newFile(name) for name in new]
+            root.insertChildren(pos, items)
+            names[pos:pos] = new
+            created.extend(items)
+        elif op < 0.8:
+            rows = random.sample(range(len(names)), random.randint(1, 4))
+            # Rows and model items, including unloaded children
+            args = [root.childAt(row) if row % 2 else row for row in rows]
+            root.deleteChildren(args)
+            for row in sorted(rows, reverse=True):
+                del names[row]
+        else:
+            created.append(root.childAt(random.randrange(len(names))))
+        created = [item for item in created if item['filename'] in names]
+        assert root.rowCount() == len(names)
+        for item in created:
+            assert item.row() == names.index(item['filename'])
+    assert [f['filename'] for f in root.getAnnotations()] == names
+    assert [root.childAt(row).row() for row in range(len(names))] == list(range(len(names)))
+
+
+def test_row_ranges_signaled():
+    model = AnnotationModel(someFiles(10))
+    inserted = []
+    removed = []
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+    model.rowsRemoved.connect(lambda parent, first, last: removed.append((first, last)))
+
+    model.root().insertChildren(2, [newFile('a.png'), newFile('b.png'), newFile('c.png')])
+    assert inserted == [(2, 4)]
+    model.root().deleteChildren([1, 2, model.root().childAt(3), 8, 9])
+    # One range per contiguous block of rows, from the end
+    assert removed == [(8, 9), (1, 3)]
+    assert [f['filename'] for f in model.root().getAnnotations()] == \
+        ['f0.png', 'c.png', 'f2.png', 'f3.png', 'f4.png', 'f7.png', 'f8.png', 'f9.png']
+
+
+
+def someVideo(name, frames=3):
+    return {'class': 'video', 'filename': name, 'frames': [
+        {'num': i, 'timestamp': i / 25.0, 'annotations': [{'class': 'point', 'x': i}]}
+        for i in range(frames)]}
+
+
+def recount(files):
+    """Count the file items, frames and annotations by class."""
+    classes = {}
+    frames = 0
+    annotations = {}
+    for f in files:
+        classes[f.get('class')] = classes.get(f.get('class'), 0) + 1
+        if f.get('class') == 'video':
+            images = f.get('frames', [])
+            frames += len(images)
+        else:
+            images = [f]
+        for image in images:
+            for ann in image.get('annotations', []):
+                annotations[ann.get('class')] = annotations.get(ann.get('class'), 0) + 1
+    return classes, frames, annotations
+
+
+def checkCounts(model):
+    files, frames, annotations = recount(model.root().getAnnotations())
+    assert model.annotationIndex().files == files
+    assert model.annotationIndex().frames == frames
+    assert model.annotationClasses() == annotations
+    assert model.numFiles() == sum(files.values())
+    assert model.numFrames() == frames
+    assert model.numAnnotations() == sum(annotations.values())
+    for _class, count in annotations.items():
+        if _class is not None:
+            assert model.numAnnotations(_class) == count
+
+
+def test_annotation_index():
+    model = AnnotationModel(someFiles(5) + [someVideo('a.avi'), someVideo('b.avi', 2)])
+    root = model.root()
+    # Built from the unloaded children
+    checkCounts(model)
+    assert not any(isinstance(child, ModelItem) for child in root._children)
+
+    root.childAt(1).addAnnotation({'class': 'point', 'x': 1})
+    checkCounts(model)
+    root.childAt(2).deleteChild(0)
+    checkCounts(model)
+    ann = root.childAt(3).childAt(0)
+    ann['class'] = 'polygon'
+    checkCounts(model)
+    del ann['class']
+    checkCounts(model)
+
+    video = root.childAt(5)
+    video.childAt(1).addAnnotation({'class': 'rect'})
+    video.deleteChild(0)
+    checkCounts(model)
+    root.deleteChildren([0, video, 6])
+    checkCounts(model)
+    root.insertChildren(1, [FileModelItem.create(someVideo('c.avi')), newFile('d.png')])
+    root.appendFileItem(someFiles(1)[0])
+    checkCounts(model)
+    root.deleteAllChildren()
+    checkCounts(model)
+
+
+def test_iterator_prunes_subtrees():
+    model = AnnotationModel(someFiles(3) + [someVideo('a.avi')])
+    frames = list(model.iterator(FrameModelItem))
+    assert [frame['num'] for frame in frames] == [0, 1, 2]
+    # The annotations of the images cannot contain frames
+    for row in range(3):
+        assert not any(isinstance(child, ModelItem) for child in model.root().childAt(row)._children)
+
+    anns = list(model.iterator(AnnotationModelItem))
+    assert [ann['x'] for ann in anns] == [0, 1, 2, 0, 1, 2]
+    assert len(list(model.iterator(AnnotationModelItem, predicate=lambda ann: ann['x'] == 1))) == 2
+
+
+
+def interpolate(first, last, steps=3):
+    """
+    Interpolate the frames between the frames with the annotations ``first``
+    and ``last``, and return the result and the annotations of all frames.
+    """
+    frames = [{'num': 0, 'annotations': first}]
+    frames += [{'num': i, 'unlabeled': True, 'annotations': [{'class': 'old'}]} for i in range(1, steps + 1)]
+    frames.append({'num': steps + 1, 'annotations': last})
+    model = AnnotationModel([{'class': 'video', 'filename': 'a.avi', 'frames': frames}])
+    video = model.root().childAt(0)
+
+    class LabelToolMockup:
+        def currentImage(self):
+            return video.childAt(video.rowCount() - 1)
+
+        def mainWindow(self):
+            return None
+
+    result = InterpolateRange(LabelToolMockup()).interpolateRange()
+    return result, [[dict(ann) for ann in frame.annotations()] for frame in video.children()]
+
+
+def test_interpolate_by_id():
+    first = [{'class': 'rect', 'id': 1, 'x': 0, 'xn': '0;10', 'note': 'a'},
+             {'class': 'rect', 'id': 2, 'x': 100}]
+    last = [{'class': 'rect', 'id': 3, 'x': 0},
+            {'class': 'rect', 'id': 1, 'x': 40, 'xn': '40;50'}]
+    result, frames = interpolate(first, last)
+    assert result
+    for step in (1, 2, 3):
+        assert frames[step] == [
+            {'class': 'rect', 'id': 1, 'x': 10.0 * step, 'xn': '%s;%s' % (10.0 * step, 10.0 * step + 10),
+             'note': 'a'},
+            # Annotations without match are copied unchanged
+            {'class': 'rect', 'id': 2, 'x': 100}]
+    assert frames[0] == first and frames[4] == last
+
+
+def test_interpolate_by_class():
+    first = [{'class': 'rect', 'type': 'rect', 'x': 0, 'y': 4},
+             {'class': 'point', 'type': 'point', 'x': 0}]
+    # Not all annotations have an id
+    last = [{'class': 'point', 'type': 'point', 'x': 8, 'id': 5},
+            {'class': 'rect', 'type': 'rect', 'x': 4, 'y': 0}]
+    result, frames = interpolate(first, last)
+    assert result
+    assert [[(ann['class'], ann['x'], ann.get('y')) for ann in frame] for frame in frames[1:4]] == \
+        [[('rect', 1.0, 3.0), ('point', 2.0, None)],
+         [('rect', 2.0, 2.0), ('point', 4.0, None)],
+         [('rect', 3.0, 1.0), ('point', 6.0, None)]]
+
+    # Without ids, the number of annotations must match
+    result, frames = interpolate(first, last[:1])
+    assert not result
+    assert frames[2] == [{'class': 'old'}]
+
+    # Unmatched annotations are kept
+    first[1]['class'] = 'line'
+    result, frames = interpolate(first, last)
+    assert result
+    assert frames[2] == [{'class': 'rect', 'type': 'rect', 'x': 2.0, 'y': 2.0},
+                         {'class': 'line', 'type': 'point', 'x': 0}]
+
+
+
+def test_key_rows():
+    model = AnnotationModel([someVideo('a.avi', 1)])
+    frame = model.root().childAt(0).childAt(0)
+    assert [frame._keyRow(key) for key in ('num', 'timestamp', 'class', 'missing')] == [0, 1, None, None]
+
+    changed = []
+    inserted = []
+    model.dataChanged.connect(lambda topLeft, bottomRight: changed.append(topLeft))
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+    frame.update({'num': 5, 'extra': 1, 'unlabeled': True})
+    # One signal for the frame, the new key row is inserted before 'num'
+    assert len(changed) == 1 and changed[0].row() == 0
+    assert inserted == [(0, 0)]
+    assert [frame._keyRow(key) for key in ('extra', 'num', 'timestamp')] == [0, 1, 2]
+    assert [frame.childAt(row).key() for row in range(3)] == ['extra', 'num', 'timestamp']
+    assert frame.childAt(3)['x'] == 0
+
+    del frame['num']
+    assert [frame._keyRow(key) for key in ('extra', 'num', 'timestamp')] == [0, None, 1]
+    frame['zzz'] = 2
+    assert frame._keyRow('zzz') == 2
+    assert isinstance(frame.childAt(3), AnnotationModelItem)
+
+
 if __name__ == '__main__':
+    from PyQt4.QtGui import QApplication
+    from sloth.gui import MainWindow
+    from sloth.core.labeltool import LabelTool
+    from sloth import APP_NAME, ORGANIZATION_NAME, ORGANIZATION_DOMAIN
+    from pymodeltest.modeltest import ModelTest
+
     app = QApplication(sys.argv)
     app.setOrganizationName(ORGANIZATION_NAME)
     app.setOrganizationDomain(ORGANIZATION_DOMAIN)
@@ -0,0 +1,100 @@
+import numpy as np
+from sloth.annotations.video import VideoSource, VideoSourceCache, ImageSequenceSource, \
+    VideoSourceFactory
+from sloth.annotations.container import JsonContainer
+
+
+class CountingVideoSource(VideoSource):
+    """Video of 100 frames whose pixels are the frame number."""
+    opened = []
+
+    def __init__(self, filename):
+        self.position = 0
+        self.seeks = 0
+        self.reads = 0
+        self.closed = False
+        self.opened.append(self)
+
+    def seek(self, frame_number):
+        self.seeks += 1
+        self.position = frame_number
+        return 0 <= frame_number < 100
+
+    def read(self):
+        if self.position >= 100:
+            return None
+        self.reads += 1
+        self.position += 1
+        return np.full((2, 2), self.position - 1, dtype=np.uint8)
+
+    def close(self):
+        self.closed = True
+
+
+def test_sequential_frames_do_not_seek():
+    cache = VideoSourceCache(max_sources=2, buffer_size=4, open_source=CountingVideoSource)
+    for frame in range(10):
+        assert cache.getFrame('a.avi', frame)[0, 0] == frame
+    source = cache.get('a.avi').source()
+    assert source.seeks == 1 and source.reads == 10
+
+    # Stepping back is answered from the buffer, skipping forward decodes forward
+    assert cache.getFrame('a.avi', 7)[0, 0] == 7
+    assert cache.getFrame('a.avi', 12)[0, 0] == 12
+    assert source.seeks == 1 and source.reads == 13
+
+    # Jumping seeks
+    assert cache.getFrame('a.avi', 50)[0, 0] == 50
+    assert cache.getFrame('a.avi', 2)[0, 0] == 2
+    assert source.seeks == 3
+    assert cache.getFrame('a.avi', 100) is None
+
+
+def test_source_limit():
+    del CountingVideoSource.opened[:]
+    cache = VideoSourceCache(max_sources=2, buffer_size=4, open_source=CountingVideoSource)
+    cache.getFrame('a.avi', 0)
+    cache.getFrame('b.avi', 0)
+    cache.getFrame('a.avi', 1)
+    cache.getFrame('c.avi', 0)
+    assert len(cache) == 2
+    assert 'b.avi' not in cache
+    assert [s.closed for s in CountingVideoSource.opened] == [False, True, False]
+    cache.close()
+    assert all(s.closed for s in CountingVideoSource.opened)
+
+
+def writeSequence(tmpdir, numbers):
+    from PIL import Image
+    for number in numbers:
+        image = np.full((4, 6), number, dtype=np.uint8)
+        Image.fromarray(image).save(str(tmpdir.join('img%04d.png' % number)))
+    tmpdir.join('img.txt').write('')
+
+
+def test_image_sequence(tmpdir):
+    writeSequence(tmpdir, [1, 2, 3, 5, 10, 11])
+    pattern = str(tmpdir.join('img%04d.png'))
+    source = ImageSequenceSource(pattern, threads=3)
+    assert source.numFrames() == 6
+    assert source.timestamps()[:2] == [0.0, 1 / ImageSequenceSource.fps]
+    assert source.seek(0)
+    assert [source.read()[0, 0] for i in range(6)] == [1, 2, 3, 5, 10, 11]
+    assert source.read() is None
+    assert source.seek(4) and source.read()[0, 0] == 10
+    assert not source.seek(6)
+    source.close()
+
+    backend = VideoSourceFactory([('*%*', ImageSequenceSource), ('*', VideoSource)]).backend(pattern)
+    assert backend is ImageSequenceSource
+
+
+def test_container_loads_sequence_frames(tmpdir):
+    writeSequence(tmpdir, range(20))
+    labelfile = str(tmpdir.join('labels.json'))
+    container = JsonContainer()
+    container.save([], labelfile)
+    container.load(labelfile)
+    frames = [container.loadFrame('img%04d.png', n) for n in (3, 4, 5, 7)]
+    assert [frame[0, 0] for frame in frames] == [3, 4, 5, 7]
+    assert container.videoSources().get(str(tmpdir.join('img%04d.png'))).seeks == 1